@@ -1,15 +1,65 @@
+import os
+import time
+from typing import Optional
+
 import awkward as ak
+import numpy as np
 from coffea import processor
 from coffea.processor import Accumulatable, defaultdict_accumulator, dict_accumulator
 
+from hzupsilonphoton.chunk_cache import ChunkCache, chunk_key
 from hzupsilonphoton.events import Events
-from hzupsilonphoton.forward_events import forward_events
-from hzupsilonphoton.utils import fill_cutflow, save_dimuon_masses, save_events
+from hzupsilonphoton.forward_events import preselection_sequence, profiles
+from hzupsilonphoton.output_writer import chunk_id, output_writer
+from hzupsilonphoton.regions import (
+    Region,
+    default_regions,
+    fill_region_histogram,
+    region_histogram,
+    region_indices,
+)
+from hzupsilonphoton.skim import load_skim, save_skim, skim_filename
+from hzupsilonphoton.utils import (
+    fill_cutflow,
+    save_dimuon_masses,
+    save_event_index,
+    save_events,
+)
 
 
 class Analyzer(processor.ProcessorABC):  # type: ignore
-    def __init__(self) -> None:
-        self._accumulator = dict_accumulator({})
+    def __init__(
+        self,
+        profile: bool = False,
+        candidate_builder: str = "awkward",
+        regions: Optional[list[Region]] = None,
+        skim_dir: Optional[str] = None,
+        cache: Optional[ChunkCache] = None,
+        background_output: bool = True,
+    ) -> None:
+        """If `profile`, the processing time of each stage is added to the output, under `stage_timings`.
+
+        `candidate_builder` is the backend of the dimuon and boson candidate builders (see `events.CANDIDATE_BUILDERS`).
+        `regions` are the analysis regions filled from the same forwarded events (default: the ones of the config).
+        If `skim_dir` is given, preselected events are cached there (see `skim`): chunks already skimmed with the same
+        upstream code and configuration start from their skim, the others are skimmed on the way.
+        With a `cache`, the results (accumulator and output files) of each chunk are memoized (see `chunk_cache`).
+        With `background_output`, output files are written by a background thread of the worker (see `output_writer`),
+        while it goes on with its chunks: the write errors (per file) are added to the output, under `write_errors`, and the
+        files are only complete after `output_writer.flush_output_writers`.
+        """
+        self._accumulator = dict_accumulator(
+            {
+                "regions": region_histogram(),
+                "write_errors": defaultdict_accumulator(str),
+            }
+        )
+        self.profile = profile
+        self.candidate_builder = candidate_builder
+        self.regions = default_regions if regions is None else regions
+        self.skim_dir = skim_dir
+        self.cache = cache
+        self.background_output = background_output
 
     @property
     def accumulator(self) -> Accumulatable:
@@ -17,155 +67,163 @@ class Analyzer(processor.ProcessorABC):  # type: ignore
 
     # we will receive NanoEvents
     def process(self, events: ak.Array) -> Accumulatable:
-
-        # Forward events over the defined analysis workflow
-        evts = forward_events(Events(events))
-
-        # Fill cutflow
-        systematics_variations = evts.weights.systematics_names + ["nominal"]
-        for variation in systematics_variations:
-            cutflow_dict = dict_accumulator(
-                {
-                    "total": defaultdict_accumulator(float),
-                    "preselected": defaultdict_accumulator(float),
-                    "selected": defaultdict_accumulator(float),
-                    "mass_window": defaultdict_accumulator(float),
-                }
+        key = chunk_key(events.metadata) if self.cache else None
+        if key is None:
+            return self.process_chunk(events)[0]
+
+        start = time.perf_counter()
+        output = self.cache.get(key, "outputs/buffer")
+        if output is not None:
+            if self.profile:
+                output["stage_timings"] = defaultdict_accumulator(float)
+                output["stage_timings"]["chunk_cache"] += time.perf_counter() - start
+            return output
+
+        output, output_files = self.process_chunk(events)
+        # the output files are cached once written
+        self.wait_for_files(output, output_files)
+        if not output["write_errors"]:
+            self.cache.put(
+                key,
+                dict_accumulator(
+                    {
+                        k: v
+                        for k, v in output.items()
+                        if k not in ["stage_timings", "write_errors"]
+                    }
+                ),
+                output_files,
             )
+        return output
+
+    def wait_for_files(self, output: Accumulatable, output_files: list[str]) -> None:
+        """Wait for `output_files` to be written (if in the background), adding the write errors to `output`."""
+        if self.background_output:
+            writer = output_writer()
+            writer.wait(output_files)
+            output["write_errors"].update(writer.errors())
+
+    def process_chunk(self, events: ak.Array) -> tuple[Accumulatable, list[str]]:
+        """Accumulator and output files of `events`."""
+        output = self.accumulator.identity()
+        output_files = []
+        writer = output_writer() if self.background_output else None
+        # output files are named after the chunk, so that a chunk run again replaces them
+        chunk = chunk_id(events.metadata)
+
+        # Forward events over the signal analysis workflow
+        evts = self.forward(events)
+
+        # Select the events of each region
+        with evts.timed("regions"):
+            indices = {
+                region.name: region_indices(evts, region) for region in self.regions
+            }
+
+        # Fill cutflows and histograms of all regions
+        with evts.timed("cutflow"):
+            self.fill_regions(output, evts, indices)
 
-            # Add total number of events
-            fill_cutflow(
-                accumulator=cutflow_dict,
-                evts=evts,
-                key="total",
-                variation=variation,
-                list_of_weights=["pileup", "generator"],
-                list_of_filters=["lumisection"],
+        # Save dimuon masses
+        if evts.data_or_mc == "data":
+            with evts.timed("dimuon_masses"):
+                dimuons_mass_filename = save_dimuon_masses(
+                    evts=evts,
+                    list_of_dimuons_mass_filters=[
+                        "lumisection",
+                        "mc_sample",
+                        "trigger",
+                        "n_muons",
+                        "n_photons",
+                        "n_dimuons",
+                    ],
+                    writer=writer,
+                    chunk=chunk,
+                )
+            output_files.append(dimuons_mass_filename)
+
+        # Save kinematical information (and index) of the events of the regions with an output (preselected and selected events)
+        for region in self.regions:
+            if region.output:
+                with evts.timed(region.output):
+                    output_files.append(
+                        save_events(
+                            evts=evts,
+                            prefix=region.output,
+                            selection_filter=indices[region.name],
+                            writer=writer,
+                            chunk=chunk,
+                        )
+                    )
+                    # index of the saved events, to get back to their NanoAOD records (see `pick_events`)
+                    output_files.append(
+                        save_event_index(
+                            evts=evts,
+                            prefix=region.output,
+                            selection_filter=indices[region.name],
+                            metadata=events.metadata,
+                            writer=writer,
+                        )
+                    )
+
+        if writer:
+            # errors of the files written so far by this worker (of this chunk or earlier ones)
+            output["write_errors"].update(writer.errors())
+
+        if self.profile:
+            output["stage_timings"] = defaultdict_accumulator(float)
+            for stage, seconds in evts.timings.items():
+                output["stage_timings"][stage] += seconds
+
+        return output, output_files
+
+    def forward(self, events: ak.Array) -> Events:
+        """Forward `events` over the signal analysis workflow, from (or saving) their preselection skim if `skim_dir` is set."""
+        skim = skim_filename(self.skim_dir, events.metadata) if self.skim_dir else None
+        if skim is None:
+            return profiles["signal"](Events(events, self.candidate_builder))
+
+        if os.path.isfile(skim):
+            start = time.perf_counter()
+            evts = load_skim(skim, self.candidate_builder)
+            evts.timings["load_skim"] += time.perf_counter() - start
+        else:
+            evts = preselection_sequence(Events(events, self.candidate_builder))
+            with evts.timed("save_skim"):
+                save_skim(evts, skim)
+        return profiles["skimmed"](evts)
+
+    def fill_regions(
+        self, output: Accumulatable, evts: Events, indices: dict[str, np.ndarray]
+    ) -> None:
+        """Fill the cutflows (`cutflow_<variation>`, one entry per region) and the histograms (`regions`) of all regions.
+
+        Both are filled from the same gather of the weights of each region, at its event `indices` (see `region_indices`).
+        """
+        cutflows = {
+            variation: dict_accumulator(
+                {region.name: defaultdict_accumulator(float) for region in self.regions}
             )
-
-            # Add number of preselected events
-            fill_cutflow(
-                accumulator=cutflow_dict,
-                evts=evts,
-                key="preselected",
-                variation=variation,
-                list_of_weights=[
-                    "pileup",
-                    "generator",
-                    "l1_prefiring",
-                    "muon_id",
-                    "muon_iso",
-                    "photon_id",
-                    "photon_electron_veto",
-                ],
-                list_of_filters=[
-                    "lumisection",
-                    "trigger",
-                    "n_muons",
-                    "n_photons",
-                    "n_dimuons",
-                    "n_bosons",
-                ],
+            for variation in evts.weights.variation_names
+        }
+        for region in self.regions:
+            weights = evts.weights.variation_weights(
+                include=region.weights or evts.weights.weights_names,
+                mask=indices[region.name],
             )
-
-            # Add number of selected events
             fill_cutflow(
-                accumulator=cutflow_dict,
-                evts=evts,
-                key="selected",
-                variation=variation,
-                list_of_weights=[
-                    "pileup",
-                    "generator",
-                    "l1_prefiring",
-                    "muon_id",
-                    "muon_iso",
-                    "photon_id",
-                    "photon_electron_veto",
-                ],
-                list_of_filters=[
-                    "lumisection",
-                    "trigger",
-                    "n_muons",
-                    "n_photons",
-                    "n_dimuons",
-                    "n_bosons",
-                    "signal_selection",
-                ],
+                accumulator=cutflows, evts=evts, key=region.name, weights=weights
             )
-
-            # Add number of events within mass_window
-            fill_cutflow(
-                accumulator=cutflow_dict,
+            fill_region_histogram(
+                histogram=output["regions"],
                 evts=evts,
-                key="mass_window",
-                variation=variation,
-                list_of_weights=[
-                    "pileup",
-                    "generator",
-                    "l1_prefiring",
-                    "muon_id",
-                    "muon_iso",
-                    "photon_id",
-                    "photon_electron_veto",
-                ],
-                list_of_filters=[
-                    "lumisection",
-                    "trigger",
-                    "n_muons",
-                    "n_photons",
-                    "n_dimuons",
-                    "n_bosons",
-                    "signal_selection",
-                    "mass_selection",
-                ],
+                region=region,
+                mask=indices[region.name],
+                weights=weights,
             )
-            self._accumulator[f"cutflow_{variation}"] = cutflow_dict
-
-        # Save dimuon masses
-        if evts.data_or_mc == "data":
-            save_dimuon_masses(
-                evts=evts,
-                list_of_dimuons_mass_filters=[
-                    "lumisection",
-                    "trigger",
-                    "n_muons",
-                    "n_photons",
-                    "n_dimuons",
-                ],
-            )
-
-        # Save kinematical information of preselected events
-        save_events(
-            evts=evts,
-            prefix="preselected_events",
-            list_of_filters=[
-                "lumisection",
-                "trigger",
-                "n_muons",
-                "n_photons",
-                "n_dimuons",
-                "n_bosons",
-            ],
-        )
-
-        # Save kinematical information of selected events
-        save_events(
-            evts=evts,
-            prefix="selected_events",
-            list_of_filters=[
-                "lumisection",
-                "trigger",
-                "n_muons",
-                "n_photons",
-                "n_dimuons",
-                "n_bosons",
-                "signal_selection",
-                "mass_selection",
-            ],
-        )
 
-        return self.accumulator
+        for variation, cutflow_dict in cutflows.items():
+            output[f"cutflow_{variation}"] = cutflow_dict
 
     def postprocess(self, accumulator: Accumulatable) -> Accumulatable:
         return accumulator
@@ -0,0 +1,39 @@
+import awkward as ak
+from coffea import processor
+from coffea.processor import Accumulatable, dict_accumulator
+
+from hzupsilonphoton.cut_optimization import (
+    fill_scan_histogram,
+    scan_histogram,
+    significance_maps,
+)
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.forward_events import profiles
+
+
+class Analyzer_Scan(processor.ProcessorABC):  # type: ignore
+    """Cut optimization scan: histograms of the signal selection variables, from which all the thresholds of the grid are evaluated at once."""
+
+    def __init__(self) -> None:
+        self._accumulator = dict_accumulator({"scan": scan_histogram()})
+
+    @property
+    def accumulator(self) -> Accumulatable:
+        return self._accumulator
+
+    # we will receive NanoEvents
+    def process(self, events: ak.Array) -> Accumulatable:
+
+        output = self.accumulator.identity()
+
+        # Forward events over the signal analysis workflow
+        evts = profiles["signal"](Events(events))
+
+        fill_scan_histogram(output["scan"], evts)
+
+        return output
+
+    def postprocess(self, accumulator: Accumulatable) -> Accumulatable:
+        """Add the yields and significances of every grid point (see `cut_optimization.significance_maps`) under `maps`."""
+        accumulator["maps"] = significance_maps(accumulator["scan"].histogram)
+        return accumulator
@@ -1,15 +1,26 @@
 import awkward as ak
 from coffea import processor
-from coffea.processor import Accumulatable, defaultdict_accumulator, dict_accumulator
+from coffea.processor import Accumulatable, dict_accumulator
 
 from hzupsilonphoton.events import Events
-from hzupsilonphoton.forward_events import forward_events
-from hzupsilonphoton.utils import save_events_trigg
+from hzupsilonphoton.forward_events import profiles
+from hzupsilonphoton.trigger_efficiency import (
+    PROBES,
+    efficiency_histogram,
+    efficiency_maps,
+    fill_efficiency_histogram,
+)
+from hzupsilonphoton.trigger_matching import match_muons, match_photons
+
+# trigger object matching of each probe
+matchers = {"probe_muon": match_muons, "probe_photon": match_photons}
 
 
 class Analyzer_Trigg(processor.ProcessorABC):  # type: ignore
     def __init__(self) -> None:
-        self._accumulator = dict_accumulator({})
+        self._accumulator = dict_accumulator(
+            {probe: efficiency_histogram(probe) for probe in PROBES}
+        )
 
     @property
     def accumulator(self) -> Accumulatable:
@@ -18,26 +29,29 @@ class Analyzer_Trigg(processor.ProcessorABC):  # type: ignore
     # we will receive NanoEvents
     def process(self, events: ak.Array) -> Accumulatable:
 
-        # Forward events over the defined analysis workflow
-        evts = forward_events(Events(events))
-
-        # Save kinematical information of selected events
-        save_events_trigg(
-            evts=evts,
-            prefix="selected_events",
-            list_of_filters=[
-                "lumisection",
-                "trigger",
-                "n_muons",
-                "n_photons",
-                "n_dimuons",
-                "n_bosons",
-                "signal_selection",
-                "mass_selection",
-            ],
-        )
+        output = self.accumulator.identity()
+
+        # Forward events over the trigger study workflow
+        evts = profiles["trigger"](Events(events))
+
+        # Fill passed and total probes histograms
+        event_filter = evts.filters.all("lumisection", "n_tag_muons")
+        for probe in PROBES:
+            fill_efficiency_histogram(
+                histogram=output[probe],
+                evts=evts,
+                probe=probe,
+                passed=matchers[probe](
+                    evts.events[probe], evts.events.TrigObjs
+                ).matched,
+                event_filter=event_filter,
+            )
 
-        return self.accumulator
+        return output
 
     def postprocess(self, accumulator: Accumulatable) -> Accumulatable:
+        """Add the trigger efficiency and scale factor maps of each probe (see `trigger_efficiency.efficiency_maps`) under `maps`."""
+        accumulator["maps"] = {
+            probe: efficiency_maps(accumulator[probe].histogram) for probe in PROBES
+        }
         return accumulator
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+import awkward as ak
+import numpy as np
+from coffea.processor import dict_accumulator
+
+from hzupsilonphoton import compiled_builders
+from hzupsilonphoton.analyzer import Analyzer
+from hzupsilonphoton.builders import (
+    build_best_candidate,
+    build_bosons_combination,
+    build_dimuons,
+    build_good_muons,
+)
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.filters import signal_selection_filter
+from hzupsilonphoton.forward_events import forward_events
+from hzupsilonphoton.output_writer import OutputFormat, read_tree, write_trees
+from hzupsilonphoton.regions import (
+    default_regions,
+    region_histogram,
+    region_indices,
+    region_mask,
+)
+from hzupsilonphoton.scale_factors.muon_sf import muon_id_weights
+from hzupsilonphoton.scale_factors.pu_weight import pu_weights
+from hzupsilonphoton.synthetic import synthetic_events
+from hzupsilonphoton.utils import events_buffer, fill_cutflow
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    chunk_size: int
+    seconds: float
+    events_per_second: float
+    peak_allocated_mb: float
+
+
+class Benchmark(NamedTuple):
+    """A function to be timed, and the sequence of `forward_events` up to which (exclusive) the events should be forwarded before."""
+
+    name: str
+    until: Optional[str]
+    function: Callable[[Events], Any]
+
+
+def _fill_cutflow(evts: Events) -> None:
+    fill_cutflow(
+        accumulator={
+            variation: {"mass_window": {}} for variation in evts.weights.variation_names
+        },
+        evts=evts,
+        key="mass_window",
+        weights=evts.weights.variation_weights(
+            include=evts.weights.weights_names,
+            mask=evts.filters.all(
+                "lumisection",
+                "mc_sample",
+                "trigger",
+                "n_muons",
+                "n_photons",
+                "n_dimuons",
+                "n_bosons",
+                "signal_selection",
+                "mass_selection",
+            ),
+        ),
+    )
+
+
+def _fill_regions(evts: Events) -> None:
+    indices = {region.name: region_indices(evts, region) for region in default_regions}
+    Analyzer().fill_regions(
+        dict_accumulator({"regions": region_histogram()}), evts, indices
+    )
+
+
+benchmarks = [
+    Benchmark("build_good_muons", "good_muons", build_good_muons),
+    Benchmark("build_dimuons", "dimuons", build_dimuons),
+    Benchmark("build_dimuons[numba]", "dimuons", compiled_builders.build_dimuons),
+    Benchmark("build_best_candidate", "best_candidate", build_best_candidate),
+    Benchmark(
+        "build_best_candidate[numba]",
+        "best_candidate",
+        compiled_builders.build_best_candidate,
+    ),
+    Benchmark(
+        "build_bosons_combination", "bosons_combinations", build_bosons_combination
+    ),
+    Benchmark("signal_selection_filter", "signal_selection", signal_selection_filter),
+    Benchmark(
+        "pu_weights",
+        "pileup",
+        lambda evts: pu_weights(evts.events.Pileup.nTrueInt, evts.year, "nominal"),
+    ),
+    Benchmark(
+        "muon_id_weights",
+        "muon_id",
+        lambda evts: muon_id_weights(
+            evts.events.bosons_combinations["0"]["0"],
+            evts.events.bosons_combinations["0"]["1"],
+            evts.year,
+            "nominal",
+        ),
+    ),
+    Benchmark("fill_cutflow", None, _fill_cutflow),
+    Benchmark("fill_regions", None, _fill_regions),
+]
+
+
+@contextlib.contextmanager
+def scratch_workdir(weighted_sum_of_events: dict[str, float]) -> Iterator[str]:
+    """Run from a temporary working directory, with `data` and `config` linked from the current one.
+
+    Its `outputs/gen_output.json` holds the given `weighted_sum_of_events` (per dataset),
+    so the analysis code can run without touching the real outputs.
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="hzupsilonphoton_") as workdir:
+        for d in ["data", "config"]:
+            os.symlink(os.path.join(cwd, d), os.path.join(workdir, d))
+        os.makedirs(os.path.join(workdir, "outputs", "buffer"))
+        with open(os.path.join(workdir, "outputs", "gen_output.json"), "w") as f:
+            json.dump({"weighted_sum_of_events": weighted_sum_of_events}, f)
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(cwd)
+
+
+def gen_weighted_sums(events: ak.Array) -> dict[str, float]:
+    """Sum of generator weights of `events`, as in the `weighted_sum_of_events` entry of `outputs/gen_output.json`."""
+    if "genWeight" not in events.fields:
+        return {}
+    return {events.metadata["dataset"]: float(np.sum(events.genWeight))}
+
+
+def prepare_events(
+    events: ak.Array, until: Optional[str], candidate_builder: str = "awkward"
+) -> Events:
+    """Forward events over `forward_events`, stopping right before the sequence named `until` (`None` runs all of them)."""
+    evts = Events(events, candidate_builder)
+    for seq in forward_events.leaves():
+        if seq.name == until:
+            break
+        evts = seq(evts=evts, from_register=False)
+    return evts
+
+
+def run_benchmark(
+    benchmark: Benchmark, events: ak.Array, repeats: int = 3
+) -> BenchmarkResult:
+    """Time `benchmark` over `events` (best of `repeats`, after one warm-up call that also loads the needed columns).
+
+    Allocations are the peak of memory traced by `tracemalloc` during one extra call (numpy buffers are traced, awkward kernels' internal buffers are not).
+    """
+    evts = prepare_events(events, benchmark.until)
+    benchmark.function(evts)
+
+    # derived kinematics are cached per chunk: compute them again on each call
+    timings = []
+    for _ in range(repeats):
+        evts.clear_kinematics()
+        start = time.perf_counter()
+        benchmark.function(evts)
+        timings.append(time.perf_counter() - start)
+
+    evts.clear_kinematics()
+    tracemalloc.start()
+    benchmark.function(evts)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    seconds = min(timings)
+    return BenchmarkResult(
+        name=benchmark.name,
+        chunk_size=len(events),
+        seconds=seconds,
+        events_per_second=len(events) / seconds if seconds > 0 else float("inf"),
+        peak_allocated_mb=peak / 1024**2,
+    )
+
+
+def run_benchmarks(
+    chunk_sizes: list[int],
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    repeats: int = 3,
+    names: Optional[list[str]] = None,
+) -> list[BenchmarkResult]:
+    """Run the micro-benchmark suite over synthetic events of `dataset`, for each chunk size."""
+    events = synthetic_events(max(chunk_sizes), dataset=dataset)
+    results = []
+    with scratch_workdir(gen_weighted_sums(events)):
+        for benchmark in benchmarks:
+            if names and benchmark.name not in names:
+                continue
+            for chunk_size in chunk_sizes:
+                results.append(run_benchmark(benchmark, events[:chunk_size], repeats))
+    return results
+
+
+# objects (and their fields) compared between candidate builders backends
+CANDIDATE_OBJECTS = {
+    "dimuons": [],
+    "best_candidate": ["0", "1"],
+    "mu_1": ["pt", "eta", "phi", "mass", "charge"],
+    "mu_2": ["pt", "eta", "phi", "mass", "charge"],
+    "photon": ["pt", "eta", "phi", "mass"],
+    "upsilon": ["x", "y", "z", "t", "charge", "pt", "eta", "phi", "mass"],
+    "boson": ["x", "y", "z", "t", "charge", "pt", "eta", "phi", "mass"],
+}
+
+
+def _flat_bytes(array: ak.Array) -> bytes:
+    return ak.to_numpy(ak.flatten(array, axis=None)).tobytes()
+
+
+def compare_candidate_builders(
+    n_events: int = 100_000,
+    datasets: list[str] = [
+        "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+        "Run2018A_2018",
+    ],
+    candidate_builder: str = "numba",
+) -> list[str]:
+    """Compare, bit-for-bit, the candidates from the `candidate_builder` backend to the awkward ones, over synthetic events.
+
+    Returns the list of differences (empty if the backends agree).
+    """
+    differences = []
+    for dataset in datasets:
+        events = synthetic_events(n_events, dataset=dataset)
+        with scratch_workdir(gen_weighted_sums(events)):
+            # objects are added in place to the events array: forward independent views of it
+            reference = prepare_events(events[:], None, "awkward")
+            candidate = prepare_events(events[:], None, candidate_builder)
+
+        for name, fields in CANDIDATE_OBJECTS.items():
+            ref_objects = reference.events[name]
+            objects = candidate.events[name]
+            if not ak.all(ak.num(ref_objects) == ak.num(objects)):
+                differences.append(f"{dataset}: {name}: different multiplicities")
+                continue
+            if name == "dimuons":
+                ref_objects = ak.zip(
+                    {"0": ref_objects["0"].pt, "1": ref_objects["1"].pt}
+                )
+                objects = ak.zip({"0": objects["0"].pt, "1": objects["1"].pt})
+                fields = ["0", "1"]
+            for field in fields:
+                if _flat_bytes(getattr(ref_objects, field)) != _flat_bytes(
+                    getattr(objects, field)
+                ):
+                    differences.append(f"{dataset}: {name}.{field}: values differ")
+
+        for name in ["n_dimuons", "n_bosons", "signal_selection", "mass_selection"]:
+            if not np.array_equal(
+                reference.filters.all(name), candidate.filters.all(name)
+            ):
+                differences.append(f"{dataset}: {name}: filter differs")
+
+    return differences
+
+
+class OutputFormatResult(NamedTuple):
+    format: str
+    n_events: int
+    size_mb: float
+    write_seconds: float
+    read_seconds: float
+    error: Optional[str] = None
+
+
+# output formats compared by `run_output_format_benchmarks` (each of them also with float32 columns)
+OUTPUT_FORMATS = [
+    OutputFormat("root", None, None),
+    OutputFormat("root", "ZLIB", 1),
+    OutputFormat("root", "ZLIB", 6),
+    OutputFormat("root", "LZ4", 4),
+    OutputFormat("root", "ZSTD", 5),
+    OutputFormat("parquet", None, None),
+    OutputFormat("parquet", "snappy", None),
+    OutputFormat("parquet", "zstd", 3),
+    OutputFormat("arrow", None, None),
+    OutputFormat("arrow", "lz4", None),
+    OutputFormat("arrow", "zstd", 3),
+]
+
+
+def run_output_format_benchmark(
+    output_format: OutputFormat,
+    buffer: dict[str, Any],
+    directory: str,
+    repeats: int = 3,
+) -> OutputFormatResult:
+    """Time (best of `repeats`) the writing and reading of the saved events `buffer` in `output_format`, and measure the file size."""
+    filename = os.path.join(directory, f"events{output_format.extension}")
+    n_events = len(buffer["weight"])
+    try:
+        write_seconds = []
+        read_seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            write_trees(filename, {"Events": buffer}, output_format)
+            write_seconds.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            read_tree(filename, output_format)
+            read_seconds.append(time.perf_counter() - start)
+    except Exception as exc:
+        # e.g. missing codec or pyarrow
+        return OutputFormatResult(output_format.name, n_events, 0, 0, 0, repr(exc))
+    return OutputFormatResult(
+        output_format.name,
+        n_events,
+        os.path.getsize(filename) / 1024**2,
+        min(write_seconds),
+        min(read_seconds),
+    )
+
+
+def run_output_format_benchmarks(
+    n_events: int = 100_000,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    region: str = "preselected",
+    repeats: int = 3,
+    output_formats: list[OutputFormat] = OUTPUT_FORMATS,
+) -> list[OutputFormatResult]:
+    """Write and read the saved events of `region` (synthetic events of `dataset`) in each output format, with and without float32 columns."""
+    events = synthetic_events(n_events, dataset=dataset)
+    results = []
+    with scratch_workdir(gen_weighted_sums(events)) as workdir:
+        evts = prepare_events(events, None)
+        (selected_region,) = [r for r in default_regions if r.name == region]
+        buffer = events_buffer(evts, region_mask(evts, selected_region))
+        for output_format in output_formats:
+            for float32 in [False, True]:
+                results.append(
+                    run_output_format_benchmark(
+                        output_format._replace(float32=float32),
+                        buffer,
+                        workdir,
+                        repeats,
+                    )
+                )
+    return results
+
+
+def format_output_format_results(results: list[OutputFormatResult]) -> str:
+    lines = [
+        f"{'format':<32}{'events':>10}{'size [MB]':>12}{'write [events/s]':>18}{'read [events/s]':>18}"
+    ]
+    for r in results:
+        if r.error:
+            lines.append(f"{r.format:<32}unavailable: {r.error.splitlines()[0]}")
+            continue
+        lines.append(
+            f"{r.format:<32}{r.n_events:>10}{r.size_mb:>12.3f}{r.n_events / r.write_seconds:>18.0f}{r.n_events / r.read_seconds:>18.0f}"
+        )
+    return "\n".join(lines)
+
+
+def format_results(results: list[BenchmarkResult]) -> str:
+    lines = [
+        f"{'benchmark':<28}{'chunk size':>12}{'time [ms]':>12}{'events/s':>14}{'peak alloc. [MB]':>18}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r.name:<28}{r.chunk_size:>12}{r.seconds * 1e3:>12.2f}{r.events_per_second:>14.0f}{r.peak_allocated_mb:>18.2f}"
+        )
+    return "\n".join(lines)
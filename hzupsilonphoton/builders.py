@@ -1,73 +1,84 @@
+from __future__ import annotations
+
 import awkward as ak
 import numpy as np
-import math as ma
 
 from hzupsilonphoton.events import Events
+from hzupsilonphoton.trigger_matching import match_trigger_objects
 
 
-def build_probe_muon(evts: Events) -> ak.Array:
-    nmuons_filter = ak.num(evts.events.Muon) >= 2  # at least 2 muons
-    muon_pt_filter = False
-    if evts.year==2016
-        muon_pt_filter = evts.events.Muon.pt > 29  # minimum muon pt
-    if evts.year==2017
-        muon_pt_filter = evts.events.Muon.pt > 26  # minimum muon pt
-    if evts.year==2016
-        muon_pt_filter = evts.events.Muon.pt > 29  # minimum muon pt
+def build_tag_muon(evts: Events) -> ak.Array:
+    """Tag muons of the trigger study: identified, isolated muons above the plateau of the single muon trigger of the year, in events firing it, matched to its trigger object."""
+    if evts.year in ["2016APV", "2016"]:
+        single_muon_trigger = evts.events.HLT.IsoMu24 == 1
+        muon_pt_filter = evts.events.Muon.pt > 26  # IsoMu24 plateau
+    if evts.year == "2017":
+        single_muon_trigger = evts.events.HLT.IsoMu27 == 1
+        muon_pt_filter = evts.events.Muon.pt > 29  # IsoMu27 plateau
+    if evts.year == "2018":
+        single_muon_trigger = evts.events.HLT.IsoMu24 == 1
+        muon_pt_filter = evts.events.Muon.pt > 26  # IsoMu24 plateau
     muon_eta_filter = np.absolute(evts.events.Muon.eta) < 2.4  # |eta| < 2.4
-    muon_id_filter = evts.events.Muon.mediumPromptId == 1  # muon id: mediumPromptId   ## check it
-    iso_muon_filter = evts.events.Muon.pfRelIso03_all < 0.15  # PF_Isolation < 0.15    ## check it
+    muon_id_filter = evts.events.Muon.mediumPromptId == 1  # muon id: mediumPromptId
+    iso_muon_filter = evts.events.Muon.pfRelIso03_all < 0.15  # PF_Isolation < 0.15
+    # matched to a single muon (filter bit 8) trigger object
+    trigger_matched_filter = match_trigger_objects(
+        evts.events.Muon, evts.events.TrigObj, trigger_id=13, filter_bits=[8]
+    ).matched
     return evts.events.Muon[
-        nmuons_filter
+        single_muon_trigger
         & muon_eta_filter
         & muon_pt_filter
         & muon_id_filter
         & iso_muon_filter
+        & trigger_matched_filter
     ]
 
-def build_tag_muon(evts: Events) -> ak.Array:
-    n_probe_muons_filter = ak.num(evts.events.probe_muon) >= 2  # at least 2 muons
-    muon_pt_filter = False
-    if evts.year==2016
-        muon_pt_filter = evts.events.Muon.pt > xx  # minimum muon pt
-    if evts.year==2017
-        muon_pt_filter = evts.events.Muon.pt > xx  # minimum muon pt
-    if evts.year==2016
-        muon_pt_filter = evts.events.Muon.pt > xx  # minimum muon pt
+
+def _not_tag(evts: Events, objects: ak.Array) -> ak.Array:
+    """`objects` away (delta R > 0.3) from all the tag muons."""
+    return objects[ak.all(objects.metric_table(evts.events.tag_muon) > 0.3, axis=2)]
+
+
+def build_probe_muon(evts: Events) -> ak.Array:
+    """Probe muons of the trigger study (muon leg of the Mu17_Photon30 trigger): the good muons selection (see `build_good_muons`), but the tag muons."""
     muon_eta_filter = np.absolute(evts.events.Muon.eta) < 2.4  # |eta| < 2.4
-    muon_id_filter = evts.events.Muon.mediumPromptId == 1  # muon id: mediumPromptId   ## check it
-    iso_muon_filter = evts.events.Muon.pfRelIso03_all < 0.15  # PF_Isolation < 0.15    ## check it
-    return evts.events.Muon[
-        n_probe_muons_filter
-        & muon_eta_filter
-        & muon_pt_filter
-        & muon_id_filter
-        & iso_muon_filter
-    ]
+    muon_pt_filter = evts.events.Muon.pt > 5  # minimum muon pt
+    muon_id_filter = evts.events.Muon.mediumPromptId == 1  # muon id: mediumPromptId
+    iso_muon_filter = evts.events.Muon.pfRelIso03_all < 0.15  # PF_Isolation < 0.15
+    return _not_tag(
+        evts,
+        evts.events.Muon[
+            muon_eta_filter & muon_pt_filter & muon_id_filter & iso_muon_filter
+        ],
+    )
+
 
 def build_probe_photon(evts: Events) -> ak.Array:
-    nphotons_filter = ak.num(evts.events.Photon) >= 1  # at lest one photon
-    photon_pt_filter = False
-    if evts.year==2016
-        photon_pt_filter = evts.events.Photon.pt > xx  # minimum photon pt
-    if evts.year==2017
-        photon_pt_filter = evts.events.Photon.pt > xx  # minimum photon pt
-    if evts.year==2016
-        photon_pt_filter = evts.events.Photon.pt > xx  # minimum photon pt
-    photon_eta_filter = np.absolute(evts.events.Photon.eta) < xx  # |eta| < 2.4
-    photon_id_filter = evts.events.Photon.mediumPromptId == xx  # photon id: mediumPromptId   ## check it
-    iso_photon_filter = evts.events.Photon.pfRelIso03_all < xx  # PF_Isolation < 0.15    ## check it
-    return evts.events.Photon[
-        nphotons_filter
-        & photon_eta_filter
-        & photon_pt_filter
-        & photon_id_filter
-        & iso_photon_filter
-    ]
+    """Probe photons of the trigger study (photon leg of the Mu17_Photon30 trigger): the good photons selection (see `build_good_photons`), from 20 GeV to cover the turn-on, away from the tag muons."""
+    photon_eta_filter = np.absolute(evts.events.Photon.eta) < 2.5  # |eta| < 2.5
+    photon_pt_filter = evts.events.Photon.pt > 20  # pt at least 20 GeV
+    photon_sc_eta_filter = (evts.events.Photon.isScEtaEB == 1) | (
+        evts.events.Photon.isScEtaEE == 1
+    )  # is Barrel or Endacap - no "crack photons".
+    photon_electron_veto_filter = evts.events.Photon.electronVeto == 1  # electron veto
+    photon_tight_id_filter = evts.events.Photon.mvaID_WP80 == 1  # MVA (WP: 80)% photon
+    return _not_tag(
+        evts,
+        evts.events.Photon[
+            photon_eta_filter
+            & photon_pt_filter
+            & photon_sc_eta_filter
+            & photon_electron_veto_filter
+            & photon_tight_id_filter
+        ],
+    )
+
 
-def build_TrigObjs(evts: Events) -> ak.Array: #separar em 3?
+def build_TrigObjs(evts: Events) -> ak.Array:  # separar em 3?
     return evts.events.TrigObj
 
+
 def build_good_muons(evts: Events) -> ak.Array:
     nmuons_filter = ak.num(evts.events.Muon) >= 2  # at least 2 muons
     muon_eta_filter = np.absolute(evts.events.Muon.eta) < 2.4  # |eta| < 2.4
@@ -104,49 +115,99 @@ def build_good_photons(evts: Events) -> ak.Array:
         & photon_tight_id_filter
     ]
 
+
 def build_dimuons(evts: Events) -> ak.Array:
+    if evts.candidate_builder == "numba":
+        from hzupsilonphoton import compiled_builders
+
+        return compiled_builders.build_dimuons(evts)
+
     dimuons = ak.combinations(evts.events.good_muons, 2)
     dimuons = dimuons[(dimuons["0"].charge + dimuons["1"].charge == 0)]
 
     return dimuons
 
 
+def _starts(counts: np.ndarray) -> np.ndarray:
+    return np.cumsum(counts) - counts
+
+
+def _flat_px_py(objects: ak.Array) -> tuple[np.ndarray, np.ndarray]:
+    pt = ak.to_numpy(ak.flatten(objects.pt))
+    phi = ak.to_numpy(ak.flatten(objects.phi))
+    return pt * np.cos(phi), pt * np.sin(phi)
+
+
+def build_best_candidate(evts: Events) -> ak.Array:
+    """Indices of the dimuon and photon forming the highest pT boson candidate.
+
+    Instead of building and sorting all the dimuon + photon four-vectors, only the pT^2 of each pair is
+    computed (on the flat transverse momentum components) and the best pair is picked with an argmax.
+    Returns a `{"0": dimuon index, "1": photon index}` record per event (empty list if there is no candidate).
+    """
+    if evts.candidate_builder == "numba":
+        from hzupsilonphoton import compiled_builders
+
+        return compiled_builders.build_best_candidate(evts)
+
+    dimuons = evts.events.dimuons
+    photons = evts.events.good_photons
+    n_dimuons = ak.to_numpy(ak.num(dimuons))
+    n_photons = ak.to_numpy(ak.num(photons))
+    n_pairs = n_dimuons * n_photons
+
+    mu_1_px, mu_1_py = _flat_px_py(dimuons["0"])
+    mu_2_px, mu_2_py = _flat_px_py(dimuons["1"])
+    photons_px, photons_py = _flat_px_py(photons)
+    dimuons_px = mu_1_px + mu_2_px
+    dimuons_py = mu_1_py + mu_2_py
+
+    # flat dimuon and photon indices of every pair, in the same order as ak.cartesian
+    pair_event = np.repeat(np.arange(len(n_pairs)), n_pairs)
+    pair_local = np.arange(np.sum(n_pairs)) - _starts(n_pairs)[pair_event]
+    pair_n_photons = n_photons[pair_event]
+    pair_dimuon = _starts(n_dimuons)[pair_event] + pair_local // pair_n_photons
+    pair_photon = _starts(n_photons)[pair_event] + pair_local % pair_n_photons
+    pairs_pt2 = (dimuons_px[pair_dimuon] + photons_px[pair_photon]) ** 2 + (
+        dimuons_py[pair_dimuon] + photons_py[pair_photon]
+    ) ** 2
+
+    has_candidate = n_pairs > 0
+    best = ak.argmax(ak.unflatten(pairs_pt2, n_pairs), axis=1)
+    best = ak.to_numpy(ak.fill_none(best, 0))[has_candidate]
+    n_best = has_candidate.astype(np.int64)
+    return ak.zip(
+        {
+            "0": ak.unflatten(best // n_photons[has_candidate], n_best),
+            "1": ak.unflatten(best % n_photons[has_candidate], n_best),
+        }
+    )
+
+
 def build_bosons_combination(evts: Events) -> ak.Array:
-    bosons = ak.cartesian( # cominaoes
-        [
-            evts.events.dimuons,
-            evts.events.good_photons,
-        ]
+    return ak.zip(
+        (
+            evts.events.dimuons[evts.events.best_candidate["0"]],
+            evts.events.good_photons[evts.events.best_candidate["1"]],
+        )
     )
-    bosons_pt = (bosons["0"]["0"] + bosons["0"]["1"] + bosons["1"]).pt
-    bosons_combinations = bosons[ak.argsort(bosons_pt, ascending=False)][
-        :, :1
-    ]  # select the boson with highest pT
-    return bosons_combinations
 
 
 def build_boson(evts: Events) -> ak.Array:
-    return (
-        evts.events.bosons_combinations["0"]["0"]
-        + evts.events.bosons_combinations["0"]["1"]
-        + evts.events.bosons_combinations["1"]
-    )
+    return evts.events.upsilon + evts.events.photon
 
 
 def build_mu_1(evts: Events) -> ak.Array:
-    return evts.events.bosons_combinations["0"]["0"]
+    return evts.events.dimuons["0"][evts.events.best_candidate["0"]]
 
 
 def build_mu_2(evts: Events) -> ak.Array:
-    return evts.events.bosons_combinations["0"]["1"]
+    return evts.events.dimuons["1"][evts.events.best_candidate["0"]]
 
 
 def build_upsilon(evts: Events) -> ak.Array:
-    return (
-        evts.events.bosons_combinations["0"]["0"]
-        + evts.events.bosons_combinations["0"]["1"]
-    )
+    return evts.events.mu_1 + evts.events.mu_2
 
 
 def build_photon(evts: Events) -> ak.Array:
-    return evts.events.bosons_combinations["1"]
+    return evts.events.good_photons[evts.events.best_candidate["1"]]
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+import pickle
+import re
+import shutil
+from typing import Any, Optional
+
+import awkward as ak
+import coffea
+import numpy as np
+from coffea.processor import Accumulatable
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.output_writer import temporary_name
+from hzupsilonphoton.polarization import polarization_filename
+from hzupsilonphoton.skim import file_digest
+from samples.lumis import lumis
+from samples.samples_details import samples
+from samples.xsecs import x_section
+
+# to be increased when the content of the cache entries changes
+CACHE_VERSION = 1
+
+# default size cap of the cache, in GB
+DEFAULT_MAX_GB = 20.0
+
+
+def _data_files(year: Optional[str]) -> list[str]:
+    """Input data files of `year` (one of their path components, or file name tokens, is the year), or the ones of no year if `None`."""
+    files = []
+    for root, _, filenames in sorted(os.walk("data", followlinks=True)):
+        for f in sorted(filenames):
+            path = os.path.join(root, f)
+            path_years = set(lumis).intersection(re.split(r"[/_.-]", path))
+            # 2016APV files can also be under 2016 (e.g. pileup profiles)
+            if (
+                (year in path_years or year.replace("APV", "") in path_years)
+                if year
+                else not path_years
+            ):
+                files.append(path)
+    return files
+
+
+@functools.lru_cache(maxsize=None)
+def code_hash() -> str:
+    """Hash of the analysis code, configuration and year independent input data files (shared by all chunks)."""
+    digest = hashlib.sha256()
+    digest.update(
+        f"{CACHE_VERSION} {coffea.__version__} {ak.__version__} {np.__version__}".encode()
+    )
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for root, _, filenames in sorted(os.walk(package_dir)):
+        for f in sorted(filenames):
+            if f.endswith(".py"):
+                digest.update(f.encode())
+                digest.update(file_digest(os.path.join(root, f)).encode())
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    for path in _data_files(None):
+        digest.update(f"{path} {file_digest(path)}".encode())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def year_hash(year: str) -> str:
+    """Hash of the input data files (scale factors, pileup profiles) of `year`."""
+    digest = hashlib.sha256()
+    for path in _data_files(year):
+        digest.update(f"{path} {file_digest(path)}".encode())
+    return digest.hexdigest()
+
+
+def dataset_metadata(dataset: str) -> dict[str, Any]:
+    """What the results of a `dataset` chunk depend on, besides the code: year, cross section, luminosity, sum of generator weights and polarization factors."""
+    year = samples[dataset]["year"]
+    metadata = {
+        "dataset": dataset,
+        "year": year,
+        "data_or_mc": samples[dataset]["data_or_mc"],
+        "year_hash": year_hash(year),
+    }
+    if metadata["data_or_mc"] == "mc":
+        with open("outputs/gen_output.json") as f:
+            weighted_sum_of_events = json.load(f)["weighted_sum_of_events"]
+        metadata.update(
+            {
+                "x_section": x_section(dataset),
+                "lumi": lumis[year],
+                "weighted_sum_of_events": weighted_sum_of_events.get(dataset),
+            }
+        )
+        polarization_file = polarization_filename(dataset)
+        if os.path.isfile(polarization_file):
+            metadata["polarization"] = file_digest(polarization_file)
+    return metadata
+
+
+def chunk_key(metadata: dict[str, Any]) -> Optional[str]:
+    """Content address of the results of the chunk described by (coffea) `metadata`. `None` if the chunk is not from a file."""
+    if "entrystart" not in metadata:
+        return None
+    key = {
+        "code": code_hash(),
+        "file": metadata.get("fileuuid") or metadata["filename"],
+        "treename": metadata.get("treename"),
+        "entrystart": metadata["entrystart"],
+        "entrystop": metadata["entrystop"],
+        **dataset_metadata(metadata["dataset"]),
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def _copy(source: str, filename: str) -> None:
+    """Copy `source` to `filename` under a temporary name, renamed once complete."""
+    temporary_filename = temporary_name(filename)
+    try:
+        shutil.copyfile(source, temporary_filename)
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.isfile(temporary_filename):
+            os.remove(temporary_filename)
+
+
+class ChunkCache:
+    """Per-chunk results (accumulator and output buffer files), stored under `cache_dir/<chunk_key>/`.
+
+    Entries are evicted, least recently used first, when the cache grows beyond `max_gb`.
+    """
+
+    def __init__(self, cache_dir: str, max_gb: float = DEFAULT_MAX_GB) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_gb * 1024**3)
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key: str, output_dir: str) -> Optional[Accumulatable]:
+        """Accumulator of the `key` chunk, its output files being copied (under the same names) to `output_dir`. `None` if not cached."""
+        entry = self._entry(key)
+        copied = []
+        try:
+            with open(os.path.join(entry, "output.pkl"), "rb") as f:
+                output = pickle.load(f)
+            for f in sorted(os.listdir(os.path.join(entry, "files"))):
+                # output files are named after their chunk (see `output_writer.chunk_id`): copied under the same
+                # name, they replace the files of an earlier run of the chunk
+                copied.append(os.path.join(output_dir, f))
+                _copy(os.path.join(entry, "files", f), copied[-1])
+        except FileNotFoundError:
+            # not cached, or evicted by another worker while being read
+            for f in copied:
+                if os.path.isfile(f):
+                    os.remove(f)
+            return None
+        # most recently used
+        os.utime(entry)
+        return output
+
+    def put(self, key: str, output: Accumulatable, files: list[str]) -> None:
+        """Cache the accumulator and output `files` of the `key` chunk (written under a temporary name, then renamed)."""
+        entry = self._entry(key)
+        temporary_entry = f"{entry}.{os.getpid()}.tmp"
+        os.makedirs(os.path.join(temporary_entry, "files"), exist_ok=True)
+        for f in files:
+            shutil.copyfile(
+                f, os.path.join(temporary_entry, "files", os.path.basename(f))
+            )
+        with open(os.path.join(temporary_entry, "output.pkl"), "wb") as f:
+            pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            os.rename(temporary_entry, entry)
+        except OSError:
+            # already cached by another worker
+            shutil.rmtree(temporary_entry, ignore_errors=True)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache is below its size cap."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry = self._entry(key)
+            if key.endswith(".tmp") or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((os.path.getmtime(entry), _directory_size(entry), entry))
+            except FileNotFoundError:
+                # evicted by another worker
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import awkward as ak
+import numba
+import numpy as np
+
+from hzupsilonphoton.builders import _flat_px_py
+from hzupsilonphoton.events import Events
+
+
+@numba.njit(cache=True)  # type: ignore
+def _dimuons_kernel(
+    muons_offsets: np.ndarray, muons_charge: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Opposite charge muon pairs, in the same order as `ak.combinations(muons, 2)`.
+
+    Returns the number of pairs per event and the local indices of first and second muons of each pair.
+    """
+    n_events = len(muons_offsets) - 1
+    n_dimuons = np.zeros(n_events, dtype=np.int64)
+    n_max = 0
+    for event in range(n_events):
+        n = muons_offsets[event + 1] - muons_offsets[event]
+        n_max += n * (n - 1) // 2
+
+    mu_1 = np.empty(n_max, dtype=np.int64)
+    mu_2 = np.empty(n_max, dtype=np.int64)
+    n_total = 0
+    for event in range(n_events):
+        start = muons_offsets[event]
+        n = muons_offsets[event + 1] - start
+        for i in range(n):
+            for j in range(i + 1, n):
+                if muons_charge[start + i] + muons_charge[start + j] == 0:
+                    mu_1[n_total] = i
+                    mu_2[n_total] = j
+                    n_total += 1
+                    n_dimuons[event] += 1
+
+    return n_dimuons, mu_1[:n_total], mu_2[:n_total]
+
+
+@numba.njit(cache=True)  # type: ignore
+def _best_candidate_kernel(
+    muons_offsets: np.ndarray,
+    muons_charge: np.ndarray,
+    muons_px: np.ndarray,
+    muons_py: np.ndarray,
+    photons_offsets: np.ndarray,
+    photons_px: np.ndarray,
+    photons_py: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Single loop over the muons and photons of each event, looking for the highest pT dimuon + photon candidate.
+
+    Dimuons are the opposite charge muon pairs, in the order of `_dimuons_kernel`, and ties go to
+    the first candidate, as in `builders.build_best_candidate`.
+    Returns the number of candidates per event (0 or 1) and the local indices of their dimuon and photon.
+    """
+    n_events = len(muons_offsets) - 1
+    n_best = np.zeros(n_events, dtype=np.int64)
+    best_dimuon = np.empty(n_events, dtype=np.int64)
+    best_photon = np.empty(n_events, dtype=np.int64)
+
+    n = 0
+    for event in range(n_events):
+        muons_start = muons_offsets[event]
+        n_muons = muons_offsets[event + 1] - muons_start
+        photons_start = photons_offsets[event]
+        n_photons = photons_offsets[event + 1] - photons_start
+
+        best_pt2 = -1.0
+        dimuon = 0
+        for i in range(muons_start, muons_start + n_muons):
+            for j in range(i + 1, muons_start + n_muons):
+                if muons_charge[i] + muons_charge[j] != 0:
+                    continue
+                dimuon_px = muons_px[i] + muons_px[j]
+                dimuon_py = muons_py[i] + muons_py[j]
+                for k in range(n_photons):
+                    px = dimuon_px + photons_px[photons_start + k]
+                    py = dimuon_py + photons_py[photons_start + k]
+                    pt2 = px * px + py * py
+                    if pt2 > best_pt2:
+                        best_pt2 = pt2
+                        best_dimuon[n] = dimuon
+                        best_photon[n] = k
+                dimuon += 1
+
+        if best_pt2 >= 0:
+            n_best[event] = 1
+            n += 1
+
+    return n_best, best_dimuon[:n], best_photon[:n]
+
+
+def _offsets(objects: ak.Array) -> np.ndarray:
+    return np.concatenate(([0], np.cumsum(ak.to_numpy(ak.num(objects)))))
+
+
+def build_dimuons(evts: Events) -> ak.Array:
+    """Same as `builders.build_dimuons`, with the opposite charge pairs found by a compiled loop."""
+    muons = evts.events.good_muons
+    n_dimuons, mu_1, mu_2 = _dimuons_kernel(
+        _offsets(muons), ak.to_numpy(ak.flatten(muons.charge))
+    )
+    return ak.zip(
+        (
+            muons[ak.unflatten(mu_1, n_dimuons)],
+            muons[ak.unflatten(mu_2, n_dimuons)],
+        )
+    )
+
+
+def build_best_candidate(evts: Events) -> ak.Array:
+    """Same as `builders.build_best_candidate`, from a single compiled loop over the good muons and photons.
+
+    The transverse momentum components are the ones of the awkward path, so both pick the same candidates.
+    """
+    muons = evts.events.good_muons
+    photons = evts.events.good_photons
+    n_best, dimuon, photon = _best_candidate_kernel(
+        _offsets(muons),
+        ak.to_numpy(ak.flatten(muons.charge)),
+        *_flat_px_py(muons),
+        _offsets(photons),
+        *_flat_px_py(photons),
+    )
+    return ak.zip(
+        {"0": ak.unflatten(dimuon, n_best), "1": ak.unflatten(photon, n_best)}
+    )
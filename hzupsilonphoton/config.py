@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import functools
 from typing import Any, Dict
 
 import yaml
@@ -13,7 +14,15 @@ class Configs(Dict[Any, Any]):
         return value
 
 
-with open("config/config.yml") as f:
-    config_dict = yaml.load(f, Loader=yaml.FullLoader)
+@functools.lru_cache(maxsize=None)
+def load_config() -> Configs:
+    """Analysis configuration (`config/config.yml`), parsed on first use."""
+    with open("config/config.yml") as f:
+        return Configs(yaml.load(f, Loader=yaml.FullLoader))
 
-config = Configs(config_dict)
+
+def __getattr__(name: str) -> Any:
+    # `config` is loaded on first use, not at import time
+    if name == "config":
+        return load_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
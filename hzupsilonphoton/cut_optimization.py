@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from typing import Any
+
+import awkward as ak
+import hist
+import numpy as np
+import uproot
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.hist_accumulator import HistAccumulator
+from samples.samples_details import samples
+
+# selection variables of the scan: arguments of `Events.kinematics`
+SCAN_VARIABLES = {
+    "delta_eta_upsilon_photon": ("delta_eta", "upsilon", "photon"),
+    "delta_phi_upsilon_photon": ("delta_phi", "upsilon", "photon"),
+    "delta_r_upsilon_photon": ("delta_r", "upsilon", "photon"),
+    "upsilon_pt": ("pt", "upsilon"),
+}
+
+# events scanned: mass window, before the signal selection
+SCAN_FILTERS = [
+    "lumisection",
+    "mc_sample",
+    "trigger",
+    "n_muons",
+    "n_photons",
+    "n_dimuons",
+    "n_bosons",
+    "mass_selection",
+]
+
+
+def thresholds(variable: str) -> np.ndarray:
+    grid = config.cut_optimization.variables[variable]
+    # rounded, so that thresholds are the ones of the config (e.g. 1.6 and not 1.5999999999999999)
+    return np.round(np.linspace(grid["min"], grid["max"], grid["n"]), 9)
+
+
+def scan_histogram() -> HistAccumulator:
+    """Weighted counts of events, per dataset, binned in all the selection variables (bin edges at the thresholds of the grid)."""
+    return HistAccumulator(
+        hist.Hist(
+            hist.axis.StrCategory([], growth=True, name="dataset"),
+            *[
+                hist.axis.Variable(thresholds(variable), name=variable)
+                for variable in config.cut_optimization.variables
+            ],
+            storage=hist.storage.Weight(),
+        )
+    )
+
+
+def fill_scan_histogram(histogram: HistAccumulator, evts: Events) -> None:
+    """Fill `histogram` with the (single) candidate of each event of the mass window, with its nominal weight."""
+    event_filter = evts.filters.all(*SCAN_FILTERS)
+    histogram.histogram.fill(
+        dataset=evts.dataset,
+        **{
+            variable: ak.to_numpy(
+                ak.flatten(evts.kinematics(*SCAN_VARIABLES[variable])[event_filter])
+            )
+            for variable in config.cut_optimization.variables
+        },
+        weight=evts.weights.weight()[event_filter],
+    )
+
+
+def yields(counts: np.ndarray) -> np.ndarray:
+    """Yields for every point of the grid of thresholds, from `counts` binned in the selection variables (with flow bins).
+
+    The cut on each variable is a cumulative sum along its axis: from the underflow for upper cuts,
+    from the overflow for lower cuts.
+    """
+    for axis, variable in enumerate(config.cut_optimization.variables):
+        if config.cut_optimization.variables[variable]["cut"] == "upper":
+            # variable < threshold i: underflow and bins up to i - 1
+            counts = np.cumsum(counts, axis=axis)
+            counts = np.delete(counts, -1, axis=axis)
+        else:
+            # variable >= threshold i: bins from i to the overflow
+            counts = np.flip(
+                np.cumsum(np.flip(counts, axis=axis), axis=axis), axis=axis
+            )
+            counts = np.delete(counts, 0, axis=axis)
+    return counts
+
+
+def _group_counts(histogram: hist.Hist, datasets: list[str]) -> np.ndarray:
+    """Sum of the counts of `datasets`, with flow bins."""
+    counts = None
+    for dataset in datasets:
+        view = histogram[{"dataset": dataset}].view(flow=True).value
+        counts = view if counts is None else counts + view
+    return counts
+
+
+def significance_maps(histogram: hist.Hist) -> dict[str, Any]:
+    """Signal and background yields, and significance (`signal / sqrt(background)`), for every point of the grid of thresholds.
+
+    Each signal sums its datasets (config: cut_optimization.signals), the background is the sum of data datasets.
+    """
+    datasets = list(histogram.axes["dataset"])
+    data = [d for d in datasets if samples[d]["data_or_mc"] == "data"]
+    background = yields(_group_counts(histogram, data)) if data else None
+
+    maps: dict[str, Any] = {"background": background}
+    for signal, prefixes in config.cut_optimization.signals.items():
+        signal_datasets = [
+            d for d in datasets if any(d.startswith(prefix) for prefix in prefixes)
+        ]
+        if not signal_datasets:
+            continue
+        maps[signal] = yields(_group_counts(histogram, signal_datasets))
+        if background is not None:
+            maps[f"significance_{signal}"] = np.divide(
+                maps[signal],
+                np.sqrt(background),
+                out=np.zeros_like(maps[signal]),
+                where=background > 0,
+            )
+    return maps
+
+
+def best_thresholds(maps: dict[str, Any], signal: str) -> dict[str, float]:
+    """Thresholds of the grid point with the highest significance for `signal`."""
+    significance = maps[f"significance_{signal}"]
+    best = np.unravel_index(np.argmax(significance), significance.shape)
+    return {
+        **{
+            variable: float(thresholds(variable)[i])
+            for variable, i in zip(config.cut_optimization.variables, best)
+        },
+        "significance": float(significance[best]),
+    }
+
+
+def save_significance_maps(maps: dict[str, Any], output_filename: str) -> None:
+    """Save the maps as a `scan` tree, with one entry per grid point: its thresholds, and the yields and significances."""
+    grid = np.meshgrid(
+        *[thresholds(variable) for variable in config.cut_optimization.variables],
+        indexing="ij",
+    )
+    branches = {
+        variable: values.ravel()
+        for variable, values in zip(config.cut_optimization.variables, grid)
+    }
+    branches.update(
+        {name: values.ravel() for name, values in maps.items() if values is not None}
+    )
+    with uproot.recreate(output_filename) as f:
+        f["scan"] = branches
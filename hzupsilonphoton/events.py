@@ -1,33 +1,145 @@
+from __future__ import annotations
+
+import contextlib
+import time
+from collections import defaultdict
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Union
+
 import awkward as ak
 import numpy as np
 from coffea import analysis_tools
+from coffea.nanoevents.methods.candidate import Candidate
+from numpy.typing import ArrayLike, DTypeLike
 
 from hzupsilonphoton import array_like
 from samples.samples_details import samples
 
+# backends of the dimuon and boson candidate builders
+CANDIDATE_BUILDERS = ["awkward", "numba"]
+
+
+def safe_mass(candidate: Candidate) -> ArrayLike:
+    """Get the mass of a canditate, taking care of negative mass**2 due to NanoAOD precision issues."""
+    squared_mass = candidate.mass2
+    return np.sqrt(ak.where(squared_mass < 0, 0, squared_mass))
+
+
+class ConstantWeight(NamedTuple):
+    """Same weight for all the events of a chunk, without systematic variations (e.g. scale factors of data)."""
+
+    value: float = 1.0
+
 
 class EventWeights(analysis_tools.Weights):  # type: ignore
-    """Extension of analysis_tools.Weights to get weights names and if they are systematics."""
+    """Extension of analysis_tools.Weights to get weights names and if they are systematics.
+
+    The individual weights and the modifiers of the systematic variations are also kept as
+    contiguous matrices (one row per weight or variation, so each of them is contiguous in memory),
+    built once after the last `add`. Partial weights are cached per set of included weights.
+    Constant weights (`add_constant`) are kept as scalars, broadcast when needed.
+    """
 
-    def __init__(self, size: int, storeIndividual: bool = False):
+    def __init__(
+        self, size: int, storeIndividual: bool = False, dtype: DTypeLike = np.float64
+    ):
         super().__init__(size, storeIndividual)
+        self.dtype = np.dtype(dtype)
+        self._constants: dict[str, float] = {}
+        self._clear_cache()
+
+    def _clear_cache(self) -> None:
+        self._partial_weights: dict[frozenset[str], np.ndarray] = {}
+        self._weights_matrix: Optional[np.ndarray] = None
+        self._modifiers_matrix: Optional[np.ndarray] = None
+
+    def add(self, *args: Any, **kwargs: Any) -> None:
+        super().add(*args, **kwargs)
+        self._clear_cache()
+
+    def add_multivariation(self, *args: Any, **kwargs: Any) -> None:
+        super().add_multivariation(*args, **kwargs)
+        self._clear_cache()
+
+    def add_constant(self, name: str, value: float = 1.0) -> None:
+        """Add a weight with the same `value` for all the events, without per-event storage nor variations."""
+        if name.endswith("Up") or name.endswith("Down"):
+            raise ValueError(
+                "Avoid using 'Up' and 'Down' in weight names, instead pass appropriate shifts to add() call"
+            )
+        if value != 1:
+            self._weight = self._weight * value
+        self._constants[name] = value
+        self._weightStats[name] = analysis_tools.WeightStatistics(
+            value * self._weight.size,
+            value**2 * self._weight.size,
+            value,
+            value,
+            self._weight.size,
+        )
+        self._clear_cache()
 
     @property
     def names(self) -> list[str]:
-        list_of_weights_names = list(self._weights.keys()) + list(
-            self._modifiers.keys()
+        list_of_weights_names = (
+            list(self._weights.keys())
+            + list(self._constants.keys())
+            + list(self._modifiers.keys())
         )
         list_of_weights_names.sort()
         return list_of_weights_names
 
     def individual_weight(self, name: str) -> np.ndarray:
-        if name.endswith("Up") or name.endswith("Down"):
-            return (
-                self._weights[name.replace("Up", "").replace("Down", "")]
-                * self._modifiers[name]
-            )
+        if name in self._constants:
+            return _broadcast(self._constants[name], self._weight.size)
+        if name in self._modifiers:
+            return self._weights[_variation_source(name)] * self._modifiers[name]
         return self._weights[name]
 
+    def modifier(self, variation_name: str) -> np.ndarray:
+        if variation_name in self._modifiers:
+            return self._modifiers[variation_name]
+        # missing 'Down' variation, as in `weight`
+        return 1 / self._modifiers[variation_name[: -len("Down")] + "Up"]
+
+    def partial_weight(
+        self, include: list[str] = [], exclude: list[str] = []
+    ) -> np.ndarray:
+        """Same as `analysis_tools.Weights.partial_weight`, computed once per set of weights.
+
+        Weights are multiplied in the order they were added, so the result does not depend on the ordering of a set,
+        then by the constant weights. Without any included per-event weight, this is a read-only broadcast array.
+        """
+        if not self._storeIndividual:
+            raise ValueError(
+                "To be able to request weight exclusion, use storeIndividual=True when creating Weights object."
+            )
+        if (include and exclude) or not (include or exclude):
+            raise ValueError(
+                "Need to specify exactly one of the 'exclude' or 'include' arguments."
+            )
+        names = frozenset(
+            name
+            for name in list(self._weights) + list(self._constants)
+            if (name in include if include else name not in exclude)
+        )
+        if names not in self._partial_weights:
+            weight = None
+            for name in self._weights:
+                if name in names:
+                    if weight is None:
+                        weight = np.array(self._weights[name], dtype=np.float64)
+                    else:
+                        weight *= self._weights[name]
+            constant = np.prod(
+                [value for name, value in self._constants.items() if name in names]
+            )
+            if weight is None:
+                weight = _broadcast(constant, self._weight.size)
+            elif constant != 1:
+                weight *= constant
+            self._partial_weights[names] = weight
+        return self._partial_weights[names]
+
     def partial_weight_with_variation(
         self,
         variation_name: str = "nominal",
@@ -36,20 +148,240 @@ class EventWeights(analysis_tools.Weights):  # type: ignore
     ) -> np.ndarray:
         if variation_name == "nominal":
             return self.partial_weight(include, exclude)
-        return self.partial_weight(include, exclude) * self._modifiers[variation_name]
+        return self.partial_weight(include, exclude) * self.modifier(variation_name)
+
+    @property
+    def weights_names(self) -> list[str]:
+        """Names of the weights (without their variations), in the order they were added."""
+        return list(self._weights.keys()) + list(self._constants.keys())
 
     @property
     def systematics_names(self) -> list[str]:
-        return list(self.variations)
+        return sorted(self.variations)
+
+    @property
+    def variation_names(self) -> list[str]:
+        """Columns of `variation_weights`: nominal, then the systematics."""
+        return ["nominal"] + self.systematics_names
+
+    def _weights_rows(self) -> np.ndarray:
+        if self._weights_matrix is None:
+            self._weights_matrix = _stack(
+                [self.individual_weight(name) for name in self.names],
+                self._weight.size,
+                self.dtype,
+            )
+        return self._weights_matrix
+
+    def _modifiers_rows(self) -> np.ndarray:
+        if self._modifiers_matrix is None:
+            self._modifiers_matrix = _stack(
+                [_broadcast(1.0, self._weight.size)]
+                + [self.modifier(name) for name in self.systematics_names],
+                self._weight.size,
+                self.dtype,
+            )
+        return self._modifiers_matrix
+
+    @property
+    def weights_matrix(self) -> np.ndarray:
+        """Events x `names` matrix of the individual weights (a view of a matrix stored one weight per row)."""
+        return self._weights_rows().T
+
+    @property
+    def modifiers_matrix(self) -> np.ndarray:
+        """Events x `variation_names` matrix of the modifiers (a view of a matrix stored one variation per row)."""
+        return self._modifiers_rows().T
+
+    def to_columns(self) -> tuple[dict[str, np.ndarray], dict[str, float]]:
+        """Per-event columns (`weight`, `weight_<name>` and `modifier_<variation>`) and constant weights, from which `from_columns` rebuilds these weights."""
+        columns = {"weight": self._weight}
+        columns.update({f"weight_{name}": w for name, w in self._weights.items()})
+        columns.update({f"modifier_{name}": m for name, m in self._modifiers.items()})
+        return columns, dict(self._constants)
+
+    @classmethod
+    def from_columns(
+        cls, columns: dict[str, np.ndarray], constants: dict[str, float]
+    ) -> EventWeights:
+        """Weights saved by `to_columns` (columns in the same order). Weight statistics are not restored."""
+        weights = cls(size=len(columns["weight"]), storeIndividual=True)
+        weights._weight = columns["weight"]
+        for column, values in columns.items():
+            if column.startswith("weight_"):
+                weights._weights[column[len("weight_") :]] = values
+            elif column.startswith("modifier_"):
+                weights._modifiers[column[len("modifier_") :]] = values
+        weights._constants = dict(constants)
+        return weights
+
+    def individual_weights(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Events x `names` matrix of the individual weights of the events in `mask` (all of them if `None`), in one gather."""
+        return _gather(self._weights_rows(), mask)
+
+    def variation_weights(
+        self,
+        include: list[str] = [],
+        exclude: list[str] = [],
+        mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Events x `variation_names` matrix of the partial weight for each variation, for the events in `mask` (all of them if `None`).
+
+        `mask` is either boolean or the indices of the events (e.g. `EventFilters.indices`).
+        Same values as `partial_weight_with_variation`, for all the variations at once.
+        """
+        weights = _gather(self._modifiers_rows(), mask)
+        weights *= _gather(self.partial_weight(include, exclude)[np.newaxis], mask)
+        return weights
+
+
+class EventFilters(analysis_tools.PackedSelection):  # type: ignore
+    """Extension of analysis_tools.PackedSelection, memoizing the masks (and their indices) of the ordered filters chain.
+
+    Filters are added in the order they are applied, so the masks of the requested selections are usually
+    prefixes of the chain: `up_to(name)` builds them cumulatively, each step from the previous one.
+    Filters passing all events (e.g. `no_cut`) do not break a prefix. Returned masks and indices are read-only.
+    """
+
+    def __init__(self, dtype: str = "uint32") -> None:
+        super().__init__(dtype)
+        self._trivial: set[str] = set()
+        self._clear_cache()
+
+    def _clear_cache(self) -> None:
+        self._masks: dict[frozenset[str], np.ndarray] = {}
+        self._indices: dict[frozenset[str], np.ndarray] = {}
+
+    def add(self, name: str, selection: array_like, fill_value: bool = False) -> None:
+        super().add(name, selection, fill_value)
+        if np.all(self.require(**{name: True})):
+            self._trivial.add(name)
+        self._clear_cache()
+
+    def _key(self, names: tuple[str, ...]) -> frozenset[str]:
+        return frozenset(names) - self._trivial
+
+    def _chain_key(self, name: str) -> frozenset[str]:
+        return self._key(tuple(self._names[: self._names.index(name) + 1]))
+
+    def up_to(self, name: str) -> np.ndarray:
+        """Mask of the events passing all the filters of the chain, up to `name` (included)."""
+        key = self._chain_key(name)
+        if key not in self._masks:
+            step = self._names.index(name)
+            if step == 0:
+                mask = self.require(**{name: True})
+            elif name in self._trivial:
+                mask = self.up_to(self._names[step - 1])
+            else:
+                mask = self.up_to(self._names[step - 1]) & self.require(**{name: True})
+            mask.flags.writeable = False
+            self._masks[key] = mask
+        return self._masks[key]
+
+    def all(self, *names: str) -> np.ndarray:
+        """Same as `analysis_tools.PackedSelection.all`, computed once per set of filters (cumulatively, for a prefix of the chain)."""
+        key = self._key(names)
+        if key not in self._masks:
+            last = max((self._names.index(name) for name in names), default=0)
+            if self._names and key == self._chain_key(self._names[last]):
+                return self.up_to(self._names[last])
+            mask = super().all(*names)
+            mask.flags.writeable = False
+            self._masks[key] = mask
+        return self._masks[key]
+
+    @property
+    def packed(self) -> np.ndarray:
+        """Packed bits of the filters (bit `i` for `names[i]`)."""
+        return self._data
+
+    @classmethod
+    def from_packed(
+        cls, names: list[str], packed: np.ndarray, trivial: list[str] = []
+    ) -> EventFilters:
+        """Filters `names` from their `packed` bits, `trivial` being the ones passing all events."""
+        filters = cls(packed.dtype.name)
+        filters._names = list(names)
+        filters._data = packed
+        filters._trivial = set(trivial)
+        return filters
+
+    @property
+    def trivial(self) -> list[str]:
+        """Filters passing all events."""
+        return [name for name in self._names if name in self._trivial]
+
+    def indices(self, *names: str) -> np.ndarray:
+        """Indices of the events passing all the `names` filters (`nonzero` of `all(*names)`), computed once per set of filters."""
+        key = self._key(names)
+        if key not in self._indices:
+            indices = np.flatnonzero(self.all(*names))
+            indices.flags.writeable = False
+            self._indices[key] = indices
+        return self._indices[key]
+
+
+def _variation_source(variation_name: str) -> str:
+    """Name of the weight varied by `variation_name`."""
+    for suffix in ["Up", "Down"]:
+        if variation_name.endswith(suffix):
+            return variation_name[: -len(suffix)]
+    return variation_name
+
+
+def _broadcast(value: float, size: int) -> np.ndarray:
+    """Read-only array of `size` times `value`, without per-event storage."""
+    return np.broadcast_to(np.float64(value), size)
+
+
+def _stack(columns: list[np.ndarray], size: int, dtype: np.dtype) -> np.ndarray:
+    if all(column.strides == (0,) for column in columns):
+        # only constant columns
+        return np.broadcast_to(
+            np.array([column[:1] for column in columns], dtype=dtype),
+            (len(columns), size),
+        )
+    matrix = np.empty((len(columns), size), dtype=dtype)
+    for row, column in zip(matrix, columns):
+        row[:] = column
+    return matrix
+
+
+def _gather(matrix: np.ndarray, mask: Optional[np.ndarray]) -> np.ndarray:
+    """Copy of the columns of a rows-major `matrix` selected by `mask` (boolean, or indices), transposed to events x rows.
+
+    The copy is kept rows-major, so reductions over the events (e.g. `sum(axis=0)`) run over contiguous memory.
+    """
+    if mask is None:
+        index = np.arange(matrix.shape[1])
+    elif mask.dtype == np.bool_:
+        index = np.flatnonzero(mask)
+    else:
+        index = mask
+    selected = np.empty((matrix.shape[0], len(index)), dtype=matrix.dtype)
+    np.take(matrix, index, axis=1, out=selected)
+    return selected.T
 
 
 class Events:
-    def __init__(self, events: ak.Array) -> None:
+    def __init__(
+        self,
+        events: ak.Array,
+        candidate_builder: str = "awkward",
+        dataset: Optional[str] = None,
+    ) -> None:
+        """`dataset` defaults to the one of the events' metadata (NanoEvents)."""
         if not isinstance(events, ak.Array):
             raise TypeError("Events should be an 'awkward.Array'.")
+        if candidate_builder not in CANDIDATE_BUILDERS:
+            raise ValueError(
+                f"Unknown candidate builder: {candidate_builder}. Should be one of: {CANDIDATE_BUILDERS}."
+            )
+        self.candidate_builder = candidate_builder
         self.events: ak.Array = events
         self.length: int = len(self.events)
-        self.dataset: str = events.metadata["dataset"]
+        self.dataset: str = dataset or events.metadata["dataset"]
         self.year: str = samples[self.dataset]["year"]
         self.data_or_mc: str = samples[self.dataset]["data_or_mc"]
 
@@ -57,13 +389,19 @@ class Events:
         self.weights = EventWeights(size=self.length, storeIndividual=True)
 
         # Build event filters holder
-        self.filters = analysis_tools.PackedSelection()
+        self.filters = EventFilters()
 
         # fill a no_cut filter with all True values
         self.filters.add(
             "no_cut", np.full(shape=self.length, fill_value=True, dtype=np.bool_)
         )
 
+        # processing time per stage (in seconds)
+        self.timings: defaultdict[str, float] = defaultdict(float)
+
+        # derived kinematics of the objects, computed once per chunk (see `kinematics`)
+        self._kinematics: dict[tuple[str, ...], ak.Array] = {}
+
         self._stop_filtering = False
 
     def __repr__(self) -> str:
@@ -80,20 +418,25 @@ class Events:
 
         self.events = self.events[filter]
         self.length = len(self.events)
+        self.clear_kinematics()
 
         # Re-Build event weight holder
         self.weights = EventWeights(size=self.length, storeIndividual=True)
 
         # Re-Build event filters holder
-        self.filters = analysis_tools.PackedSelection()
+        self.filters = EventFilters()
 
         # fill a no_cut filter with all True values
         self.filters.add(
             "no_cut", np.full(shape=self.length, fill_value=True, dtype=np.bool_)
         )
 
-    def add_weight(self, weight_name: str, weight: array_like) -> None:
-        if isinstance(weight, tuple):
+    def add_weight(
+        self, weight_name: str, weight: Union[array_like, ConstantWeight]
+    ) -> None:
+        if isinstance(weight, ConstantWeight):
+            self.weights.add_constant(name=weight_name, value=weight.value)
+        elif isinstance(weight, tuple):
             weight, weightUp, weightDown = weight
             self.weights.add(
                 name=weight_name,
@@ -116,6 +459,43 @@ class Events:
         self.events[object_name] = object
         self._stop_filtering = True
 
+        # drop the kinematics of a replaced object
+        self._kinematics = {
+            key: value
+            for key, value in self._kinematics.items()
+            if object_name not in key[1:]
+        }
+
+    def clear_kinematics(self) -> None:
+        self._kinematics = {}
+
+    def kinematics(
+        self, quantity: str, object_name: str, other_name: Optional[str] = None
+    ) -> ak.Array:
+        """Kinematic `quantity` of `events.<object_name>` (or between it and `events.<other_name>`), computed once per chunk.
+
+        Quantities are `mass`, `pt`, `eta`, `phi` of an object and `delta_eta`, `delta_phi` (absolute values)
+        and `delta_r` between two objects. The mass of a composite candidate (no `mass` field) is its `safe_mass`.
+        """
+        key = (quantity, object_name) + ((other_name,) if other_name else ())
+        if key not in self._kinematics:
+            if other_name:
+                self._kinematics[key] = _PAIR_KINEMATICS[quantity](
+                    self, object_name, other_name
+                )
+            else:
+                self._kinematics[key] = _KINEMATICS[quantity](self.events[object_name])
+        return self._kinematics[key]
+
+    @contextlib.contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        """Accumulate the time spent within the context to `timings[stage]`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += time.perf_counter() - start
+
     @property
     def ones(self) -> np.ndarray:
         return np.ones(self.length)
@@ -123,3 +503,29 @@ class Events:
     @property
     def trues(self) -> np.ndarray:
         return np.full(shape=self.length, fill_value=True, dtype=np.bool_)
+
+
+def _mass(candidate: ak.Array) -> ak.Array:
+    if "mass" in candidate.fields:
+        return candidate.mass
+    return safe_mass(candidate)
+
+
+_KINEMATICS: dict[str, Callable[[ak.Array], ak.Array]] = {
+    "mass": _mass,
+    "pt": lambda candidate: candidate.pt,
+    "eta": lambda candidate: candidate.eta,
+    "phi": lambda candidate: candidate.phi,
+}
+
+_PAIR_KINEMATICS: dict[str, Callable[[Events, str, str], ak.Array]] = {
+    "delta_eta": lambda evts, a, b: np.absolute(
+        evts.kinematics("eta", a) - evts.kinematics("eta", b)
+    ),
+    "delta_phi": lambda evts, a, b: np.absolute(
+        evts.events[a].delta_phi(evts.events[b])
+    ),
+    "delta_r": lambda evts, a, b: np.hypot(
+        evts.kinematics("delta_eta", a, b), evts.kinematics("delta_phi", a, b)
+    ),
+}
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Callable, Union
+from typing import Callable, Iterator, Union
 
 import awkward as ak
 from numpy.typing import ArrayLike
@@ -21,18 +21,27 @@ class FeedForwardSequence:
         return f"Sequence name: {self.name}"
 
     def __call__(self, evts: Events, from_register: bool = True) -> Events:
-        # will call sequences from its register
-        if from_register:
+        # will call sequences from its register (always, for a sequence of sequences)
+        if from_register or self.sequences:
             for seq in self.sequences:
                 evts = seq(evts=evts, from_register=False)
             return evts
 
         # default behavior
-        return self.forward(evts)
+        with evts.timed(self.name):
+            return self.forward(evts)
 
     def register_sequence(self, sequence: FeedForwardSequence) -> None:
         self.sequences.append(sequence)
 
+    def leaves(self) -> Iterator[FeedForwardSequence]:
+        """The filter, weight and object sequences run by this one, in order (sub-sequences unrolled)."""
+        for seq in self.sequences:
+            if seq.sequences:
+                yield from seq.leaves()
+            else:
+                yield seq
+
     def forward(self, evts: Events) -> Events:
         return evts
 
@@ -1,13 +1,12 @@
 from typing import Union
 
 import awkward as ak
-import numpy as np
 from coffea import lumi_tools
 from numpy.typing import ArrayLike
 
 from hzupsilonphoton.config import config
 from hzupsilonphoton.events import Events
-from hzupsilonphoton.utils import safe_mass
+from hzupsilonphoton.utils import mc_sample_filter
 
 
 def lumisection_filter(evts: Events) -> ArrayLike:
@@ -30,6 +29,13 @@ def lumisection_filter(evts: Events) -> ArrayLike:
         return lumisection_filter
 
 
+def sample_overlap_filter(evts: Events) -> ArrayLike:
+    """Events in the generator level phase space of their MC sample (see `utils.mc_sample_filter`), as counted by the generator level analysis."""
+    if evts.data_or_mc == "data":
+        return evts.trues
+    return mc_sample_filter(evts.dataset, evts.events)
+
+
 def trigger_filter(evts: Events) -> Union[ArrayLike, ak.Array]:
     if evts.data_or_mc == "data":
         return evts.trues
@@ -64,25 +70,21 @@ def n_bosons_combination_filter(evts: Events) -> ak.Array:
 
 
 def signal_selection_filter(evts: Events) -> ak.Array:
-    upsilon_vectors = (
-        evts.events.bosons_combinations["0"]["0"]
-        + evts.events.bosons_combinations["0"]["1"]
-    )
-    photons_vectors = evts.events.bosons_combinations["1"]
-
     delta_eta_filter = (
-        np.absolute(upsilon_vectors.eta - photons_vectors.eta)
+        evts.kinematics("delta_eta", "upsilon", "photon")
         < config.signal_selection.delta_eta_upsilon_boson
     )
     delta_phi_filter = (
-        np.absolute(upsilon_vectors.delta_phi(photons_vectors))
+        evts.kinematics("delta_phi", "upsilon", "photon")
         > config.signal_selection.delta_phi_upsilon_boson
     )
     delta_r_filter = (
-        upsilon_vectors.delta_r(photons_vectors)
+        evts.kinematics("delta_r", "upsilon", "photon")
         >= config.signal_selection.delta_r_upsilon_boson
     )
-    pt_filter = upsilon_vectors.pt > config.signal_selection.upsilon_min_pt
+    pt_filter = (
+        evts.kinematics("pt", "upsilon") > config.signal_selection.upsilon_min_pt
+    )
 
     signal_selection = (
         # ak.num(delta_eta_filter & delta_phi_filter & delta_r_filter & pt_filter) >= 1
@@ -96,11 +98,9 @@ def signal_selection_filter(evts: Events) -> ak.Array:
 
 
 def mass_selection_filter(evts: Events) -> ak.Array:
-    boson_mass_filter = (safe_mass(evts.events.boson) > 60) & (
-        safe_mass(evts.events.boson) < 150
-    )
-    dimuon_mass_filter = (safe_mass(evts.events.upsilon) > 8) & (
-        safe_mass(evts.events.upsilon) < 11
-    )
+    boson_mass = evts.kinematics("mass", "boson")
+    upsilon_mass = evts.kinematics("mass", "upsilon")
+    boson_mass_filter = (boson_mass > 60) & (boson_mass < 150)
+    dimuon_mass_filter = (upsilon_mass > 8) & (upsilon_mass < 11)
 
     return ak.fill_none(ak.firsts(boson_mass_filter & dimuon_mass_filter), False)
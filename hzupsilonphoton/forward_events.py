@@ -1,6 +1,7 @@
 import awkward as ak
 
 from hzupsilonphoton.builders import (
+    build_best_candidate,
     build_boson,
     build_bosons_combination,
     build_dimuons,
@@ -9,6 +10,10 @@ from hzupsilonphoton.builders import (
     build_mu_1,
     build_mu_2,
     build_photon,
+    build_probe_muon,
+    build_probe_photon,
+    build_tag_muon,
+    build_TrigObjs,
     build_upsilon,
 )
 from hzupsilonphoton.feed_forward import (
@@ -20,6 +25,7 @@ from hzupsilonphoton.feed_forward import (
 from hzupsilonphoton.filters import (
     lumisection_filter,
     mass_selection_filter,
+    sample_overlap_filter,
     signal_selection_filter,
     trigger_filter,
 )
@@ -31,64 +37,120 @@ from hzupsilonphoton.weighters import (
     photon_electron_veto_weight,
     photon_id_weight,
     pileup_weight,
+    polarization_weight,
 )
 
-forward_events = FeedForwardSequence("base_sequence")
-forward_events.register_sequence(FilterSequence("lumisection", lumisection_filter))
+# Shared sub-sequences
+# lumisection and MC samples overlap filters, and event level weights
+common_sequence = FeedForwardSequence("common_sequence")
+common_sequence.register_sequence(FilterSequence("lumisection", lumisection_filter))
+common_sequence.register_sequence(FilterSequence("mc_sample", sample_overlap_filter))
+common_sequence.register_sequence(WeightSequence("pileup", pileup_weight))
+common_sequence.register_sequence(WeightSequence("generator", generator_weight))
+common_sequence.register_sequence(WeightSequence("polarization", polarization_weight))
+common_sequence.register_sequence(WeightSequence("l1_prefiring", l1prefr_weights))
 
-forward_events.register_sequence(WeightSequence("pileup", pileup_weight))
-forward_events.register_sequence(WeightSequence("generator", generator_weight))
-forward_events.register_sequence(WeightSequence("l1_prefiring", l1prefr_weights))
+# good muons and photons
+objects_sequence = FeedForwardSequence("objects_sequence")
+objects_sequence.register_sequence(ObjectSequence("good_muons", build_good_muons))
+objects_sequence.register_sequence(ObjectSequence("good_photons", build_good_photons))
 
-forward_events.register_sequence(FilterSequence("trigger", trigger_filter))
-
-forward_events.register_sequence(ObjectSequence("good_muons", build_good_muons))
-forward_events.register_sequence(ObjectSequence("good_photons", build_good_photons))
-
-forward_events.register_sequence(
+# dimuon + photon candidates
+candidates_sequence = FeedForwardSequence("candidates_sequence")
+candidates_sequence.register_sequence(
     FilterSequence("n_muons", lambda evts: ak.num(evts.events.good_muons) >= 2)
 )
-forward_events.register_sequence(
+candidates_sequence.register_sequence(
     FilterSequence("n_photons", lambda evts: ak.num(evts.events.good_photons) >= 1)
 )
-
-forward_events.register_sequence(ObjectSequence("dimuons", build_dimuons))
-forward_events.register_sequence(
+candidates_sequence.register_sequence(ObjectSequence("dimuons", build_dimuons))
+candidates_sequence.register_sequence(
     FilterSequence("n_dimuons", lambda evts: ak.num(evts.events.dimuons) >= 1)
 )
-
-forward_events.register_sequence(
+candidates_sequence.register_sequence(
+    ObjectSequence("best_candidate", build_best_candidate)
+)
+candidates_sequence.register_sequence(
     ObjectSequence("bosons_combinations", build_bosons_combination)
 )
-forward_events.register_sequence(
+candidates_sequence.register_sequence(
     FilterSequence(
         "n_bosons", lambda evts: ak.num(evts.events.bosons_combinations) >= 1
     )
 )
+candidates_sequence.register_sequence(ObjectSequence("mu_1", build_mu_1))
+candidates_sequence.register_sequence(ObjectSequence("mu_2", build_mu_2))
+candidates_sequence.register_sequence(ObjectSequence("upsilon", build_upsilon))
+candidates_sequence.register_sequence(ObjectSequence("photon", build_photon))
+candidates_sequence.register_sequence(ObjectSequence("boson", build_boson))
 
-forward_events.register_sequence(ObjectSequence("boson", build_boson))
-forward_events.register_sequence(ObjectSequence("mu_1", build_mu_1))
-forward_events.register_sequence(ObjectSequence("mu_2", build_mu_2))
-forward_events.register_sequence(ObjectSequence("upsilon", build_upsilon))
-forward_events.register_sequence(ObjectSequence("photon", build_photon))
-
-forward_events.register_sequence(WeightSequence("muon_id", muon_id_weight))
-forward_events.register_sequence(WeightSequence("muon_iso", muon_iso_weight))
-forward_events.register_sequence(WeightSequence("photon_id", photon_id_weight))
-forward_events.register_sequence(
+# candidates scale factors
+scale_factors_sequence = FeedForwardSequence("scale_factors_sequence")
+scale_factors_sequence.register_sequence(WeightSequence("muon_id", muon_id_weight))
+scale_factors_sequence.register_sequence(WeightSequence("muon_iso", muon_iso_weight))
+scale_factors_sequence.register_sequence(WeightSequence("photon_id", photon_id_weight))
+scale_factors_sequence.register_sequence(
     WeightSequence("photon_electron_veto", photon_electron_veto_weight)
 )
 
-forward_events.register_sequence(
+# signal selection
+selection_sequence = FeedForwardSequence("selection_sequence")
+selection_sequence.register_sequence(
     FilterSequence("signal_selection", signal_selection_filter)
 )
-forward_events.register_sequence(
+selection_sequence.register_sequence(
     FilterSequence("mass_selection", mass_selection_filter)
 )
 
-forward_events.register_sequence(ObjectSequence("probe_muon", build_probe_muon))
-forward_events.register_sequence(ObjectSequence("tag_muon", build_tag_muon))
-forward_events.register_sequence(ObjectSequence("probe_photon", build_probe_photon))
-forward_events.register_sequence(ObjectSequence("TrigObjs", build_TrigObjs))
+# tag and probe objects, for the trigger study
+tag_and_probe_sequence = FeedForwardSequence("tag_and_probe_sequence")
+tag_and_probe_sequence.register_sequence(ObjectSequence("tag_muon", build_tag_muon))
+tag_and_probe_sequence.register_sequence(ObjectSequence("probe_muon", build_probe_muon))
+tag_and_probe_sequence.register_sequence(
+    ObjectSequence("probe_photon", build_probe_photon)
+)
+tag_and_probe_sequence.register_sequence(ObjectSequence("TrigObjs", build_TrigObjs))
+tag_and_probe_sequence.register_sequence(
+    FilterSequence("n_tag_muons", lambda evts: ak.num(evts.events.tag_muon) >= 1)
+)
+
+# generator level: special MC samples filter and generator weights
+gen_sequence = FeedForwardSequence("gen_sequence")
+gen_sequence.register_sequence(FilterSequence("mc_sample", sample_overlap_filter))
+gen_sequence.register_sequence(
+    WeightSequence("generator_weight", lambda evts: evts.events.genWeight)
+)
+
+
+def _profile(name: str, sequences: list[FeedForwardSequence]) -> FeedForwardSequence:
+    profile = FeedForwardSequence(name)
+    for sequence in sequences:
+        profile.register_sequence(sequence)
+    return profile
+
+
+# everything before the signal selection: what the preselection skims store (see `skim`)
+preselection_sequence = _profile(
+    "preselection",
+    [
+        common_sequence,
+        FilterSequence("trigger", trigger_filter),
+        objects_sequence,
+        candidates_sequence,
+        scale_factors_sequence,
+    ],
+)
 
+# Sequence profiles: what each analyzer runs
+profiles = {
+    # main analysis (Analyzer)
+    "signal": _profile("signal", [preselection_sequence, selection_sequence]),
+    # main analysis, from a preselection skim
+    "skimmed": _profile("skimmed", [selection_sequence]),
+    # trigger study (Analyzer_Trigg)
+    "trigger": _profile("trigger", [common_sequence, tag_and_probe_sequence]),
+    # generator level analysis (GenAnalyzer)
+    "gen": _profile("gen", [gen_sequence]),
+}
 
+forward_events = profiles["signal"]
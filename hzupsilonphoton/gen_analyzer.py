@@ -1,9 +1,17 @@
 import awkward as ak
 import numpy as np
-from coffea import analysis_tools, processor
+from coffea import processor
 from coffea.processor import Accumulatable
 
-from hzupsilonphoton.utils import mc_sample_filter
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.forward_events import profiles
+from hzupsilonphoton.polarization import (
+    helicity_angles,
+    hypotheses_factors,
+    is_polarization_sample,
+    polarization_columns,
+    polarization_histogram,
+)
 
 
 class GenAnalyzer(processor.ProcessorABC):  # type: ignore
@@ -12,6 +20,10 @@ class GenAnalyzer(processor.ProcessorABC):  # type: ignore
             {
                 "unweighted_sum_of_events": processor.defaultdict_accumulator(float),
                 "weighted_sum_of_events": processor.defaultdict_accumulator(float),
+                "polarization": polarization_histogram(),
+                "polarization_factors": processor.defaultdict_accumulator(
+                    polarization_columns
+                ),
             }
         )
 
@@ -22,21 +34,43 @@ class GenAnalyzer(processor.ProcessorABC):  # type: ignore
     # we will receive a NanoEvents
     def process(self, events: ak.Array) -> Accumulatable:
         dataset = events.metadata["dataset"]
-        # year = samples[dataset]["year"]
-        # data_or_mc = samples[dataset]["data_or_mc"]
         output = self.accumulator.identity()
 
-        # Special MC sample filter
-        events = events[mc_sample_filter(dataset, events)]
+        # Forward events over the generator level workflow (special MC sample filter and generator weights)
+        evts = profiles["gen"](Events(events))
+        mc_sample = evts.filters.all("mc_sample")
 
-        # Event weight holder
-        weights = analysis_tools.Weights(size=len(events), storeIndividual=True)
-        weights.add("Generator_weight", events.genWeight)
-        # weights.add("Generator_weight", np.sign(events.genWeight))
-        # weights.add("Generator_weight", np.sign(events.Generator.weight))
+        output["unweighted_sum_of_events"][dataset] += np.sum(mc_sample)
+        output["weighted_sum_of_events"][dataset] += np.sum(
+            evts.weights.weight()[mc_sample]
+        )
 
-        output["unweighted_sum_of_events"][dataset] += len(events)
-        output["weighted_sum_of_events"][dataset] += np.sum(weights.weight())
+        # Upsilon polarization (helicity frame angles and per-event reweighting factors) of the signal samples
+        if is_polarization_sample(dataset):
+            cos_theta, phi = helicity_angles(events.GenPart)
+            has_angles = mc_sample & ~np.isnan(cos_theta)
+            output["polarization"].histogram.fill(
+                dataset=dataset,
+                cos_theta=cos_theta[has_angles],
+                phi=phi[has_angles],
+                weight=evts.weights.weight()[has_angles],
+            )
+            columns = {
+                "luminosityBlock": ak.to_numpy(events.luminosityBlock),
+                "event": ak.to_numpy(events.event),
+                "cos_theta": cos_theta,
+                "phi": phi,
+            }
+            columns.update(
+                {
+                    f"weight_{name}": factors
+                    for name, factors in hypotheses_factors(cos_theta, phi).items()
+                }
+            )
+            for name, column in columns.items():
+                output["polarization_factors"][dataset][
+                    name
+                ] += processor.column_accumulator(column[has_angles])
 
         # end processing
         return output
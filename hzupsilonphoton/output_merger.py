@@ -1,6 +1,17 @@
+import concurrent.futures
 import subprocess
+from typing import Optional
 
-from samples.samples_details import data_samples_files, samples_files
+import numpy as np
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.output_writer import (
+    chunk_files,
+    configured_output_format,
+    read_tree,
+    write_trees,
+)
+from samples.samples_details import samples
 
 
 def execute_command(command: str) -> str:
@@ -18,14 +29,60 @@ def execute_command(command: str) -> str:
         return output
 
 
-def output_merger() -> str:
+def merge_files(output: str, inputs: str) -> str:
+    """Merge the output files matching the `inputs` pattern into `output` (both without their extension) and return the merge log.
+
+    The inputs are deduplicated by chunk ID (see `output_writer.chunk_files`). ROOT files are merged with `hadd`,
+    the columnar formats (see `output_writer.OutputFormat`) by concatenating their tables.
+    """
+    output_format = configured_output_format()
+    files = chunk_files(f"{inputs}{output_format.extension}")
+    if output_format.format == "root":
+        return execute_command(f"hadd -f {output}.root {' '.join(files)} ")
+
+    print(f"\n\n\n--> Will merge:\n {inputs}{output_format.extension}")
+    try:
+        if not files:
+            raise FileNotFoundError(
+                f"no file matches {inputs}{output_format.extension}"
+            )
+        tables = [read_tree(f, output_format) for f in files]
+        merged = {
+            name: np.concatenate([table[name] for table in tables])
+            for name in tables[0]
+        }
+        write_trees(
+            f"{output}{output_format.extension}", {"Events": merged}, output_format
+        )
+    except Exception as exc:
+        error_message = f"--> ERROR: Merge failed. \nError output: {exc!r}"
+        print(error_message)
+        return error_message
+    return f"{output}{output_format.extension}: {len(tables)} files merged\n"
+
+
+def output_merger(pool: Optional[concurrent.futures.Executor] = None) -> str:
+    """Merge the output buffers, per sample and per process.
+
+    The per sample merges of each kind of output run concurrently on `pool` (if given),
+    before the per process merges that read them.
+    """
+    run = pool.map if pool else map
+    # sample names only: their input files are not needed (nor globbed)
+    data_samples = [
+        sample for sample in samples if samples[sample]["data_or_mc"] == "data"
+    ]
+
     # merge dimuon masses
     print("--> merging dimuon masses...")
     merger_output = ""
-    for sample in data_samples_files.keys():
-        merger_output += execute_command(
-            f"hadd -f outputs/dimuons_mass_{sample}.root outputs/buffer/dimuons_mass_{sample}*.root "
+    merger_output += "".join(
+        run(
+            merge_files,
+            [f"outputs/dimuons_mass_{sample}" for sample in data_samples],
+            [f"outputs/buffer/dimuons_mass_{sample}*" for sample in data_samples],
         )
+    )
 
     # merger_output += execute_command(
     #     f"hadd -f outputs/dimuons_mass_Run2016APV.root outputs/dimuons_mass_Run2016APV*.root "
@@ -36,8 +93,8 @@ def output_merger() -> str:
     # merger_output += execute_command(
     #     f"hadd -f outputs/dimuons_mass_Run2017.root outputs/dimuons_mass_Run2017*.root "
     # )
-    merger_output += execute_command(
-        "hadd -f outputs/dimuons_mass_Run2018.root outputs/dimuons_mass_Run2018*.root "
+    merger_output += merge_files(
+        "outputs/dimuons_mass_Run2018", "outputs/dimuons_mass_Run2018*"
     )
     # merger_output += execute_command(
     #     f"hadd -f outputs/dimuons_mass_Run2.root outputs/dimuons_mass_Run2016APV.root outputs/dimuons_mass_Run2016.root outputs/dimuons_mass_Run2017.root outputs/dimuons_mass_Run2018.root "
@@ -45,10 +102,13 @@ def output_merger() -> str:
 
     # merge preselected events
     print("--> merging preselected events...")
-    for sample in samples_files.keys():
-        merger_output += execute_command(
-            f"hadd -f outputs/preselected_{sample}.root outputs/buffer/preselected*{sample}*.root "
+    merger_output += "".join(
+        run(
+            merge_files,
+            [f"outputs/preselected_{sample}" for sample in samples],
+            [f"outputs/buffer/preselected*{sample}*" for sample in samples],
         )
+    )
 
     # merger_output += execute_command(
     #     f"hadd -f outputs/preselected_Run2016APV.root outputs/preselected_Run2016APV*.root "
@@ -59,8 +119,8 @@ def output_merger() -> str:
     # merger_output += execute_command(
     #     f"hadd -f outputs/preselected_Run2017.root outputs/preselected_Run2017*.root "
     # )
-    merger_output += execute_command(
-        "hadd -f outputs/preselected_Run2018.root outputs/preselected_Run2018*.root "
+    merger_output += merge_files(
+        "outputs/preselected_Run2018", "outputs/preselected_Run2018*"
     )
 
     # execute_command(
@@ -69,10 +129,13 @@ def output_merger() -> str:
 
     # merge selected events
     print("--> merging preselected events...")
-    for sample in samples_files.keys():
-        merger_output += execute_command(
-            f"hadd -f outputs/selected_{sample}.root outputs/buffer/selected*{sample}*.root "
+    merger_output += "".join(
+        run(
+            merge_files,
+            [f"outputs/selected_{sample}" for sample in samples],
+            [f"outputs/buffer/selected*{sample}*" for sample in samples],
         )
+    )
 
     # merger_output += execute_command(
     #     f"hadd -f outputs/selected_Run2016APV.root outputs/selected_Run2016AVP*.root "
@@ -83,11 +146,32 @@ def output_merger() -> str:
     # merger_output += execute_command(
     #     f"hadd -f outputs/selected_Run2017.root outputs/selected_Run2017*.root "
     # )
-    merger_output += execute_command(
-        "hadd -f outputs/selected_Run2018.root outputs/selected_Run2018*.root "
+    merger_output += merge_files(
+        "outputs/selected_Run2018", "outputs/selected_Run2018*"
     )
     # merger_output += execute_command(
     #     f"hadd -f outputs/selected_Run2.root outputs/selected_Run2016APV.root outputs/selected_Run2016.root outputs/selected_Run2017.root outputs/selected_Run2018.root "
     # )
 
+    # merge event indexes (per region output and sample: see `pick_events`)
+    print("--> merging event indexes...")
+    outputs = [
+        region["output"] for region in config.regions.values() if region.get("output")
+    ]
+    merger_output += "".join(
+        run(
+            merge_files,
+            [
+                f"outputs/event_index_{output}_{sample}"
+                for output in outputs
+                for sample in samples
+            ],
+            [
+                f"outputs/buffer/event_index_{output}_{sample}*"
+                for output in outputs
+                for sample in samples
+            ],
+        )
+    )
+
     return merger_output
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import queue
+import re
+import secrets
+import threading
+import uuid
+from typing import Any, NamedTuple, Optional
+
+import awkward as ak
+import numpy as np
+import uproot
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.worker import run_on_workers
+
+# files queued (built, not yet written) per process before `OutputWriter.write` blocks
+DEFAULT_MAX_PENDING = 4
+
+# file extension of each output format
+OUTPUT_EXTENSIONS = {"root": ".root", "parquet": ".parquet", "arrow": ".arrow"}
+
+# chunk ID at the end of the output file names: `<file UUID>-<entry start>-<entry stop>`
+CHUNK_ID = re.compile(r"_(?P<chunk>[0-9a-f]{32}-\d+-\d+)$")
+
+_process_writer: Optional[OutputWriter] = None
+_process_writer_pid: Optional[int] = None
+
+
+class OutputFormat(NamedTuple):
+    """Format of the output files: ROOT (`root`, written by uproot) or the columnar Parquet (`parquet`) and Arrow IPC (`arrow`) ones (written by pyarrow).
+
+    `compression` is the codec (ROOT: ZLIB, LZ4, ZSTD or LZMA; Parquet: snappy, gzip, brotli, zstd or lz4; Arrow: lz4 or zstd),
+    `None` for no compression, and `level` its level (`None`: default of the codec). With `float32`, the floating point
+    columns but the weights are down-cast to float32.
+    """
+
+    format: str = "root"
+    compression: Optional[str] = "ZLIB"
+    level: Optional[int] = 1
+    float32: bool = False
+
+    @property
+    def extension(self) -> str:
+        return OUTPUT_EXTENSIONS[self.format]
+
+    @property
+    def name(self) -> str:
+        name = f"{self.format}:{self.compression or 'none'}"
+        if self.compression and self.level is not None:
+            name += f":{self.level}"
+        return name + (":float32" if self.float32 else "")
+
+
+def configured_output_format() -> OutputFormat:
+    """Output format of the `output_format` section of the configuration."""
+    return OutputFormat(**config.output_format)
+
+
+def chunk_id(metadata: dict[str, Any]) -> str:
+    """ID of the chunk described by (coffea) `metadata`: UUID of its file (hash of its name, if unknown) and its entry range.
+
+    Output files named after it are the same for every run of the chunk (retried, or re-executed). A random
+    token if the chunk is not from a file.
+    """
+    if "entrystart" not in metadata:
+        return secrets.token_hex(nbytes=20)
+    if metadata.get("fileuuid"):
+        file_id = uuid.UUID(metadata["fileuuid"]).hex
+    else:
+        file_id = hashlib.sha256(metadata["filename"].encode()).hexdigest()[:32]
+    return f"{file_id}-{metadata['entrystart']}-{metadata['entrystop']}"
+
+
+def chunk_files(pattern: str) -> list[str]:
+    """Files matching `pattern`, deduplicated by chunk ID, sorted.
+
+    A chunk run again writes the same file, but chunks of an earlier run with other entry ranges (e.g. another
+    chunk size, without clearing the buffers) would be merged twice: of the files of an output whose ranges of
+    the same input file overlap, only the most recent one is kept. Files without a chunk ID are all kept, and
+    temporary files (see `write_trees`) never match.
+    """
+    kept = []
+    chunks: dict[tuple[str, str], list[tuple[float, int, int, str]]] = {}
+    for f in glob.glob(pattern):
+        stem = os.path.splitext(f)[0]
+        match = CHUNK_ID.search(stem)
+        if match is None:
+            kept.append(f)
+            continue
+        file_id, start, stop = match["chunk"].split("-")
+        try:
+            modified = os.path.getmtime(f)
+        except FileNotFoundError:
+            # replaced while listed
+            continue
+        chunks.setdefault((stem[: match.start()], file_id), []).append(
+            (modified, int(start), int(stop), f)
+        )
+
+    for files in chunks.values():
+        ranges: list[tuple[int, int]] = []
+        for _, start, stop, f in sorted(files, reverse=True):
+            if all(
+                stop <= other_start or start >= other_stop
+                for other_start, other_stop in ranges
+            ):
+                ranges.append((start, stop))
+                kept.append(f)
+    return sorted(kept)
+
+
+def _columns(branches: dict[str, Any], float32: bool = False) -> dict[str, np.ndarray]:
+    columns = {name: ak.to_numpy(column) for name, column in branches.items()}
+    if float32:
+        columns = {
+            name: column.astype(np.float32)
+            if column.dtype == np.float64 and not name.startswith("weight")
+            else column
+            for name, column in columns.items()
+        }
+    return columns
+
+
+def write_trees(
+    filename: str,
+    trees: dict[str, dict[str, Any]],
+    output_format: OutputFormat = OutputFormat(),
+) -> None:
+    """Write `trees` (tree name: flat branches) to `filename`, in `output_format` (the columnar formats hold a single tree).
+
+    The file is written under a temporary name and then renamed, so that an interrupted write never leaves a partial
+    file, and a chunk written twice (retried, or re-executed) replaces its file as a whole.
+    """
+    temporary_filename = temporary_name(filename)
+    try:
+        _write_trees(temporary_filename, trees, output_format)
+        os.replace(temporary_filename, filename)
+    finally:
+        if os.path.isfile(temporary_filename):
+            os.remove(temporary_filename)
+
+
+def temporary_name(filename: str) -> str:
+    """Name `filename` is written under before being renamed: unique per process and thread, and not matching the `*<extension>` patterns of the merges."""
+    return f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _write_trees(
+    filename: str,
+    trees: dict[str, dict[str, Any]],
+    output_format: OutputFormat,
+) -> None:
+    trees = {
+        name: _columns(branches, output_format.float32)
+        for name, branches in trees.items()
+    }
+    if output_format.format == "root":
+        compression = (
+            getattr(uproot, output_format.compression.upper())(output_format.level)
+            if output_format.compression
+            else None
+        )
+        with uproot.recreate(filename, compression=compression) as f:
+            for name, branches in trees.items():
+                f[name] = branches
+        return
+
+    if len(trees) != 1:
+        raise ValueError(
+            f"{output_format.format} output files hold a single tree, got {list(trees)}"
+        )
+    import pyarrow
+
+    (branches,) = trees.values()
+    table = pyarrow.table(branches)
+    compression = (output_format.compression or "none").lower()
+    if output_format.format == "parquet":
+        import pyarrow.parquet
+
+        pyarrow.parquet.write_table(
+            table,
+            filename,
+            compression=compression,
+            compression_level=output_format.level,
+        )
+    elif output_format.format == "arrow":
+        import pyarrow.feather
+
+        pyarrow.feather.write_feather(
+            table,
+            filename,
+            compression="uncompressed" if compression == "none" else compression,
+            compression_level=output_format.level,
+        )
+    else:
+        raise ValueError(f"Unknown output format: {output_format.format}")
+
+
+def read_tree(filename: str, output_format: OutputFormat) -> dict[str, np.ndarray]:
+    """Columns of the (single) tree of the output file `filename`, written in `output_format`."""
+    if output_format.format == "root":
+        with uproot.open(filename) as f:
+            (tree,) = f.keys(cycle=False)
+            return f[tree].arrays(library="np")  # type: ignore
+    if output_format.format == "parquet":
+        import pyarrow.parquet
+
+        table = pyarrow.parquet.read_table(filename)
+    else:
+        import pyarrow.feather
+
+        table = pyarrow.feather.read_table(filename)
+    return {
+        name: column.to_numpy()
+        for name, column in zip(table.column_names, table.columns)
+    }
+
+
+class OutputWriter:
+    """Background thread writing (serializing and compressing) the output files of a process, fed by a bounded queue.
+
+    `write` returns as soon as the file is queued, so the caller goes on with the next computations (or chunk) while
+    earlier files are written; it blocks while `max_pending` files are already queued. Write errors are kept until
+    collected with `errors`.
+    """
+
+    def __init__(self, max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        self._queue: queue.Queue[
+            tuple[str, dict[str, dict[str, Any]], OutputFormat]
+        ] = queue.Queue(max_pending)
+        self._condition = threading.Condition()
+        self._pending: set[str] = set()
+        self._errors: dict[str, str] = {}
+        self._thread = threading.Thread(
+            target=self._run, name="output_writer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            filename, trees, output_format = self._queue.get()
+            error = None
+            try:
+                write_trees(filename, trees, output_format)
+            except Exception as exc:
+                error = repr(exc)
+            with self._condition:
+                if error:
+                    self._errors[filename] = error
+                self._pending.discard(filename)
+                self._condition.notify_all()
+
+    def write(
+        self,
+        filename: str,
+        trees: dict[str, dict[str, Any]],
+        output_format: OutputFormat = OutputFormat(),
+    ) -> str:
+        """Queue `trees` to be written to `filename` (see `write_trees`). Returns `filename`."""
+        with self._condition:
+            self._pending.add(filename)
+        self._queue.put((filename, trees, output_format))
+        return filename
+
+    def wait(self, filenames: Optional[list[str]] = None) -> None:
+        """Wait until `filenames` (default: all the queued files) are written."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._pending.intersection(filenames)
+                if filenames is not None
+                else not self._pending
+            )
+
+    def errors(self) -> dict[str, str]:
+        """Write errors (per file) since the last call."""
+        with self._condition:
+            errors, self._errors = self._errors, {}
+        return errors
+
+    def flush(self) -> dict[str, str]:
+        """Wait for all the queued files, and return the write errors (per file)."""
+        self.wait()
+        return self.errors()
+
+
+def output_writer() -> OutputWriter:
+    """Background writer of this process (worker), started on first use."""
+    global _process_writer, _process_writer_pid
+    # a forked process does not inherit the thread of its parent's writer
+    if _process_writer is None or _process_writer_pid != os.getpid():
+        _process_writer = OutputWriter()
+        _process_writer_pid = os.getpid()
+    return _process_writer
+
+
+def flush_output_writer() -> dict[str, str]:
+    """Wait for the files queued by this process (if any), and return the write errors (per file)."""
+    if _process_writer is None or _process_writer_pid != os.getpid():
+        return {}
+    return _process_writer.flush()
+
+
+def flush_output_writers() -> dict[str, str]:
+    """Wait for the files queued by this process and by all the workers of the shared pool, and return the write errors (per file)."""
+    errors = flush_output_writer()
+    for worker_errors in run_on_workers(flush_output_writer):
+        errors.update(worker_errors)
+    return errors
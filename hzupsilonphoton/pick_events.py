@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import glob
+import os
+import re
+from typing import Any
+
+import awkward as ak
+import numpy as np
+import uproot
+
+from hzupsilonphoton.output_writer import configured_output_format, read_tree
+from samples.samples_details import sample_files
+
+# merged event indexes (see `utils.event_index`), one file per region output and sample
+INDEX_DIR = "outputs"
+
+# event IDs, in the order the indexes are sorted by
+EVENT_ID = np.dtype(
+    [("run", np.uint32), ("luminosityBlock", np.uint32), ("event", np.uint64)]
+)
+
+
+def parse_event_id(event_id: str) -> tuple[int, int, int]:
+    """Run, luminosity block and event number of a `run:lumi:event` event ID."""
+    fields = re.split(r"[:,\s]+", event_id.strip())
+    if len(fields) != 3 or not all(field.isdigit() for field in fields):
+        raise ValueError(f"Invalid event ID (expected run:lumi:event): {event_id!r}")
+    run, luminosity_block, event = (int(field) for field in fields)
+    return run, luminosity_block, event
+
+
+def _event_ids(columns: dict[str, np.ndarray]) -> np.ndarray:
+    ids = np.empty(len(columns["event"]), dtype=EVENT_ID)
+    for name in EVENT_ID.names:
+        ids[name] = columns[name]
+    return ids
+
+
+def load_event_index(
+    output: str = "selected_events", index_dir: str = INDEX_DIR
+) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """Event IDs (sorted) and index columns (plus the `dataset` of each event) of the merged indexes of the `output` region output, over all samples."""
+    output_format = configured_output_format()
+    prefix = f"event_index_{output}_"
+    columns: dict[str, list[np.ndarray]] = {}
+    for filename in sorted(
+        glob.glob(os.path.join(index_dir, f"{prefix}*{output_format.extension}"))
+    ):
+        index = read_tree(filename, output_format)
+        dataset = os.path.basename(filename)[
+            len(prefix) : -len(output_format.extension)
+        ]
+        index["dataset"] = np.full(len(index["event"]), dataset, dtype=object)
+        for name, column in index.items():
+            columns.setdefault(name, []).append(column)
+    if not columns:
+        raise FileNotFoundError(
+            f"No event index of {output} under {index_dir} (run the main analysis and the merge first)"
+        )
+
+    index = {name: np.concatenate(column) for name, column in columns.items()}
+    ids = _event_ids(index)
+    order = np.argsort(ids, kind="stable")
+    return ids[order], {name: column[order] for name, column in index.items()}
+
+
+def find_events(
+    ids: np.ndarray, index_ids: np.ndarray, index: dict[str, np.ndarray]
+) -> tuple[dict[str, np.ndarray], np.ndarray]:
+    """Index rows of the event `ids` (looked up by binary search), and the IDs not found."""
+    if len(index_ids) == 0:
+        return {name: column[:0] for name, column in index.items()}, ids
+    rows = np.minimum(np.searchsorted(index_ids, ids), len(index_ids) - 1)
+    found = index_ids[rows] == ids
+    return {name: column[rows[found]] for name, column in index.items()}, ids[~found]
+
+
+def file_paths(dataset: str, uuids: set[int]) -> dict[int, str]:
+    """Paths of the files of `dataset` with the given UUIDs (as integers). Only the file headers are read, until all are found."""
+    paths: dict[int, str] = {}
+    for path in sample_files(dataset):
+        with uproot.open(path) as f:
+            if f.file.uuid.int in uuids:
+                paths[f.file.uuid.int] = path
+        if len(paths) == len(uuids):
+            break
+    return paths
+
+
+def _entry_ranges(entries: np.ndarray) -> list[tuple[int, int]]:
+    """Ranges (start, stop) of consecutive `entries` (sorted)."""
+    breaks = np.flatnonzero(np.diff(entries) != 1) + 1
+    return [
+        (int(run[0]), int(run[-1]) + 1) for run in np.split(entries, breaks) if len(run)
+    ]
+
+
+def read_entries(
+    path: str, entries: np.ndarray, treename: str = "Events"
+) -> dict[str, ak.Array]:
+    """All the branches of the `entries` of the `treename` tree of `path`, read range by range."""
+    with uproot.open(path) as f:
+        tree = f[treename]
+        ranges = [
+            tree.arrays(entry_start=start, entry_stop=stop, how=dict)
+            for start, stop in _entry_ranges(np.unique(entries))
+        ]
+    return {
+        name: ak.concatenate([branches[name] for branches in ranges])
+        for name in ranges[0]
+    }
+
+
+def write_events(
+    filename: str, branches: dict[str, ak.Array], treename: str = "Events"
+) -> None:
+    """Write NanoAOD `branches` (as read by `read_entries`), the branches of each collection (`Muon_pt`, ...) zipped, so that uproot writes their counter (`nMuon`, ...)."""
+    collections = {
+        name[1:]
+        for name in branches
+        if name.startswith("n")
+        and any(other.startswith(f"{name[1:]}_") for other in branches)
+    }
+    tree: dict[str, Any] = {}
+    for name, branch in branches.items():
+        collection = name.split("_", 1)[0]
+        if name.startswith("n") and name[1:] in collections:
+            continue
+        if collection in collections and branch.ndim > 1:
+            tree.setdefault(collection, {})[name.split("_", 1)[1]] = branch
+        else:
+            tree[name] = branch
+    with uproot.recreate(filename) as f:
+        f[treename] = {
+            name: ak.zip(branch) if isinstance(branch, dict) else branch
+            for name, branch in tree.items()
+        }
+
+
+def pick_events(
+    ids: list[tuple[int, int, int]],
+    output_filename: str,
+    output: str = "selected_events",
+    index_dir: str = INDEX_DIR,
+) -> np.ndarray:
+    """Extract the full NanoAOD events of the given (run, lumi, event) `ids` to `output_filename`, looking them up in the event index of the `output` region output.
+
+    Each event is read from its file (found by UUID) with an entry range read, without scanning the files (events are written grouped by file). Returns the IDs not found.
+    """
+    index_ids, index = load_event_index(output, index_dir)
+    found, missing = find_events(np.array(ids, dtype=EVENT_ID), index_ids, index)
+    found_ids = _event_ids(found)
+    uuids = np.array(
+        [
+            (int(high) << 64) | int(low)
+            for high, low in zip(found["file_uuid_high"], found["file_uuid_low"])
+        ],
+        dtype=object,
+    )
+
+    picked: list[dict[str, ak.Array]] = []
+    for dataset in np.unique(found["dataset"]):
+        in_dataset = found["dataset"] == dataset
+        paths = file_paths(dataset, set(uuids[in_dataset]))
+        for file_uuid, path in paths.items():
+            in_file = in_dataset & (uuids == file_uuid)
+            picked.append(read_entries(path, found["entry"][in_file]))
+        # indexed, but from a file that is no longer in the sample
+        not_found = in_dataset & ~np.isin(uuids, list(paths))
+        missing = np.concatenate([missing, found_ids[not_found]])
+
+    if picked:
+        write_events(
+            output_filename,
+            {
+                name: ak.concatenate([branches[name] for branches in picked])
+                for name in picked[0]
+            },
+        )
+    return missing
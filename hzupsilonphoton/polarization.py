@@ -0,0 +1,254 @@
+from __future__ import annotations
+
+import functools
+import os
+from typing import Optional
+
+import awkward as ak
+import hist
+import numpy as np
+import uproot
+from coffea.processor import column_accumulator, dict_accumulator
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.hist_accumulator import HistAccumulator
+from hzupsilonphoton.utils import MU_PLUS_PDGID, mother_indices
+
+# PDG ids of Y(1S), Y(2S), Y(3S) and of the Z and Higgs bosons
+UPSILON_PDGIDS = [553, 100553, 200553]
+BOSON_PDGIDS = [23, 25]
+
+# copies (e.g. after recoils) of a particle climbed when looking for the boson an upsilon comes from
+MAX_GENERATIONS = 10
+
+# per-event angles and reweighting factors of the generator level analysis, one file per dataset
+POLARIZATION_DIR = "outputs/polarization"
+
+# event IDs the factors are looked up by (the run number of MC samples is 1)
+EVENT_ID = np.dtype([("luminosityBlock", np.uint32), ("event", np.uint64)])
+
+
+def is_polarization_sample(dataset: str) -> bool:
+    """Whether `dataset` is one of the signal samples (`polarization.samples` in config) with a Y(nS) --> mu+ mu- decay."""
+    return any(dataset.startswith(sample) for sample in config.polarization.samples)
+
+
+def _four_momenta(flat: ak.Array, index: np.ndarray) -> np.ndarray:
+    """(t, x, y, z) of the generator particles at `index` of the flat `GenPart` arrays, in double precision."""
+    pt, eta, phi, mass = (
+        ak.to_numpy(flat[field]).astype(np.float64)[index]
+        for field in ["pt", "eta", "phi", "mass"]
+    )
+    x, y, z = pt * np.cos(phi), pt * np.sin(phi), pt * np.sinh(eta)
+    return np.column_stack([np.sqrt(x**2 + y**2 + z**2 + mass**2), x, y, z])
+
+
+def boost_to_rest_frame(momenta: np.ndarray, frames: np.ndarray) -> np.ndarray:
+    """Lorentz boost of each four-momentum of `momenta` (rows of (t, x, y, z)) to the rest frame of the same row of `frames`."""
+    beta = -frames[:, 1:] / frames[:, :1]
+    beta2 = np.sum(beta**2, axis=1)
+    gamma = 1 / np.sqrt(1 - beta2)
+    beta_p = np.sum(beta * momenta[:, 1:], axis=1)
+    gamma2 = np.divide(gamma - 1, beta2, out=np.zeros_like(beta2), where=beta2 > 0)
+    space = (
+        momenta[:, 1:]
+        + (gamma2 * beta_p)[:, None] * beta
+        + (gamma * momenta[:, 0])[:, None] * beta
+    )
+    return np.column_stack([gamma * (momenta[:, 0] + beta_p), space])
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1)[:, None]
+
+
+def helicity_angles(gen_particles: ak.Array) -> tuple[np.ndarray, np.ndarray]:
+    """cos(theta) and phi of the mu+ of the Y(nS) --> mu+ mu- decay, in the upsilon helicity frame, per event (`nan` without such a decay from a boson).
+
+    The z axis is the upsilon direction in the boson rest frame (opposite to the boson direction in the upsilon rest frame),
+    the y axis is perpendicular to the plane of the z axis and the beam (z x beam), and x = y x z.
+    Computed with batched boosts over the flat `GenPart` arrays (see `utils.mother_indices`).
+    """
+    counts = ak.to_numpy(ak.num(gen_particles))
+    flat = ak.flatten(gen_particles)
+    pdgids = ak.to_numpy(flat.pdgId)
+    mothers = mother_indices(gen_particles)
+    event_index = np.repeat(np.arange(len(counts)), counts)
+
+    # first mu+ from an upsilon of each event
+    is_muon = (
+        (pdgids == MU_PLUS_PDGID)
+        & (mothers >= 0)
+        & np.isin(pdgids[np.maximum(mothers, 0)], UPSILON_PDGIDS)
+    )
+    events, first = np.unique(event_index[is_muon], return_index=True)
+    muons = np.flatnonzero(is_muon)[first]
+    upsilons = mothers[muons]
+
+    # boson the upsilon comes from, climbing the upsilon copies
+    bosons = mothers[upsilons]
+    for _ in range(MAX_GENERATIONS):
+        climbing = (bosons >= 0) & ~np.isin(pdgids[np.maximum(bosons, 0)], BOSON_PDGIDS)
+        if not np.any(climbing):
+            break
+        bosons = np.where(climbing, mothers[np.maximum(bosons, 0)], bosons)
+    from_boson = (bosons >= 0) & np.isin(pdgids[np.maximum(bosons, 0)], BOSON_PDGIDS)
+    events, muons, upsilons, bosons = (
+        events[from_boson],
+        muons[from_boson],
+        upsilons[from_boson],
+        bosons[from_boson],
+    )
+
+    upsilon_p4 = _four_momenta(flat, upsilons)
+    muon_p3 = boost_to_rest_frame(_four_momenta(flat, muons), upsilon_p4)[:, 1:]
+    boson_p3 = boost_to_rest_frame(_four_momenta(flat, bosons), upsilon_p4)[:, 1:]
+    beam = np.tile([1.0, 0.0, 0.0, 1.0], (len(events), 1))
+    beam_p3 = boost_to_rest_frame(beam, upsilon_p4)[:, 1:]
+
+    z_axis = _unit(-boson_p3)
+    y_axis = _unit(np.cross(z_axis, beam_p3))
+    x_axis = np.cross(y_axis, z_axis)
+    muon_direction = _unit(muon_p3)
+
+    cos_theta = np.full(len(counts), np.nan)
+    phi = np.full(len(counts), np.nan)
+    cos_theta[events] = np.sum(muon_direction * z_axis, axis=1)
+    phi[events] = np.arctan2(
+        np.sum(muon_direction * y_axis, axis=1),
+        np.sum(muon_direction * x_axis, axis=1),
+    )
+    return cos_theta, phi
+
+
+def reweighting_factors(
+    cos_theta: np.ndarray,
+    phi: np.ndarray,
+    lambda_theta: float = 0.0,
+    lambda_phi: float = 0.0,
+    lambda_theta_phi: float = 0.0,
+) -> np.ndarray:
+    """Ratio of the dimuon angular distribution with the given anisotropy parameters to the (unpolarized) generated one.
+
+    W ~ 1 + lambda_theta cos^2(theta) + lambda_phi sin^2(theta) cos(2 phi) + lambda_theta_phi sin(2 theta) cos(phi),
+    normalized to the same number of events. Events without angles (`nan`) get 1.
+    """
+    sin2_theta = 1 - cos_theta**2
+    distribution = (
+        1
+        + lambda_theta * cos_theta**2
+        + lambda_phi * sin2_theta * np.cos(2 * phi)
+        + lambda_theta_phi * 2 * cos_theta * np.sqrt(sin2_theta) * np.cos(phi)
+    )
+    factors = distribution * 3 / (3 + lambda_theta)
+    return np.where(np.isnan(factors), 1.0, factors)
+
+
+def hypotheses_factors(cos_theta: np.ndarray, phi: np.ndarray) -> dict[str, np.ndarray]:
+    """Reweighting factors of each polarization hypothesis (`polarization.hypotheses` in config)."""
+    return {
+        name: reweighting_factors(cos_theta, phi, **hypothesis)
+        for name, hypothesis in config.polarization.hypotheses.items()
+    }
+
+
+def polarization_histogram() -> HistAccumulator:
+    """Generator weighted counts of events, per dataset, in (cos(theta), phi) of the helicity frame."""
+    binning = config.polarization.histograms
+    return HistAccumulator(
+        hist.Hist(
+            hist.axis.StrCategory([], growth=True, name="dataset"),
+            hist.axis.Regular(
+                binning.cos_theta.bins,
+                binning.cos_theta.min,
+                binning.cos_theta.max,
+                name="cos_theta",
+                label="cos#theta_{HX}",
+            ),
+            hist.axis.Regular(
+                binning.phi.bins,
+                binning.phi.min,
+                binning.phi.max,
+                name="phi",
+                label="#phi_{HX}",
+            ),
+            storage=hist.storage.Weight(),
+        )
+    )
+
+
+def polarization_columns() -> dict_accumulator:
+    """Per-event event IDs, angles and reweighting factors of a dataset, accumulated over its chunks."""
+    columns = {
+        "luminosityBlock": column_accumulator(np.zeros(0, dtype=np.uint32)),
+        "event": column_accumulator(np.zeros(0, dtype=np.uint64)),
+        "cos_theta": column_accumulator(np.zeros(0)),
+        "phi": column_accumulator(np.zeros(0)),
+    }
+    for name in config.polarization.hypotheses:
+        columns[f"weight_{name}"] = column_accumulator(np.zeros(0))
+    return dict_accumulator(columns)
+
+
+def polarization_filename(dataset: str, output_dir: str = POLARIZATION_DIR) -> str:
+    return os.path.join(output_dir, f"{dataset}.root")
+
+
+def save_polarization(
+    columns: dict[str, dict_accumulator], output_dir: str = POLARIZATION_DIR
+) -> None:
+    """Save the per-event angles and factors (see `polarization_columns`) of each dataset, sorted by event ID."""
+    os.makedirs(output_dir, exist_ok=True)
+    for dataset, dataset_columns in columns.items():
+        arrays = {name: column.value for name, column in dataset_columns.items()}
+        order = np.lexsort((arrays["event"], arrays["luminosityBlock"]))
+        with uproot.recreate(polarization_filename(dataset, output_dir)) as f:
+            f["Events"] = {name: array[order] for name, array in arrays.items()}
+
+
+def save_polarization_histograms(histogram: hist.Hist, output_filename: str) -> None:
+    """Save the (cos(theta), phi) histograms as TH2D, named after their dataset."""
+    with uproot.recreate(output_filename) as f:
+        for dataset in histogram.axes["dataset"]:
+            f[dataset] = histogram[{"dataset": dataset}]
+
+
+@functools.lru_cache(maxsize=None)
+def polarization_table(
+    dataset: str,
+) -> Optional[tuple[np.ndarray, dict[str, np.ndarray]]]:
+    """Sorted event IDs and reweighting factors (per hypothesis) of `dataset`, as saved by the generator level analysis. `None` if not saved."""
+    filename = polarization_filename(dataset)
+    if not os.path.isfile(filename):
+        return None
+    with uproot.open(filename) as f:
+        arrays = f["Events"].arrays(library="np")
+    event_ids = np.empty(len(arrays["event"]), dtype=EVENT_ID)
+    event_ids["luminosityBlock"] = arrays["luminosityBlock"]
+    event_ids["event"] = arrays["event"]
+    factors = {
+        name: arrays[f"weight_{name}"] for name in config.polarization.hypotheses
+    }
+    return event_ids, factors
+
+
+def lookup_factors(
+    dataset: str, luminosity_block: np.ndarray, event: np.ndarray
+) -> Optional[dict[str, np.ndarray]]:
+    """Reweighting factors (per hypothesis) of the given events of `dataset`, looked up by event ID (1 for events not found). `None` if not saved."""
+    table = polarization_table(dataset)
+    if table is None:
+        return None
+    event_ids, factors = table
+
+    if len(event_ids) == 0:
+        return {name: np.ones(len(event)) for name in factors}
+
+    keys = np.empty(len(event), dtype=EVENT_ID)
+    keys["luminosityBlock"] = luminosity_block
+    keys["event"] = event
+    index = np.minimum(np.searchsorted(event_ids, keys), len(event_ids) - 1)
+    found = event_ids[index] == keys
+    return {
+        name: np.where(found, values[index], 1.0) for name, values in factors.items()
+    }
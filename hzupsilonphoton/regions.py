@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+from typing import Any, NamedTuple, Optional
+
+import awkward as ak
+import hist
+import numpy as np
+import uproot
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.hist_accumulator import HistAccumulator
+
+
+class Window(NamedTuple):
+    """`min < quantity < max` for the candidate `object` of the events (outside of it, if `inverted`)."""
+
+    object: str
+    quantity: str
+    min: float
+    max: float
+    inverted: bool = False
+
+
+class Region(NamedTuple):
+    """Events passing (or failing, for names starting with `~`) `filters` and within `windows`.
+
+    Yields are weighted by `weights` (all of them if `None`), and the events are saved under the `output` prefix (not saved if `None`).
+    """
+
+    name: str
+    filters: list[str]
+    windows: list[Window] = []
+    weights: Optional[list[str]] = None
+    output: Optional[str] = None
+
+
+def regions_from_config(regions_config: dict[str, Any]) -> list[Region]:
+    return [
+        Region(
+            name=name,
+            filters=list(region["filters"]),
+            windows=[Window(**window) for window in region.get("windows", [])],
+            weights=region.get("weights"),
+            output=region.get("output"),
+        )
+        for name, region in regions_config.items()
+    ]
+
+
+# analysis regions (config: regions)
+default_regions = regions_from_config(config.regions)
+
+
+def _quantity(evts: Events, object_name: str, quantity: str) -> ak.Array:
+    if quantity in ["mass", "pt", "eta", "phi"]:
+        return evts.kinematics(quantity, object_name)
+    return evts.events[object_name][quantity]
+
+
+def window_mask(evts: Events, window: Window) -> np.ndarray:
+    quantity = _quantity(evts, window.object, window.quantity)
+    inside = (quantity > window.min) & (quantity < window.max)
+    if window.inverted:
+        inside = ~inside
+    # events without candidate are never in a window
+    return ak.to_numpy(ak.fill_none(ak.firsts(inside), False))
+
+
+def region_mask(evts: Events, region: Region) -> np.ndarray:
+    """Mask of the events of `region`. Its required filters come from the (cached) selection of `evts.filters`."""
+    required = [name for name in region.filters if not name.startswith("~")]
+    inverted = [name[1:] for name in region.filters if name.startswith("~")]
+    mask = evts.filters.all(*required)
+    if not inverted and not region.windows:
+        return mask
+    mask = mask.copy()
+    for name in inverted:
+        mask &= ~evts.filters.all(name)
+    for window in region.windows:
+        mask &= window_mask(evts, window)
+    return mask
+
+
+def region_indices(evts: Events, region: Region) -> np.ndarray:
+    """Indices of the events of `region` (read-only). Those of a region with required filters only are the (cached) `evts.filters.indices`."""
+    if any(name.startswith("~") for name in region.filters) or region.windows:
+        indices = np.flatnonzero(region_mask(evts, region))
+        indices.flags.writeable = False
+        return indices
+    return evts.filters.indices(*region.filters)
+
+
+def region_histogram() -> HistAccumulator:
+    """Weighted counts of events, per dataset, region and weight variation, in (boson mass, upsilon mass)."""
+    binning = config.region_histograms
+    return HistAccumulator(
+        hist.Hist(
+            hist.axis.StrCategory([], growth=True, name="dataset"),
+            hist.axis.StrCategory([], growth=True, name="region"),
+            hist.axis.StrCategory([], growth=True, name="variation"),
+            hist.axis.Regular(
+                binning.boson_mass.bins,
+                binning.boson_mass.min,
+                binning.boson_mass.max,
+                name="boson_mass",
+                label="m_{#mu#mu#gamma} [GeV]",
+            ),
+            hist.axis.Regular(
+                binning.upsilon_mass.bins,
+                binning.upsilon_mass.min,
+                binning.upsilon_mass.max,
+                name="upsilon_mass",
+                label="m_{#mu#mu} [GeV]",
+            ),
+            storage=hist.storage.Weight(),
+        )
+    )
+
+
+def fill_region_histogram(
+    histogram: HistAccumulator,
+    evts: Events,
+    region: Region,
+    mask: np.ndarray,
+    weights: np.ndarray,
+) -> None:
+    """Fill `histogram` with the candidates of the events in `mask` (boolean, or indices), for each column of `weights` (selected events x `evts.weights.variation_names`)."""
+    boson_mass = ak.firsts(evts.kinematics("mass", "boson")[mask])
+    upsilon_mass = ak.firsts(evts.kinematics("mass", "upsilon")[mask])
+    # events of the region without candidate (e.g. before the n_bosons filter) are not filled
+    has_candidate = ~ak.to_numpy(ak.is_none(boson_mass))
+    boson_mass = ak.to_numpy(boson_mass[has_candidate])
+    upsilon_mass = ak.to_numpy(upsilon_mass[has_candidate])
+    for variation, weight in zip(evts.weights.variation_names, weights.T):
+        histogram.histogram.fill(
+            dataset=evts.dataset,
+            region=region.name,
+            variation=variation,
+            boson_mass=boson_mass,
+            upsilon_mass=upsilon_mass,
+            weight=weight[has_candidate],
+        )
+
+
+def save_region_histograms(histogram: hist.Hist, output_filename: str) -> None:
+    """Save the region histograms as TH2D, named `<dataset>/<region>/<variation>`."""
+    with uproot.recreate(output_filename) as f:
+        for dataset in histogram.axes["dataset"]:
+            for region in histogram.axes["region"]:
+                for variation in histogram.axes["variation"]:
+                    f[f"{dataset}/{region}/{variation}"] = histogram[
+                        {"dataset": dataset, "region": region, "variation": variation}
+                    ]
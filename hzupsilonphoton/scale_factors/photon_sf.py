@@ -1,7 +1,8 @@
+import functools
 from collections import namedtuple
+from typing import Any
 
 import awkward as ak
-from coffea.lookup_tools import extractor
 
 SFFile = namedtuple("SFFile", ["electron_veto", "id"])
 
@@ -23,28 +24,33 @@ files["2018"] = SFFile(
     "data/photon_sfs/2018/Photons/egammaEffi_txt_EGM2D_Pho_wp80_root_UL18.root",
 )
 
-# setup a extractor
-ext = extractor()
-for y in ["2016APV", "2016", "2017", "2018"]:
-    # Photon Electron Veto
-    ext.add_weight_sets(
-        [f"photon_electron_veto_{y} MVAID/SF_CSEV_MVAID {files[y].electron_veto}"]
-    )
-    ext.add_weight_sets(
-        [
-            f"photon_electron_veto_{y}_error MVAID/SF_CSEV_MVAID_error {files[y].electron_veto}"
-        ]
-    )
 
-    # Photon ID
-    ext.add_weight_sets([f"photon_id_{y} EGamma_SF2D {files[y].id}"])
-    ext.add_weight_sets([f"photon_id_{y}_error EGamma_SF2D_error {files[y].id}"])
+@functools.lru_cache(maxsize=None)
+def evaluator() -> Any:
+    """Photon electron veto and ID SFs evaluator, loaded on first use (once per process)."""
+    from coffea.lookup_tools import extractor
+
+    # setup a extractor
+    ext = extractor()
+    for y in ["2016APV", "2016", "2017", "2018"]:
+        # Photon Electron Veto
+        ext.add_weight_sets(
+            [f"photon_electron_veto_{y} MVAID/SF_CSEV_MVAID {files[y].electron_veto}"]
+        )
+        ext.add_weight_sets(
+            [
+                f"photon_electron_veto_{y}_error MVAID/SF_CSEV_MVAID_error {files[y].electron_veto}"
+            ]
+        )
 
-ext.finalize()
+        # Photon ID
+        ext.add_weight_sets([f"photon_id_{y} EGamma_SF2D {files[y].id}"])
+        ext.add_weight_sets([f"photon_id_{y}_error EGamma_SF2D_error {files[y].id}"])
 
+    ext.finalize()
 
-# get an evaluator
-evaluator = ext.make_evaluator()
+    # get an evaluator
+    return ext.make_evaluator()
 
 
 def photon_electron_veto_weights(
@@ -56,18 +62,18 @@ def photon_electron_veto_weights(
 
     photon_sc_region = ak.where(photon.isScEtaEB == 1, 0, 3)
 
-    photon_electron_veto_sf = evaluator[f"photon_electron_veto_{year}"](
+    photon_electron_veto_sf = evaluator()[f"photon_electron_veto_{year}"](
         photon_sc_region
     )
 
     if syst_var != "nominal":
         if syst_var != "plus":
-            photon_electron_veto_sf = photon_electron_veto_sf + evaluator[
+            photon_electron_veto_sf = photon_electron_veto_sf + evaluator()[
                 f"photon_electron_veto_{year}_error"
             ](photon_sc_region)
 
         if syst_var != "minus":
-            photon_electron_veto_sf = photon_electron_veto_sf - evaluator[
+            photon_electron_veto_sf = photon_electron_veto_sf - evaluator()[
                 f"photon_electron_veto_{year}_error"
             ](photon_sc_region)
 
@@ -81,16 +87,16 @@ def photon_id_weights(
     References: https://twiki.cern.ch/twiki/bin/view/CMS/EgammaUL2016To2018
     """
 
-    photon_id_sf = evaluator[f"photon_id_{year}"](photon.eta, photon.pt)
+    photon_id_sf = evaluator()[f"photon_id_{year}"](photon.eta, photon.pt)
 
     if syst_var != "nominal":
         if syst_var != "plus":
-            photon_id_sf = photon_id_sf + evaluator[f"photon_id_{year}_error"](
+            photon_id_sf = photon_id_sf + evaluator()[f"photon_id_{year}_error"](
                 photon.eta, photon.pt
             )
 
         if syst_var != "minus":
-            photon_id_sf = photon_id_sf - evaluator[f"photon_id_{year}_error"](
+            photon_id_sf = photon_id_sf - evaluator()[f"photon_id_{year}_error"](
                 photon.eta, photon.pt
             )
 
@@ -1,83 +1,95 @@
+import functools
+from typing import Any
+
 import numpy as np
 import uproot
 from numpy.typing import ArrayLike
 
-pu_hist: dict[str, dict[str, dict[str, uproot.reading.ReadOnlyDirectory]]] = {}
-pu_hist["data"] = {}
-pu_hist["data"]["minus"] = {}
-pu_hist["data"]["nominal"] = {}
-pu_hist["data"]["plus"] = {}
-
-# 2016APV - Data
-pu_hist["data"]["minus"]["2016APV"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-66000ub-99bins.root:pileup"
-)
-pu_hist["data"]["nominal"]["2016APV"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-69200ub-99bins.root:pileup"
-)
-pu_hist["data"]["plus"]["2016APV"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-72400ub-99bins.root:pileup"
-)
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-80000ub-99bins.root
-
-
-# 2016 - Data
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-66000ub-99bins.root
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-69200ub-99bins.root
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-72400ub-99bins.root
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-80000ub-99bins.root
-pu_hist["data"]["minus"]["2016"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-66000ub-99bins.root:pileup"
-)
-pu_hist["data"]["nominal"]["2016"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-69200ub-99bins.root:pileup"
-)
-pu_hist["data"]["plus"]["2016"] = uproot.open(
-    "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-72400ub-99bins.root:pileup"
-)
-# data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-80000ub-99bins.root
-
-
-# 2017 - Data
-pu_hist["data"]["minus"]["2017"] = uproot.open(
-    "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-66000ub-99bins.root:pileup"
-)
-pu_hist["data"]["nominal"]["2017"] = uproot.open(
-    "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-69200ub-99bins.root:pileup"
-)
-pu_hist["data"]["plus"]["2017"] = uproot.open(
-    "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-72400ub-99bins.root:pileup"
-)
-# data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-80000ub-99bins.root
-
-
-# 2018 - Data
-pu_hist["data"]["minus"]["2018"] = uproot.open(
-    "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-66000ub-99bins.root:pileup"
-)
-pu_hist["data"]["nominal"]["2018"] = uproot.open(
-    "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-69200ub-99bins.root:pileup"
-)
-pu_hist["data"]["plus"]["2018"] = uproot.open(
-    "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-72400ub-99bins.root:pileup"
-)
-# data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-80000ub-99bins.root
-
-pu_hist["mc"] = {}
-
-# 2016APV - MC
-pu_hist["mc"]["2016APV"] = uproot.open(
-    "data/pu_histos/mc/pileup_2016APV_shifts.root:pileup"
-)
-
-# 2016 - MC
-pu_hist["mc"]["2016"] = uproot.open("data/pu_histos/mc/pileup_2016_shifts.root:pileup")
-
-# 2017 - MC
-pu_hist["mc"]["2017"] = uproot.open("data/pu_histos/mc/pileup_2017_shifts.root:pileup")
-
-# 2018 - MC
-pu_hist["mc"]["2018"] = uproot.open("data/pu_histos/mc/pileup_2018_shifts.root:pileup")
+
+@functools.lru_cache(maxsize=None)
+def pu_histograms() -> dict[str, Any]:
+    """Data (per variation and year) and MC (per year) pileup histograms, loaded on first use (once per process)."""
+    pu_hist: dict[str, dict[str, dict[str, uproot.reading.ReadOnlyDirectory]]] = {}
+    pu_hist["data"] = {}
+    pu_hist["data"]["minus"] = {}
+    pu_hist["data"]["nominal"] = {}
+    pu_hist["data"]["plus"] = {}
+
+    # 2016APV - Data
+    pu_hist["data"]["minus"]["2016APV"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-66000ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["nominal"]["2016APV"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-69200ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["plus"]["2016APV"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-72400ub-99bins.root:pileup"
+    )
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-preVFP-80000ub-99bins.root
+
+    # 2016 - Data
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-66000ub-99bins.root
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-69200ub-99bins.root
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-72400ub-99bins.root
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-80000ub-99bins.root
+    pu_hist["data"]["minus"]["2016"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-66000ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["nominal"]["2016"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-69200ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["plus"]["2016"] = uproot.open(
+        "data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-72400ub-99bins.root:pileup"
+    )
+    # data/pu_histos/data/2016/PileupHistogram-goldenJSON-13tev-2016-postVFP-80000ub-99bins.root
+
+    # 2017 - Data
+    pu_hist["data"]["minus"]["2017"] = uproot.open(
+        "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-66000ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["nominal"]["2017"] = uproot.open(
+        "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-69200ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["plus"]["2017"] = uproot.open(
+        "data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-72400ub-99bins.root:pileup"
+    )
+    # data/pu_histos/data/2017/PileupHistogram-goldenJSON-13tev-2017-80000ub-99bins.root
+
+    # 2018 - Data
+    pu_hist["data"]["minus"]["2018"] = uproot.open(
+        "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-66000ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["nominal"]["2018"] = uproot.open(
+        "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-69200ub-99bins.root:pileup"
+    )
+    pu_hist["data"]["plus"]["2018"] = uproot.open(
+        "data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-72400ub-99bins.root:pileup"
+    )
+    # data/pu_histos/data/2018/PileupHistogram-goldenJSON-13tev-2018-80000ub-99bins.root
+
+    pu_hist["mc"] = {}
+
+    # 2016APV - MC
+    pu_hist["mc"]["2016APV"] = uproot.open(
+        "data/pu_histos/mc/pileup_2016APV_shifts.root:pileup"
+    )
+
+    # 2016 - MC
+    pu_hist["mc"]["2016"] = uproot.open(
+        "data/pu_histos/mc/pileup_2016_shifts.root:pileup"
+    )
+
+    # 2017 - MC
+    pu_hist["mc"]["2017"] = uproot.open(
+        "data/pu_histos/mc/pileup_2017_shifts.root:pileup"
+    )
+
+    # 2018 - MC
+    pu_hist["mc"]["2018"] = uproot.open(
+        "data/pu_histos/mc/pileup_2018_shifts.root:pileup"
+    )
+
+    return pu_hist
 
 
 def get_bin(values: np.ndarray, histo_edges: np.ndarray) -> ArrayLike:
@@ -93,8 +105,10 @@ def pu_weights(n_pu: int, year: str, syst_var: str) -> ArrayLike:
     """Returns PU weight.
     Reference: https://hypernews.cern.ch/HyperNews/CMS/get/physics-validation/3689/1/1.html"""
 
-    pu_hist_data: uproot.reading.ReadOnlyDirectory = pu_hist["data"][syst_var][year]
-    pu_hist_mc: uproot.reading.ReadOnlyDirectory = pu_hist["mc"][year]
+    pu_hist_data: uproot.reading.ReadOnlyDirectory = pu_histograms()["data"][syst_var][
+        year
+    ]
+    pu_hist_mc: uproot.reading.ReadOnlyDirectory = pu_histograms()["mc"][year]
 
     bins_data = get_bin(n_pu, pu_hist_data.axis().edges())
     bins_mc = get_bin(n_pu - 1, pu_hist_mc.axis().edges())
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+from types import ModuleType
+from typing import Any, Callable, Optional
+
+import awkward as ak
+import coffea
+import numpy as np
+import uproot
+from coffea.nanoevents.methods import candidate
+
+from hzupsilonphoton import (
+    builders,
+    events,
+    feed_forward,
+    forward_events,
+    polarization,
+    utils,
+    weighters,
+)
+from hzupsilonphoton.config import config
+from hzupsilonphoton.events import EventFilters, Events, EventWeights
+from hzupsilonphoton.feed_forward import FeedForwardSequence
+from hzupsilonphoton.scale_factors import l1prefiring_sf, muon_sf, photon_sf, pu_weight
+from samples import lumis, xsecs
+
+# to be increased when the content of the skims changes
+SKIM_VERSION = 2
+
+# objects stored in the skims: their fields, and the behavior they are rebuilt with
+SKIM_OBJECTS = {
+    "mu_1": (["pt", "eta", "phi", "mass", "charge"], "PtEtaPhiMCandidate"),
+    "mu_2": (["pt", "eta", "phi", "mass", "charge"], "PtEtaPhiMCandidate"),
+    "photon": (["pt", "eta", "phi", "mass", "charge"], "PtEtaPhiMCandidate"),
+    "upsilon": (["x", "y", "z", "t", "charge"], "Candidate"),
+    "boson": (["x", "y", "z", "t", "charge"], "Candidate"),
+    # muons of the dimuons (for the dimuon masses of data)
+    "dimuons_0": (["pt", "eta", "phi", "mass", "charge"], "PtEtaPhiMCandidate"),
+    "dimuons_1": (["pt", "eta", "phi", "mass", "charge"], "PtEtaPhiMCandidate"),
+}
+
+# event level columns stored in the skims (event IDs)
+SKIM_COLUMNS = ["run", "luminosityBlock", "event"]
+
+# modules of the code run before the skims are written (on top of the functions of `forward_events.preselection_sequence`)
+UPSTREAM_MODULES: list[ModuleType] = [
+    builders,
+    events,
+    feed_forward,
+    polarization,
+    utils,
+    weighters,
+    l1prefiring_sf,
+    muon_sf,
+    photon_sf,
+    pu_weight,
+    lumis,
+    xsecs,
+]
+
+# upstream modules only imported when used (e.g. the numba candidate builders): hashed from their source file
+UPSTREAM_LAZY_MODULES = ["hzupsilonphoton.compiled_builders"]
+
+# configuration only used after the preselection: changing it keeps the skims valid
+DOWNSTREAM_CONFIG = [
+    "signal_selection",
+    "regions",
+    "region_histograms",
+    "cut_optimization",
+]
+
+
+def _sequence_function(sequence: FeedForwardSequence) -> Callable[..., Any]:
+    for attribute in ["filter_function", "weight_function", "object_function"]:
+        if hasattr(sequence, attribute):
+            return getattr(sequence, attribute)
+    return sequence.forward
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def upstream_hash() -> str:
+    """Hash of everything the skims depend on: preselection code and configuration, input data files (scale factors, golden JSONs, generator level outputs and polarization factors) and versions."""
+    digest = hashlib.sha256()
+
+    def _update(*items: Any) -> None:
+        for item in items:
+            digest.update(str(item).encode())
+
+    _update(SKIM_VERSION, coffea.__version__, ak.__version__, np.__version__)
+    for sequence in forward_events.preselection_sequence.leaves():
+        _update(
+            sequence.name,
+            type(sequence).__name__,
+            inspect.getsource(_sequence_function(sequence)),
+        )
+    for module in UPSTREAM_MODULES:
+        _update(module.__name__, inspect.getsource(module))
+    for name in UPSTREAM_LAZY_MODULES:
+        _update(name, file_digest(importlib.util.find_spec(name).origin))
+    _update(
+        json.dumps(
+            {k: v for k, v in config.items() if k not in DOWNSTREAM_CONFIG},
+            sort_keys=True,
+        )
+    )
+    for root, _, files in sorted(os.walk("data", followlinks=True)):
+        for f in sorted(files):
+            _update(os.path.join(root, f), file_digest(os.path.join(root, f)))
+    if os.path.isfile("outputs/gen_output.json"):
+        _update(file_digest("outputs/gen_output.json"))
+    for root, _, files in sorted(os.walk(polarization.POLARIZATION_DIR)):
+        for f in sorted(files):
+            _update(f, file_digest(os.path.join(root, f)))
+
+    return digest.hexdigest()[:16]
+
+
+def skim_filename(skim_dir: str, metadata: dict[str, Any]) -> Optional[str]:
+    """Skim of the chunk described by (coffea) `metadata`, for the current `upstream_hash`. `None` if the chunk is not from a file."""
+    if "entrystart" not in metadata:
+        return None
+    file_id = metadata.get("fileuuid") or os.path.basename(metadata["filename"])
+    return os.path.join(
+        skim_dir,
+        upstream_hash(),
+        metadata["dataset"],
+        f"{file_id}_{metadata['entrystart']}_{metadata['entrystop']}.root",
+    )
+
+
+def _skim_object(evts: Events, name: str) -> ak.Array:
+    if name.startswith("dimuons_"):
+        return evts.events.dimuons[name[len("dimuons_") :]]
+    return evts.events[name]
+
+
+def save_skim(evts: Events, filename: str) -> None:
+    """Save the objects (`SKIM_OBJECTS`), event IDs (`SKIM_COLUMNS`), weights and filter bits of preselected `evts` (see `forward_events.preselection_sequence`).
+
+    The file is written under a temporary name and then renamed, so an interrupted job never leaves a partial skim.
+    """
+    weights_columns, constants = evts.weights.to_columns()
+    tree = {
+        name: ak.zip(
+            {field: getattr(_skim_object(evts, name), field) for field in fields}
+        )
+        for name, (fields, _) in SKIM_OBJECTS.items()
+    }
+    tree.update({column: evts.events[column] for column in SKIM_COLUMNS})
+    tree["filters"] = evts.filters.packed
+    tree.update(weights_columns)
+    info = {
+        "version": SKIM_VERSION,
+        "dataset": evts.dataset,
+        "filters": evts.filters.names,
+        "trivial_filters": evts.filters.trivial,
+        "weights": list(weights_columns),
+        "constants": constants,
+    }
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temporary_filename = f"{filename}.{os.getpid()}.tmp"
+    with uproot.recreate(temporary_filename) as f:
+        f["Events"] = tree
+        f["info"] = json.dumps(info)
+    os.replace(temporary_filename, filename)
+
+
+def load_skim(filename: str, candidate_builder: str = "awkward") -> Events:
+    """Preselected events, as forwarded by `forward_events.preselection_sequence`, from their skim."""
+    with uproot.open(filename) as f:
+        info = json.loads(str(f["info"]))
+        arrays = f["Events"].arrays()
+
+    objects = {
+        name: ak.zip(
+            {field: arrays[f"{name}_{field}"] for field in fields},
+            with_name=with_name,
+            behavior=candidate.behavior,
+        )
+        for name, (fields, with_name) in SKIM_OBJECTS.items()
+    }
+    objects["dimuons"] = ak.zip(
+        {"0": objects.pop("dimuons_0"), "1": objects.pop("dimuons_1")}
+    )
+    objects.update({column: arrays[column] for column in SKIM_COLUMNS})
+
+    evts = Events(
+        ak.zip(objects, depth_limit=1),
+        candidate_builder,
+        dataset=info["dataset"],
+    )
+    evts.weights = EventWeights.from_columns(
+        {column: ak.to_numpy(arrays[column]) for column in info["weights"]},
+        info["constants"],
+    )
+    evts.filters = EventFilters.from_packed(
+        info["filters"], ak.to_numpy(arrays["filters"]), info["trivial_filters"]
+    )
+    # the skimmed events already carry filters and weights
+    evts._stop_filtering = True
+    return evts
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import concurrent.futures
+import statistics
+import time
+import traceback
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+from coffea.processor import FuturesExecutor, accumulate
+from coffea.processor.executor import WorkItem, _compression_wrapper, _decompress
+from coffea.util import rich_bar
+
+from hzupsilonphoton.telemetry import (
+    DEFAULT_TELEMETRY_INTERVAL,
+    MeasuredFunction,
+    Telemetry,
+)
+
+# a chunk runs late when it takes longer than this factor times the median time (per event) of its dataset
+DEFAULT_SPECULATION_FACTOR = 3.0
+
+# chunks of a dataset completed before its median is trusted
+DEFAULT_SPECULATION_MIN_CHUNKS = 5
+
+# chunks running for less than this (in seconds) are never re-executed
+DEFAULT_SPECULATION_MIN_SECONDS = 30.0
+
+
+@dataclass
+class SpeculativeFuturesExecutor(FuturesExecutor):  # type: ignore
+    """Futures executor re-executing the straggler chunks (e.g. read from a slow file server) on idle workers.
+
+    The time per event of the completed chunks is tracked per dataset. Once no chunk is left to submit, a chunk
+    running longer than `speculation_factor` times the median of its dataset (and than `speculation_min_seconds`)
+    is submitted again, once, on an idle worker. The result of whichever copy finishes first is kept, and the other one
+    dropped: if still running at the end, it is left running on its worker (the shared pool is kept for the next stages)
+    and its result ignored. It relies on the chunks writing the same output files, atomically, whatever copy runs them
+    (see `output_writer.chunk_id`), so that the files of a dropped copy replace the kept ones by identical ones.
+
+    At most `workers` (of the pool) chunks are in flight, so that their start times are known. Results are merged
+    in the main process (no merge jobs). With a `telemetry` file name, the progress of the run (per dataset, with
+    ETAs) is written there every `telemetry_interval` seconds (see `telemetry.Telemetry`); bytes read are known if
+    the runner saves its metrics (`savemetrics`). A `speculation_factor` of 0 disables the re-execution.
+    """
+
+    speculation_factor: float = DEFAULT_SPECULATION_FACTOR
+    speculation_min_chunks: int = DEFAULT_SPECULATION_MIN_CHUNKS
+    speculation_min_seconds: float = DEFAULT_SPECULATION_MIN_SECONDS
+    telemetry: Optional[str] = None
+    telemetry_interval: float = DEFAULT_TELEMETRY_INTERVAL
+
+    def __call__(
+        self,
+        items: Iterable[Any],
+        function: Callable[[Any], Any],
+        accumulator: Any,
+    ) -> Any:
+        items = list(items)
+        if not all(isinstance(item, WorkItem) for item in items):
+            # preprocessing (file metadata)
+            return super().__call__(items, function, accumulator)
+        if len(items) == 0:
+            return accumulator
+        if self.compression is not None:
+            function = _compression_wrapper(self.compression, function)
+
+        if isinstance(self.pool, concurrent.futures.Executor):
+            workers = getattr(self.pool, "_max_workers", self.workers)
+            return self._process(self.pool, workers, items, function, accumulator)
+        with self.pool(max_workers=self.workers) as pool:
+            return self._process(pool, self.workers, items, function, accumulator)
+
+    def _straggler(
+        self,
+        items: list[Any],
+        running: dict[concurrent.futures.Future[Any], tuple[int, float]],
+        copies: dict[int, int],
+        completed: set[int],
+        durations: dict[str, list[float]],
+    ) -> Optional[int]:
+        """Chunk running the latest compared to the median of its dataset, if late enough and neither re-executed nor completed yet."""
+        if self.speculation_factor <= 0:
+            return None
+        now = time.monotonic()
+        straggler, latest = None, 1.0
+        for index, start in running.values():
+            dataset_durations = durations[items[index].dataset]
+            if (
+                copies[index] > 1
+                or index in completed
+                or len(dataset_durations) < self.speculation_min_chunks
+                or now - start < self.speculation_min_seconds
+            ):
+                continue
+            expected = statistics.median(dataset_durations) * max(len(items[index]), 1)
+            lateness = (now - start) / (self.speculation_factor * expected)
+            if lateness > latest:
+                straggler, latest = index, lateness
+        return straggler
+
+    def _process(
+        self,
+        pool: concurrent.futures.Executor,
+        workers: int,
+        items: list[Any],
+        function: Callable[[Any], Any],
+        accumulator: Any,
+    ) -> Any:
+        pending = list(reversed(range(len(items))))
+        # running copies: chunk (index in `items`) and start time
+        running: dict[concurrent.futures.Future[Any], tuple[int, float]] = {}
+        copies: dict[int, int] = defaultdict(int)
+        completed: set[int] = set()
+        # seconds per event of the completed chunks, per dataset
+        durations: dict[str, list[float]] = defaultdict(list)
+        # copies of the straggler chunks, and how many of them finished first
+        duplicates: set[concurrent.futures.Future[Any]] = set()
+        duplicate_wins = 0
+        telemetry = (
+            Telemetry(self.telemetry, items, workers, self.telemetry_interval)
+            if self.telemetry
+            else None
+        )
+        function = MeasuredFunction(function)
+
+        def submit(index: int) -> concurrent.futures.Future[Any]:
+            future = pool.submit(function, items[index])
+            running[future] = (index, time.monotonic())
+            copies[index] += 1
+            return future
+
+        merged = None
+        with rich_bar() as progress:
+            p_id = progress.add_task(
+                self.desc, total=len(items), unit=self.unit, disable=not self.status
+            )
+            try:
+                while len(completed) < len(items):
+                    while pending and len(running) < workers:
+                        submit(pending.pop())
+                        if telemetry:
+                            telemetry.copy_submitted()
+                    if not pending and len(running) < workers:
+                        straggler = self._straggler(
+                            items, running, copies, completed, durations
+                        )
+                        if straggler is not None:
+                            duplicates.add(submit(straggler))
+                            if telemetry:
+                                telemetry.copy_submitted(duplicate=True)
+
+                    done, _ = concurrent.futures.wait(
+                        running,
+                        timeout=2,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                    for future in done:
+                        index, start = running.pop(future)
+                        copies[index] -= 1
+                        failed = future.exception() is not None
+                        result, stats = (None, None) if failed else future.result()
+                        if telemetry:
+                            telemetry.copy_finished(stats)
+                        if index in completed:
+                            # the other copy finished first
+                            continue
+                        if failed:
+                            if copies[index] > 0:
+                                # the other copy may still succeed
+                                continue
+                            raise future.exception()  # type: ignore
+                        completed.add(index)
+                        duplicate_wins += future in duplicates
+                        durations[items[index].dataset].append(
+                            (time.monotonic() - start) / max(len(items[index]), 1)
+                        )
+                        result = _decompress(result)
+                        if telemetry:
+                            telemetry.chunk_completed(
+                                index,
+                                stats,
+                                bytes_read=(result or {})
+                                .get("metrics", {})
+                                .get("bytesread"),
+                                duplicate=future in duplicates,
+                            )
+                        merged = accumulate([result], merged)
+                    progress.update(p_id, completed=len(completed), refresh=True)
+                    if telemetry:
+                        telemetry.update()
+            except Exception as e:
+                traceback.print_exc()
+                for future in running:
+                    future.cancel()
+                if not self.recoverable:
+                    raise e from None
+                print("Exception occured, recovering progress...")
+                return accumulate([merged, accumulator]), e
+            finally:
+                if telemetry:
+                    # copies still running (dropped or cancelled) are no longer followed
+                    for _ in running:
+                        telemetry.copy_finished(None)
+                    telemetry.update(force=True)
+
+        dropped = [future for future in running if not future.done()]
+        if dropped:
+            # copies of chunks completed by their other copy: left running on their worker (a process pool cannot
+            # interrupt a task), their results are ignored
+            print(
+                f"--> {len(dropped)} dropped chunk copies still running, their results are ignored"
+            )
+        if duplicates:
+            print(
+                f"--> {len(duplicates)} straggler chunks re-executed, {duplicate_wins} of them finished first by their copy"
+            )
+        return accumulate([merged, accumulator]), 0
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+import time
+
+
+def measure_startup(
+    commands: list[str], script: str = "run_analysis.py", repeats: int = 3
+) -> dict[str, float]:
+    """Time (best of `repeats`, in seconds) of `python <script> <command> --help`, in a new interpreter, for each command.
+
+    It covers the interpreter start and the module level imports of `script`, which all commands pay.
+    """
+    timings = {}
+    for command in commands:
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, script, command, "--help"],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            best = min(best, time.perf_counter() - start)
+        timings[command] = best
+    return timings
+
+
+def over_budget(timings: dict[str, float], budget: float) -> list[str]:
+    """Commands starting slower than `budget` seconds."""
+    return [
+        f"{command}: {seconds:.2f} s (budget: {budget:.2f} s)"
+        for command, seconds in timings.items()
+        if seconds > budget
+    ]
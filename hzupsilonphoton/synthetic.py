@@ -0,0 +1,422 @@
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+
+import awkward as ak
+import numpy as np
+import uproot
+from coffea.nanoevents import NanoAODSchema, NanoEventsFactory
+
+from samples.samples_details import samples
+
+# masses, in GeV
+MUON_MASS = 0.1056583745
+UPSILON_MASS = 9.4603
+Z_MASS = 91.1876
+HIGGS_MASS = 125.10
+
+# NanoAOD GenPart statusFlags bits
+IS_PROMPT = 1 << 0
+FROM_HARD_PROCESS = 1 << 8
+IS_LAST_COPY = 1 << 13
+
+# version of the generated branches, in the name of the cached files (see `synthetic_file`)
+SYNTHETIC_VERSION = 3
+
+golden_jsons = {
+    "2016APV": "data/golden_jsons/Cert_271036-284044_13TeV_Legacy2016_Collisions16_JSON.txt",
+    "2016": "data/golden_jsons/Cert_271036-284044_13TeV_Legacy2016_Collisions16_JSON.txt",
+    "2017": "data/golden_jsons/Cert_294927-306462_13TeV_UL2017_Collisions17_GoldenJSON.txt",
+    "2018": "data/golden_jsons/Cert_314472-325175_13TeV_Legacy2018_Collisions18_JSON.txt",
+}
+
+
+def _pt_eta_phi(p4: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(pt, eta, phi) of four-momenta (E, px, py, pz)."""
+    pt = np.hypot(p4[:, 1], p4[:, 2])
+    return pt, np.arcsinh(p4[:, 3] / pt), np.arctan2(p4[:, 2], p4[:, 1])
+
+
+def _boost(p4: np.ndarray, parent: np.ndarray) -> np.ndarray:
+    """Boost four-momenta (E, px, py, pz), given in the `parent` rest frame, to the lab frame."""
+    beta = parent[:, 1:] / parent[:, :1]
+    beta2 = np.sum(beta**2, axis=1)
+    gamma = 1 / np.sqrt(1 - beta2)
+    beta_p = np.sum(beta * p4[:, 1:], axis=1)
+    energy = gamma * (p4[:, 0] + beta_p)
+    momentum = (
+        p4[:, 1:]
+        + ((gamma - 1) / beta2 * beta_p + gamma * p4[:, 0])[:, np.newaxis] * beta
+    )
+    return np.column_stack([energy, momentum])
+
+
+def _two_body_decay(
+    rng: np.random.Generator, parent: np.ndarray, mass_1: float, mass_2: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Isotropic two-body decays of `parent` (E, px, py, pz). Daughters are returned in the lab frame."""
+    parent_mass = np.sqrt(parent[:, 0] ** 2 - np.sum(parent[:, 1:] ** 2, axis=1))
+    p = np.sqrt(
+        (parent_mass**2 - (mass_1 + mass_2) ** 2)
+        * (parent_mass**2 - (mass_1 - mass_2) ** 2)
+    ) / (2 * parent_mass)
+    cos_theta = rng.uniform(-1, 1, len(parent))
+    sin_theta = np.sqrt(1 - cos_theta**2)
+    phi = rng.uniform(-np.pi, np.pi, len(parent))
+    direction = p[:, np.newaxis] * np.column_stack(
+        [sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta]
+    )
+    daughter_1 = np.column_stack([np.sqrt(p**2 + mass_1**2), direction])
+    daughter_2 = np.column_stack([np.sqrt(p**2 + mass_2**2), -direction])
+    return _boost(daughter_1, parent), _boost(daughter_2, parent)
+
+
+def _collection(
+    signal_counts: np.ndarray,
+    signal: dict[str, np.ndarray],
+    counts: np.ndarray,
+    extra: dict[str, np.ndarray],
+) -> ak.Array:
+    """Jagged collection, with the signal objects placed first in each event, followed by the extra ones."""
+    return ak.zip(
+        {
+            name: ak.concatenate(
+                [
+                    ak.unflatten(signal[name], signal_counts),
+                    ak.unflatten(extra[name], counts),
+                ],
+                axis=1,
+            )
+            for name in extra
+        }
+    )
+
+
+def synthetic_branches(
+    n_events: int,
+    year: str = "2018",
+    data_or_mc: str = "mc",
+    signal_fraction: float = 0.2,
+    boson_mass: float = HIGGS_MASS,
+    seed: int = 42,
+    dalitz: bool = False,
+) -> dict[str, ak.Array]:
+    """Build NanoAOD-like branches, with the fields read by the analysis code.
+
+    A `signal_fraction` of the events carries a boson (mass: `boson_mass`) decaying to Y(1S) + photon, with Y(1S) --> mu+ mu-.
+    On top of that, every event gets extra muons, photons, trigger objects and gen particles, with Poisson multiplicities and falling pT spectra.
+    With `dalitz`, every event carries a Higgs boson Dalitz decay instead (H --> mu+ mu- gamma, m_ll uniform up to 60 GeV, as the
+    MLL-0To60 sample), the muons being daughters of the Higgs boson in `GenPart`.
+    """
+    rng = np.random.default_rng(seed)
+    is_signal = rng.uniform(size=n_events) < signal_fraction
+    if dalitz:
+        is_signal[:] = True
+    n_signal = int(is_signal.sum())
+
+    # boson --> upsilon + gamma, upsilon --> mu- mu+
+    boson_pt = rng.exponential(15.0, n_signal)
+    boson_phi = rng.uniform(-np.pi, np.pi, n_signal)
+    boson_pz = rng.normal(0, 150.0, n_signal)
+    boson = np.column_stack(
+        [
+            np.sqrt(boson_pt**2 + boson_pz**2 + boson_mass**2),
+            boson_pt * np.cos(boson_phi),
+            boson_pt * np.sin(boson_phi),
+            boson_pz,
+        ]
+    )
+    # Dalitz decays: mu+ mu- pair (virtual photon) of mass m_ll
+    dimuon_mass = rng.uniform(2 * MUON_MASS, 60, n_signal) if dalitz else UPSILON_MASS
+    upsilon, gamma = _two_body_decay(rng, boson, dimuon_mass, 0.0)
+    mu_minus, mu_plus = _two_body_decay(rng, upsilon, MUON_MASS, MUON_MASS)
+
+    signal_muons_pt, signal_muons_eta, signal_muons_phi = _pt_eta_phi(
+        np.stack([mu_minus, mu_plus], axis=1).reshape(-1, 4)
+    )
+    signal_photons_pt, signal_photons_eta, signal_photons_phi = _pt_eta_phi(gamma)
+
+    branches: dict[str, ak.Array] = {}
+
+    # event IDs, sampled from the certified lumisections
+    with open(golden_jsons[year]) as f:
+        golden_json = json.load(f)
+    lumisections = np.array(
+        [
+            (int(run), lumi)
+            for run, lumi_ranges in golden_json.items()
+            for first, last in lumi_ranges
+            for lumi in (first, last)
+        ]
+    )
+    lumisections = lumisections[rng.integers(0, len(lumisections), n_events)]
+    branches["run"] = lumisections[:, 0].astype(np.uint32)
+    branches["luminosityBlock"] = lumisections[:, 1].astype(np.uint32)
+    branches["event"] = rng.choice(1 << 40, size=n_events, replace=False).astype(
+        np.uint64
+    )
+
+    # Muons
+    n_extra_muons = rng.poisson(1.5, n_events)
+    n_muons = int(n_extra_muons.sum())
+    extra_muons_charge = rng.choice(np.array([-1, 1], dtype=np.int32), n_muons)
+    branches["Muon"] = _collection(
+        np.where(is_signal, 2, 0),
+        {
+            "pt": signal_muons_pt.astype(np.float32),
+            "eta": signal_muons_eta.astype(np.float32),
+            "phi": signal_muons_phi.astype(np.float32),
+            "mass": np.full(2 * n_signal, MUON_MASS, dtype=np.float32),
+            "charge": np.tile(np.array([-1, 1], dtype=np.int32), n_signal),
+            "pdgId": np.tile(np.array([13, -13], dtype=np.int32), n_signal),
+            "mediumPromptId": rng.uniform(size=2 * n_signal) < 0.95,
+            "pfRelIso03_all": rng.exponential(0.03, 2 * n_signal).astype(np.float32),
+        },
+        n_extra_muons,
+        {
+            "pt": (3 + rng.exponential(8.0, n_muons)).astype(np.float32),
+            "eta": rng.uniform(-2.6, 2.6, n_muons).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n_muons).astype(np.float32),
+            "mass": np.full(n_muons, MUON_MASS, dtype=np.float32),
+            "charge": extra_muons_charge,
+            "pdgId": -13 * extra_muons_charge,
+            "mediumPromptId": rng.uniform(size=n_muons) < 0.6,
+            "pfRelIso03_all": rng.exponential(0.3, n_muons).astype(np.float32),
+        },
+    )
+
+    # Photons
+    n_extra_photons = rng.poisson(1.0, n_events)
+    n_photons = int(n_extra_photons.sum())
+    extra_photons_eta = rng.uniform(-2.6, 2.6, n_photons)
+    branches["Photon"] = _collection(
+        np.where(is_signal, 1, 0),
+        {
+            "pt": signal_photons_pt.astype(np.float32),
+            "eta": signal_photons_eta.astype(np.float32),
+            "phi": signal_photons_phi.astype(np.float32),
+            "mass": np.zeros(n_signal, dtype=np.float32),
+            "charge": np.zeros(n_signal, dtype=np.int32),
+            "pdgId": np.full(n_signal, 22, dtype=np.int32),
+            "isScEtaEB": np.absolute(signal_photons_eta) < 1.4442,
+            "isScEtaEE": (np.absolute(signal_photons_eta) > 1.566)
+            & (np.absolute(signal_photons_eta) < 2.5),
+            "electronVeto": rng.uniform(size=n_signal) < 0.95,
+            "mvaID_WP80": rng.uniform(size=n_signal) < 0.9,
+        },
+        n_extra_photons,
+        {
+            "pt": (15 + rng.exponential(20.0, n_photons)).astype(np.float32),
+            "eta": extra_photons_eta.astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n_photons).astype(np.float32),
+            "mass": np.zeros(n_photons, dtype=np.float32),
+            "charge": np.zeros(n_photons, dtype=np.int32),
+            "pdgId": np.full(n_photons, 22, dtype=np.int32),
+            "isScEtaEB": np.absolute(extra_photons_eta) < 1.4442,
+            "isScEtaEE": (np.absolute(extra_photons_eta) > 1.566)
+            & (np.absolute(extra_photons_eta) < 2.5),
+            "electronVeto": rng.uniform(size=n_photons) < 0.8,
+            "mvaID_WP80": rng.uniform(size=n_photons) < 0.4,
+        },
+    )
+
+    # HLT
+    branches["HLT_Mu17_Photon30_IsoCaloId"] = rng.uniform(size=n_events) < np.where(
+        is_signal, 0.8, 0.1
+    )
+
+    # Trigger objects: one per signal muon and photon, plus random ones
+    n_extra_trigobjs = rng.poisson(6.0, n_events)
+    n_trigobjs = int(n_extra_trigobjs.sum())
+    signal_trigobjs = {
+        "pt": np.column_stack(
+            [signal_muons_pt.reshape(-1, 2), signal_photons_pt[:, np.newaxis]]
+        ),
+        "eta": np.column_stack(
+            [signal_muons_eta.reshape(-1, 2), signal_photons_eta[:, np.newaxis]]
+        ),
+        "phi": np.column_stack(
+            [signal_muons_phi.reshape(-1, 2), signal_photons_phi[:, np.newaxis]]
+        ),
+    }
+    branches["TrigObj"] = _collection(
+        np.where(is_signal, 3, 0),
+        {
+            "pt": signal_trigobjs["pt"].reshape(-1).astype(np.float32),
+            "eta": (
+                signal_trigobjs["eta"].reshape(-1) + rng.normal(0, 0.01, 3 * n_signal)
+            ).astype(np.float32),
+            "phi": (
+                signal_trigobjs["phi"].reshape(-1) + rng.normal(0, 0.01, 3 * n_signal)
+            ).astype(np.float32),
+            "id": np.tile(np.array([13, 13, 22], dtype=np.int32), n_signal),
+            "filterBits": rng.integers(0, 1 << 14, 3 * n_signal, dtype=np.int32),
+        },
+        n_extra_trigobjs,
+        {
+            "pt": (5 + rng.exponential(20.0, n_trigobjs)).astype(np.float32),
+            "eta": rng.uniform(-2.6, 2.6, n_trigobjs).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, n_trigobjs).astype(np.float32),
+            "id": rng.choice(
+                np.array([1, 6, 11, 13, 15, 22], dtype=np.int32), n_trigobjs
+            ),
+            "filterBits": rng.integers(0, 1 << 14, n_trigobjs, dtype=np.int32),
+        },
+    )
+
+    # L1 prefiring
+    l1_prefiring_nominal = 1 - rng.exponential(0.01, n_events).clip(0, 0.5)
+    branches["L1PreFiringWeight"] = ak.zip(
+        {
+            "Nom": l1_prefiring_nominal.astype(np.float32),
+            "Up": (l1_prefiring_nominal * 1.01).clip(0, 1).astype(np.float32),
+            "Dn": (l1_prefiring_nominal * 0.99).astype(np.float32),
+        }
+    )
+
+    if data_or_mc == "mc":
+        branches["genWeight"] = np.where(
+            rng.uniform(size=n_events) < 0.1, -1.5, 1.5
+        ).astype(np.float32)
+        branches["Pileup"] = ak.zip(
+            {
+                "nTrueInt": rng.poisson(32.0, n_events).clip(0, 98).astype(np.float32),
+                "nPU": rng.poisson(32.0, n_events).astype(np.int32),
+            }
+        )
+        if dalitz:
+            # the muons are daughters of the Higgs boson
+            decay_chain = [boson, gamma, mu_minus, mu_plus]
+            pdgids, mothers = [25, 22, 13, -13], [-1, 0, 0, 0]
+        else:
+            decay_chain = [boson, upsilon, gamma, mu_minus, mu_plus]
+            pdgids = [23 if boson_mass == Z_MASS else 25, 553, 22, 13, -13]
+            mothers = [-1, 0, 0, 1, 1]
+        branches["GenPart"] = _gen_particles(
+            rng,
+            is_signal,
+            np.stack(decay_chain, axis=1).reshape(-1, 4),
+            pdgids=np.array(pdgids),
+            mothers=np.array(mothers),
+        )
+
+    # single muon triggers (tag muons of the trigger study), mostly fired by events with a muon above their threshold
+    leading_muon_pt = ak.to_numpy(ak.fill_none(ak.max(branches["Muon"].pt, axis=1), 0))
+    for path, threshold in [("IsoMu24", 24), ("IsoMu27", 27)]:
+        branches[f"HLT_{path}"] = rng.uniform(size=n_events) < np.where(
+            leading_muon_pt > threshold, 0.9, 0.01
+        )
+
+    return branches
+
+
+def _gen_particles(
+    rng: np.random.Generator,
+    is_signal: np.ndarray,
+    decay_chain: np.ndarray,
+    pdgids: np.ndarray,
+    mothers: np.ndarray,
+) -> ak.Array:
+    """GenPart collection: the signal decay chain (e.g. [boson, upsilon, gamma, mu-, mu+], with their `pdgids` and `mothers` indices) followed by a falling spectrum of extra particles."""
+    n_signal = int(is_signal.sum())
+    prompt = IS_PROMPT | FROM_HARD_PROCESS | IS_LAST_COPY
+
+    chain_pt, chain_eta, chain_phi = _pt_eta_phi(decay_chain)
+    chain_mass2 = decay_chain[:, 0] ** 2 - np.sum(decay_chain[:, 1:] ** 2, axis=1)
+
+    n_extra = rng.poisson(30.0, len(is_signal))
+    n_particles = int(n_extra.sum())
+    gen_particles = _collection(
+        np.where(is_signal, len(pdgids), 0),
+        {
+            "pt": chain_pt,
+            "eta": chain_eta,
+            "phi": chain_phi,
+            "mass": np.sqrt(np.maximum(chain_mass2, 0)),
+            "pdgId": np.tile(pdgids, n_signal),
+            "genPartIdxMother": np.tile(mothers, n_signal),
+            "statusFlags": np.full(len(pdgids) * n_signal, prompt),
+        },
+        n_extra,
+        {
+            "pt": rng.exponential(5.0, n_particles),
+            "eta": rng.uniform(-5, 5, n_particles),
+            "phi": rng.uniform(-np.pi, np.pi, n_particles),
+            "mass": np.zeros(n_particles),
+            "pdgId": rng.choice(
+                np.array([21, 1, -1, 2, -2, 211, -211, 22, 111, 11, -11]), n_particles
+            ),
+            "genPartIdxMother": np.full(n_particles, -1),
+            "statusFlags": np.where(
+                rng.uniform(size=n_particles) < 0.3, prompt, IS_LAST_COPY
+            ),
+        },
+    )
+    return ak.zip(
+        {
+            "pt": ak.values_astype(gen_particles.pt, np.float32),
+            "eta": ak.values_astype(gen_particles.eta, np.float32),
+            "phi": ak.values_astype(gen_particles.phi, np.float32),
+            "mass": ak.values_astype(gen_particles.mass, np.float32),
+            "pdgId": ak.values_astype(gen_particles.pdgId, np.int32),
+            "genPartIdxMother": ak.values_astype(
+                gen_particles.genPartIdxMother, np.int32
+            ),
+            "statusFlags": ak.values_astype(gen_particles.statusFlags, np.int32),
+        }
+    )
+
+
+def write_synthetic_file(
+    filename: str,
+    n_events: int,
+    dataset: str,
+    signal_fraction: float = 0.2,
+    seed: int = 42,
+) -> str:
+    """Write a NanoAOD-like ROOT file with synthetic events of a given `dataset` (year and data/MC are taken from `samples`)."""
+    with uproot.recreate(filename) as f:
+        f["Events"] = synthetic_branches(
+            n_events,
+            year=samples[dataset]["year"],
+            data_or_mc=samples[dataset]["data_or_mc"],
+            signal_fraction=signal_fraction,
+            boson_mass=Z_MASS if dataset.startswith("ZTo") else HIGGS_MASS,
+            seed=seed,
+            dalitz="Dalitz" in dataset,
+        )
+    return filename
+
+
+def synthetic_file(
+    n_events: int, dataset: str, signal_fraction: float = 0.2, seed: int = 42
+) -> str:
+    """Path to a synthetic NanoAOD-like file. It is written only once, under the system temporary directory."""
+    filename = os.path.join(
+        tempfile.gettempdir(),
+        f"hzupsilonphoton_synthetic_v{SYNTHETIC_VERSION}_{dataset}_{n_events}_{signal_fraction}_{seed}.root",
+    )
+    if not os.path.isfile(filename):
+        write_synthetic_file(
+            f"{filename}.tmp", n_events, dataset, signal_fraction, seed
+        )
+        os.replace(f"{filename}.tmp", filename)
+    return filename
+
+
+def synthetic_events(
+    n_events: int,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    signal_fraction: float = 0.2,
+    seed: int = 42,
+) -> ak.Array:
+    """Synthetic NanoEvents, as the processors receive them (NanoAOD schema and `dataset` metadata)."""
+    NanoAODSchema.warn_missing_crossrefs = False
+    return NanoEventsFactory.from_root(
+        synthetic_file(n_events, dataset, signal_fraction, seed),
+        treepath="Events",
+        schemaclass=NanoAODSchema,
+        metadata={"dataset": dataset},
+    ).events()
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import resource
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+# seconds between two updates of the telemetry file
+DEFAULT_TELEMETRY_INTERVAL = 10.0
+
+
+class ChunkStats(NamedTuple):
+    """Resources used by a chunk, measured in its worker."""
+
+    pid: int
+    wall_seconds: float
+    cpu_seconds: float
+    # peak resident memory of the worker, so far
+    peak_memory_mb: float
+
+
+class MeasuredFunction:
+    """Work `function` of an executor, returning its result with the `ChunkStats` of the call (picklable, to be run by the workers)."""
+
+    def __init__(self, function: Callable[[Any], Any]) -> None:
+        self.function = function
+
+    def __call__(self, item: Any) -> tuple[Any, ChunkStats]:
+        start, cpu_start = time.perf_counter(), time.process_time()
+        result = self.function(item)
+        return result, ChunkStats(
+            pid=os.getpid(),
+            wall_seconds=time.perf_counter() - start,
+            cpu_seconds=time.process_time() - cpu_start,
+            # ru_maxrss is in kB, on Linux
+            peak_memory_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        )
+
+
+class _DatasetProgress:
+    def __init__(self) -> None:
+        self.chunks = 0
+        self.events = 0
+        self.chunks_done = 0
+        self.events_done = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.bytes_read = 0
+
+
+class Telemetry:
+    """Live telemetry of a run over chunks (coffea `WorkItem`s), written to `filename` (JSON) every `interval` seconds.
+
+    Per dataset (in the order they are processed) and in total: chunks and events done and remaining, events/s,
+    bytes read, CPU fraction of the chunks (CPU time / wall time, close to 1 when CPU bound, lower when waiting for
+    I/O) and ETA. For the run: worker utilization (busy fraction of the workers) and peak memory of the workers.
+    ETAs assume the remaining events take the worker time per event measured so far (of the dataset, or of the run
+    if none of its chunks is done yet), spread over all the workers.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        items: list[Any],
+        workers: int,
+        interval: float = DEFAULT_TELEMETRY_INTERVAL,
+    ) -> None:
+        self.filename = filename
+        self.items = items
+        self.workers = workers
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_update = float("-inf")
+        self.datasets: dict[str, _DatasetProgress] = {}
+        for item in items:
+            progress = self.datasets.setdefault(item.dataset, _DatasetProgress())
+            progress.chunks += 1
+            progress.events += len(item)
+        self.running = 0
+        self.busy_seconds = 0.0
+        self.peak_memory_mb: dict[int, float] = {}
+        self.duplicates = 0
+        self.duplicate_wins = 0
+
+    def copy_submitted(self, duplicate: bool = False) -> None:
+        self.running += 1
+        self.duplicates += duplicate
+
+    def copy_finished(self, stats: Optional[ChunkStats]) -> None:
+        """A copy of a chunk finished (completing it, dropped or failed). `stats` is `None` if it failed."""
+        self.running -= 1
+        if stats is not None:
+            self.busy_seconds += stats.wall_seconds
+            self.peak_memory_mb[stats.pid] = max(
+                self.peak_memory_mb.get(stats.pid, 0.0), stats.peak_memory_mb
+            )
+
+    def chunk_completed(
+        self,
+        index: int,
+        stats: ChunkStats,
+        bytes_read: Optional[int] = None,
+        duplicate: bool = False,
+    ) -> None:
+        """The chunk `items[index]` completed (by a re-executed copy of it, if `duplicate`), reading `bytes_read` bytes."""
+        item = self.items[index]
+        progress = self.datasets[item.dataset]
+        progress.chunks_done += 1
+        progress.events_done += len(item)
+        progress.wall_seconds += stats.wall_seconds
+        progress.cpu_seconds += stats.cpu_seconds
+        progress.bytes_read += bytes_read or 0
+        self.duplicate_wins += duplicate
+
+    def snapshot(self) -> dict[str, Any]:
+        """Current state of the run (see the class docstring)."""
+        elapsed = time.monotonic() - self.start
+        events_done = sum(p.events_done for p in self.datasets.values())
+        wall_seconds = sum(p.wall_seconds for p in self.datasets.values())
+        cpu_seconds = sum(p.cpu_seconds for p in self.datasets.values())
+        bytes_read = sum(p.bytes_read for p in self.datasets.values())
+        # worker seconds per event
+        run_cost = wall_seconds / events_done if events_done else None
+
+        datasets = {}
+        remaining_seconds: Optional[float] = 0.0
+        for dataset, p in self.datasets.items():
+            cost = p.wall_seconds / p.events_done if p.events_done else run_cost
+            if remaining_seconds is not None:
+                remaining_seconds = (
+                    remaining_seconds + (p.events - p.events_done) * cost / self.workers
+                    if cost is not None
+                    else None
+                )
+            datasets[dataset] = {
+                "chunks_done": p.chunks_done,
+                "chunks_remaining": p.chunks - p.chunks_done,
+                "events_done": p.events_done,
+                "events_remaining": p.events - p.events_done,
+                # per worker
+                "events_per_second": p.events_done / p.wall_seconds
+                if p.wall_seconds
+                else None,
+                "bytes_read": p.bytes_read,
+                "cpu_fraction": p.cpu_seconds / p.wall_seconds
+                if p.wall_seconds
+                else None,
+                # datasets are processed in order: this one is done once the ones before are
+                "eta_seconds": remaining_seconds,
+            }
+
+        return {
+            "updated": datetime.datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": elapsed,
+            "chunks_done": sum(p.chunks_done for p in self.datasets.values()),
+            "chunks_remaining": sum(
+                p.chunks - p.chunks_done for p in self.datasets.values()
+            ),
+            "chunks_running": self.running,
+            "events_done": events_done,
+            "events_remaining": sum(
+                p.events - p.events_done for p in self.datasets.values()
+            ),
+            "events_per_second": events_done / elapsed if elapsed else None,
+            "bytes_read": bytes_read,
+            "bytes_per_second": bytes_read / elapsed if elapsed else None,
+            "cpu_fraction": cpu_seconds / wall_seconds if wall_seconds else None,
+            "workers": self.workers,
+            "worker_utilization": self.busy_seconds / (self.workers * elapsed)
+            if elapsed
+            else None,
+            "peak_memory_mb": max(self.peak_memory_mb.values(), default=None),
+            "re_executed_chunks": self.duplicates,
+            "re_executed_chunks_finished_first": self.duplicate_wins,
+            "eta_seconds": remaining_seconds,
+            "datasets": datasets,
+        }
+
+    def update(self, force: bool = False) -> None:
+        """Write the snapshot to the telemetry file (under a temporary name, then renamed), if `interval` seconds passed since the last one."""
+        now = time.monotonic()
+        if not force and now - self.last_update < self.interval:
+            return
+        self.last_update = now
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        temporary_filename = f"{self.filename}.{os.getpid()}.tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temporary_filename, self.filename)
+
+
+def format_telemetry(snapshot: dict[str, Any]) -> str:
+    """Human readable summary of a telemetry `snapshot`."""
+
+    def _value(value: Optional[float], scale: float = 1.0, digits: int = 0) -> str:
+        return "-" if value is None else f"{value / scale:.{digits}f}"
+
+    lines = [
+        f"updated: {snapshot['updated']} (elapsed: {_value(snapshot['elapsed_seconds'])} s)",
+        f"chunks: {snapshot['chunks_done']} done, {snapshot['chunks_running']} running, {snapshot['chunks_remaining']} remaining",
+        f"events/s: {_value(snapshot['events_per_second'])} - read: {_value(snapshot['bytes_per_second'], 1024**2, 1)} MB/s"
+        f" - CPU fraction: {_value(snapshot['cpu_fraction'], digits=2)}"
+        f" - worker utilization: {_value(snapshot['worker_utilization'], digits=2)}"
+        f" - peak memory: {_value(snapshot['peak_memory_mb'])} MB",
+        f"ETA: {_value(snapshot['eta_seconds'])} s",
+        "",
+        f"{'dataset':<60}{'chunks':>14}{'events/s/worker':>17}{'CPU fraction':>14}{'read [MB]':>12}{'ETA [s]':>10}",
+    ]
+    for dataset, d in snapshot["datasets"].items():
+        chunks = f"{d['chunks_done']}/{d['chunks_done'] + d['chunks_remaining']}"
+        lines.append(
+            f"{dataset[:59]:<60}{chunks:>14}{_value(d['events_per_second']):>17}"
+            f"{_value(d['cpu_fraction'], digits=2):>14}{_value(d['bytes_read'], 1024**2, 1):>12}{_value(d['eta_seconds']):>10}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import resource
+import subprocess
+import time
+from typing import Any, Optional
+
+import numpy as np
+import uproot
+from coffea import processor
+from coffea.nanoevents import NanoAODSchema
+
+from hzupsilonphoton.analyzer import Analyzer
+from hzupsilonphoton.benchmarks import scratch_workdir
+from hzupsilonphoton.output_writer import flush_output_writer
+from hzupsilonphoton.synthetic import synthetic_file
+from samples.samples_details import samples
+
+# stages taking less than this fraction of the total time are too noisy to be compared to the baseline
+MIN_STAGE_FRACTION = 0.05
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def measure_throughput(
+    n_events: int = 100_000,
+    chunksize: int = 25_000,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    files: Optional[list[str]] = None,
+    candidate_builder: str = "awkward",
+) -> dict[str, Any]:
+    """Run `Analyzer.process` end-to-end (iterative executor) and measure its throughput.
+
+    Input is either `n_events` synthetic events, or the given local NanoAOD `files` of `dataset`.
+    Outputs are written to a scratch working directory, so the real outputs are untouched.
+    """
+    if not files:
+        files = [synthetic_file(n_events, dataset)]
+
+    weighted_sum_of_events = {}
+    n_events = 0
+    for f in files:
+        with uproot.open(f) as root_file:
+            tree = root_file["Events"]
+            n_events += tree.num_entries
+            if samples[dataset]["data_or_mc"] == "mc":
+                weighted_sum_of_events[dataset] = weighted_sum_of_events.get(
+                    dataset, 0.0
+                ) + float(np.sum(tree["genWeight"].array(library="np")))
+
+    files = [os.path.abspath(f) for f in files]
+    with scratch_workdir(weighted_sum_of_events) as workdir:
+        start = time.perf_counter()
+        output = processor.run_uproot_job(
+            fileset={dataset: files},
+            treename="Events",
+            processor_instance=Analyzer(
+                profile=True, candidate_builder=candidate_builder
+            ),
+            executor=processor.iterative_executor,
+            executor_args={"schema": NanoAODSchema},
+            chunksize=chunksize,
+        )
+        # including the output files written in the background
+        flush_output_writer()
+        total_seconds = time.perf_counter() - start
+        output_bytes = _directory_size(os.path.join(workdir, "outputs", "buffer"))
+
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "dataset": dataset,
+        "files": files,
+        "n_events": n_events,
+        "chunksize": chunksize,
+        "candidate_builder": candidate_builder,
+        "total_seconds": total_seconds,
+        "events_per_second": n_events / total_seconds,
+        # peak resident memory of this process (ru_maxrss is in kB, on Linux)
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "output_bytes": output_bytes,
+        "stages": {
+            stage: {
+                "seconds": seconds,
+                "events_per_second": n_events / seconds if seconds > 0 else None,
+            }
+            for stage, seconds in output["stage_timings"].items()
+        },
+    }
+
+
+def append_to_history(measurement: dict[str, Any], history_filename: str) -> None:
+    history = []
+    if os.path.isfile(history_filename):
+        with open(history_filename) as f:
+            history = json.load(f)
+    history.append(measurement)
+    os.makedirs(os.path.dirname(history_filename) or ".", exist_ok=True)
+    with open(history_filename, "w") as f:
+        json.dump(history, f, indent=2)
+
+
+def compare_to_baseline(
+    measurement: dict[str, Any], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    """List of regressions: throughputs (total or per stage) below `(1 - tolerance)` of the baseline, or peak memory above `(1 + tolerance)` of it."""
+    regressions = []
+
+    def _check_throughput(name: str, current: float, reference: float) -> None:
+        if current < (1 - tolerance) * reference:
+            regressions.append(
+                f"{name}: {current:.0f} events/s (baseline: {reference:.0f} events/s, {current / reference - 1:+.1%})"
+            )
+
+    _check_throughput(
+        "total", measurement["events_per_second"], baseline["events_per_second"]
+    )
+    for stage, reference in baseline["stages"].items():
+        if reference["seconds"] < MIN_STAGE_FRACTION * baseline["total_seconds"]:
+            continue
+        if stage not in measurement["stages"]:
+            regressions.append(f"{stage}: stage not found")
+            continue
+        _check_throughput(
+            stage,
+            measurement["stages"][stage]["events_per_second"],
+            reference["events_per_second"],
+        )
+
+    if measurement["peak_memory_mb"] > (1 + tolerance) * baseline["peak_memory_mb"]:
+        regressions.append(
+            f"peak memory: {measurement['peak_memory_mb']:.0f} MB (baseline: {baseline['peak_memory_mb']:.0f} MB)"
+        )
+
+    return regressions
+
+
+def format_measurement(measurement: dict[str, Any]) -> str:
+    lines = [f"{'stage':<28}{'time [s]':>12}{'events/s':>14}"]
+    for stage, timing in sorted(
+        measurement["stages"].items(), key=lambda item: -item[1]["seconds"]
+    ):
+        lines.append(
+            f"{stage:<28}{timing['seconds']:>12.3f}{timing['events_per_second']:>14.0f}"
+        )
+    lines.append(
+        f"{'TOTAL':<28}{measurement['total_seconds']:>12.3f}{measurement['events_per_second']:>14.0f}"
+    )
+    lines.append(f"Peak memory: {measurement['peak_memory_mb']:.0f} MB")
+    lines.append(f"Output size: {measurement['output_bytes'] / 1024**2:.2f} MB")
+    return "\n".join(lines)
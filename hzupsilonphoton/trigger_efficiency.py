@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import functools
+import operator
+from typing import Any
+
+import awkward as ak
+import hist
+import numpy as np
+import uproot
+from numpy.typing import ArrayLike
+
+from hzupsilonphoton.config import config
+from hzupsilonphoton.events import Events
+from hzupsilonphoton.hist_accumulator import HistAccumulator
+from samples.samples_details import samples
+
+# probe objects of the trigger study (binning in config: trigger_efficiency)
+PROBES = ["probe_muon", "probe_photon"]
+
+
+def efficiency_histogram(probe: str) -> HistAccumulator:
+    """Weighted counts of `probe` objects, per dataset and weight variation, that `passed` the trigger or not, in (pT, |eta|)."""
+    binning = config.trigger_efficiency[probe]
+    return HistAccumulator(
+        hist.Hist(
+            hist.axis.StrCategory([], growth=True, name="dataset"),
+            hist.axis.StrCategory([], growth=True, name="variation"),
+            hist.axis.Boolean(name="passed"),
+            hist.axis.Variable(binning["pt_bins"], name="pt", label="p_{T} [GeV]"),
+            hist.axis.Variable(binning["abs_eta_bins"], name="abs_eta", label="|#eta|"),
+            storage=hist.storage.Weight(),
+        )
+    )
+
+
+def fill_efficiency_histogram(
+    histogram: HistAccumulator,
+    evts: Events,
+    probe: str,
+    passed: ak.Array,
+    event_filter: ArrayLike,
+) -> None:
+    """Fill `histogram` with the `probe` objects (and if they `passed` the trigger) of the events in `event_filter`, for the nominal weight and each of its variations."""
+    probes = evts.events[probe][event_filter]
+    counts = ak.num(probes)
+    pt = ak.to_numpy(ak.flatten(probes.pt))
+    abs_eta = np.absolute(ak.to_numpy(ak.flatten(probes.eta)))
+    passed = ak.to_numpy(ak.flatten(passed[event_filter]))
+
+    for variation in ["nominal"] + evts.weights.systematics_names:
+        weight = evts.weights.weight(None if variation == "nominal" else variation)
+        histogram.histogram.fill(
+            dataset=evts.dataset,
+            variation=variation,
+            passed=passed,
+            pt=pt,
+            abs_eta=abs_eta,
+            weight=np.repeat(weight[event_filter], counts),
+        )
+
+
+def efficiency(passed: hist.Hist, total: hist.Hist) -> hist.Hist:
+    """`passed / total` per bin, with a binomial uncertainty (from the effective number of entries of `total`)."""
+    out = hist.Hist(*total.axes, storage=hist.storage.Weight())
+    values = np.divide(
+        passed.values(),
+        total.values(),
+        out=np.zeros_like(total.values()),
+        where=total.values() > 0,
+    )
+    effective_entries = np.divide(
+        total.values() ** 2,
+        total.variances(),
+        out=np.zeros_like(total.values()),
+        where=total.variances() > 0,
+    )
+    variances = np.divide(
+        values * (1 - values),
+        effective_entries,
+        out=np.zeros_like(values),
+        where=effective_entries > 0,
+    )
+    out[...] = np.stack([values, variances], axis=-1)
+    return out
+
+
+def ratio(numerator: hist.Hist, denominator: hist.Hist) -> hist.Hist:
+    """`numerator / denominator` per bin, propagating (uncorrelated) uncertainties."""
+    out = hist.Hist(*denominator.axes, storage=hist.storage.Weight())
+    values = np.divide(
+        numerator.values(),
+        denominator.values(),
+        out=np.zeros_like(denominator.values()),
+        where=denominator.values() > 0,
+    )
+    relative_variances = np.divide(
+        numerator.variances(),
+        numerator.values() ** 2,
+        out=np.zeros_like(values),
+        where=numerator.values() > 0,
+    ) + np.divide(
+        denominator.variances(),
+        denominator.values() ** 2,
+        out=np.zeros_like(values),
+        where=denominator.values() > 0,
+    )
+    out[...] = np.stack([values, values**2 * relative_variances], axis=-1)
+    return out
+
+
+def _dataset_counts(histogram: hist.Hist, dataset: str, variation: str) -> hist.Hist:
+    """Counts of `dataset` for `variation`, or for the nominal weight if the dataset has no entries for it (e.g. the polarization weight, only for the signal samples)."""
+    counts = histogram[{"dataset": dataset, "variation": variation}]
+    if variation != "nominal" and not np.any(counts.variances()):
+        return histogram[{"dataset": dataset, "variation": "nominal"}]
+    return counts
+
+
+def _group_efficiency(
+    histogram: hist.Hist, datasets: list[str], variation: str
+) -> hist.Hist:
+    counts = functools.reduce(
+        operator.add,
+        (_dataset_counts(histogram, d, variation) for d in datasets),
+    )
+    return efficiency(counts[{"passed": True}], counts[{"passed": sum}])
+
+
+def efficiency_maps(histogram: hist.Hist) -> dict[str, Any]:
+    """Efficiency maps, in (pT, |eta|), per dataset and weight variation, and per year for data and MC (datasets summed).
+
+    Data maps are given for the nominal weight only. An MC dataset without a weight variation (e.g. the polarization
+    weight of the background samples) contributes its nominal counts to it, so that every variation of the MC maps
+    sums the same datasets. Scale factors (data / MC) are given per year and MC weight variation.
+    """
+    datasets = list(histogram.axes["dataset"])
+    variations = list(histogram.axes["variation"])
+    efficiencies: dict[str, dict[str, hist.Hist]] = {
+        dataset: {
+            variation: _group_efficiency(histogram, [dataset], variation)
+            for variation in (
+                variations if samples[dataset]["data_or_mc"] == "mc" else ["nominal"]
+            )
+        }
+        for dataset in datasets
+    }
+
+    scale_factors: dict[str, dict[str, hist.Hist]] = {}
+    for year in sorted({samples[d]["year"] for d in datasets}):
+        data = [
+            d
+            for d in datasets
+            if samples[d]["year"] == year and samples[d]["data_or_mc"] == "data"
+        ]
+        mc = [
+            d
+            for d in datasets
+            if samples[d]["year"] == year and samples[d]["data_or_mc"] == "mc"
+        ]
+        if data:
+            efficiencies[f"data_{year}"] = {
+                "nominal": _group_efficiency(histogram, data, "nominal")
+            }
+        if mc:
+            efficiencies[f"mc_{year}"] = {
+                variation: _group_efficiency(histogram, mc, variation)
+                for variation in variations
+            }
+        if data and mc:
+            scale_factors[year] = {
+                variation: ratio(
+                    efficiencies[f"data_{year}"]["nominal"],
+                    efficiencies[f"mc_{year}"][variation],
+                )
+                for variation in variations
+            }
+
+    return {"efficiencies": efficiencies, "scale_factors": scale_factors}
+
+
+def save_efficiency_maps(maps: dict[str, Any], output_filename: str) -> None:
+    """Save the efficiency and scale factor maps (of each probe) as TH2D, named `<efficiencies|scale_factors>/<probe>/<dataset or year>/<variation>`."""
+    with uproot.recreate(output_filename) as f:
+        for probe, probe_maps in maps.items():
+            for kind in ["efficiencies", "scale_factors"]:
+                for group, histograms in probe_maps[kind].items():
+                    for variation, histogram in histograms.items():
+                        f[f"{kind}/{probe}/{group}/{variation}"] = histogram
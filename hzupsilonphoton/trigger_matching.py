@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import awkward as ak
+import numpy as np
+
+from hzupsilonphoton.config import config
+
+
+def filter_bits_mask(filter_bits: list[int]) -> int:
+    """Bitwise OR of `TrigObj_filterBits` values (e.g. `[2, 32]` -> `34`)."""
+    mask = 0
+    for bit in filter_bits:
+        mask |= bit
+    return mask
+
+
+def match_trigger_objects(
+    objects: ak.Array,
+    trigger_objects: ak.Array,
+    trigger_id: int,
+    filter_bits: list[int] = [],
+    max_delta_r: float = 0.1,
+) -> ak.Array:
+    """Match each offline object to its nearest (in delta R) trigger object.
+
+    Only trigger objects with the given `trigger_id` and all the `filter_bits` set are considered.
+    Returns, for each offline object, a record with the `index` of the nearest trigger object (in the event `TrigObj` collection,
+    `None` if there is none), its `delta_r` (`inf` if there is none) and if it is `matched` (`delta_r < max_delta_r`).
+    """
+    mask = filter_bits_mask(filter_bits)
+    trigger_objects_index = ak.local_index(trigger_objects)
+    good_trigger_objects = (trigger_objects.id == trigger_id) & (
+        (trigger_objects.filterBits & mask) == mask
+    )
+    trigger_objects = trigger_objects[good_trigger_objects]
+    trigger_objects_index = trigger_objects_index[good_trigger_objects]
+
+    # delta R table: [event][object][trigger object]
+    delta_r = objects.metric_table(trigger_objects)
+    nearest = ak.argmin(delta_r, axis=2, keepdims=True)
+    nearest_delta_r = ak.fill_none(ak.firsts(delta_r[nearest], axis=2), np.inf)
+
+    return ak.zip(
+        {
+            "index": trigger_objects_index[ak.firsts(nearest, axis=2)],
+            "delta_r": nearest_delta_r,
+            "matched": nearest_delta_r < max_delta_r,
+        }
+    )
+
+
+def match_muons(muons: ak.Array, trigger_objects: ak.Array) -> ak.Array:
+    return match_trigger_objects(muons, trigger_objects, **config.trigger_matching.muon)
+
+
+def match_photons(photons: ak.Array, trigger_objects: ak.Array) -> ak.Array:
+    return match_trigger_objects(
+        photons, trigger_objects, **config.trigger_matching.photon
+    )
@@ -1,15 +1,22 @@
 import secrets
-from typing import Union
+import uuid
+from typing import Any, Optional, Union
 
 import awkward as ak
 import numpy as np
 import uproot
-from coffea.nanoevents.methods.candidate import Candidate
+from coffea.nanoevents.methods import candidate
 from coffea.processor import Accumulatable
 from numpy.typing import ArrayLike
 from particle import PDGID, Particle
 
-from hzupsilonphoton.events import Events
+from hzupsilonphoton.events import Events, safe_mass
+from hzupsilonphoton.output_writer import (
+    OutputWriter,
+    chunk_id,
+    configured_output_format,
+    write_trees,
+)
 
 
 def file_tester(file_path: str) -> None:
@@ -19,42 +26,85 @@ def file_tester(file_path: str) -> None:
         print(f"An exception occurred trying to open: {file_path}")
 
 
-def safe_mass(candidate: Candidate) -> ArrayLike:
-    """Get the mass of a canditate, taking care of negative mass**2 due to NanoAOD precision issues."""
-    squared_mass = candidate.mass2
-    return np.sqrt(ak.where(squared_mass < 0, 0, squared_mass))
-
-
 def get_pdgid_by_name(name: str) -> PDGID:
     return Particle.from_name(name).pdgid
 
 
+# PDG ids of the generator level filters, resolved once
+HIGGS_PDGID = int(get_pdgid_by_name("H0"))
+MU_PLUS_PDGID = int(get_pdgid_by_name("mu+"))
+MU_MINUS_PDGID = int(get_pdgid_by_name("mu-"))
+
+# NanoAOD GenPart statusFlags bit
+IS_PROMPT = 1 << 0
+
+
+def mother_indices(gen_particles: ak.Array) -> np.ndarray:
+    """Index of the mother (-1 if none) of each generator particle, in the `GenPart` arrays flattened over the events.
+
+    The local `genPartIdxMother` indices are shifted by the per-event offsets of the flat arrays,
+    instead of going through the (costly) `parent` cross-reference of NanoEvents.
+    """
+    counts = ak.to_numpy(ak.num(gen_particles))
+    mothers = ak.to_numpy(ak.flatten(gen_particles.genPartIdxMother))
+    global_mothers = mothers + np.repeat(np.cumsum(counts) - counts, counts)
+    return np.where(mothers >= 0, global_mothers, -1)
+
+
+def mother_pdgids(gen_particles: ak.Array) -> np.ndarray:
+    """pdgId of the mother (0 if none) of each generator particle, flattened over the events (see `mother_indices`)."""
+    pdgids = ak.to_numpy(ak.flatten(gen_particles.pdgId))
+    mothers = mother_indices(gen_particles)
+    return np.where(mothers >= 0, pdgids[np.maximum(mothers, 0)], 0)
+
+
+def higgs_dimuon_mass(gen_particles: ak.Array) -> np.ndarray:
+    """Mass of the prompt mu+ mu- pair from the Higgs boson decay, per event (`nan` if the event has not exactly one such pair).
+
+    Computed on the flat `GenPart` arrays (see `mother_pdgids`), with the four-vector arithmetic of coffea's candidates.
+    """
+    counts = ak.to_numpy(ak.num(gen_particles))
+    flat = ak.flatten(gen_particles)
+    pdgids = ak.to_numpy(flat.pdgId)
+    is_prompt = (ak.to_numpy(flat.statusFlags) & IS_PROMPT) != 0
+    from_higgs = is_prompt & (mother_pdgids(gen_particles) == HIGGS_PDGID)
+    is_mu_plus = from_higgs & (pdgids == MU_PLUS_PDGID)
+    is_mu_minus = from_higgs & (pdgids == MU_MINUS_PDGID)
+
+    event_index = np.repeat(np.arange(len(counts)), counts)
+    is_muon = is_mu_plus | is_mu_minus
+    muons = ak.zip(
+        {field: flat[field][is_muon] for field in ["pt", "eta", "phi", "mass"]},
+        with_name="PtEtaPhiMCandidate",
+        behavior=candidate.behavior,
+    )
+    dimuons = {}
+    for component in ["x", "y", "z", "t"]:
+        values = ak.to_numpy(getattr(muons, component))
+        dimuons[component] = np.zeros(len(counts), dtype=values.dtype)
+        np.add.at(dimuons[component], event_index[is_muon], values)
+    squared_mass = (
+        dimuons["t"] * dimuons["t"]
+        - dimuons["x"] * dimuons["x"]
+        - dimuons["y"] * dimuons["y"]
+        - dimuons["z"] * dimuons["z"]
+    )
+
+    one_pair = (np.bincount(event_index[is_mu_plus], minlength=len(counts)) == 1) & (
+        np.bincount(event_index[is_mu_minus], minlength=len(counts)) == 1
+    )
+    return np.where(one_pair, np.sqrt(np.maximum(squared_mass, 0)), np.nan)
+
+
 def mc_sample_filter(dataset: str, events: ak.Array) -> Union[ArrayLike, ak.Array]:
-    """Filter MC samples for special cases."""
+    """Filter MC samples for special cases (shared by the generator level and the main analyses, to remove overlaps between samples)."""
     _filter = np.ones(len(events), dtype=bool)
 
     # Higss resonant m_ll < 30
     if dataset.startswith(
         "GluGluHToMuMuG_M125_MLL-0To60_Dalitz_012j_13TeV_amcatnloFXFX_pythia8"
     ):
-        is_prompt_filter = events.GenPart.hasFlags("isPrompt")
-        is_mu_plus_filter = events.GenPart.pdgId == get_pdgid_by_name("mu+")
-        is_mu_minus_filter = events.GenPart.pdgId == get_pdgid_by_name("mu-")
-        # is_gamma_filter = events.GenPart.pdgId == get_pdgid_by_name("gamma")
-        is_Higgs_children = ak.fill_none(
-            events.GenPart.parent.pdgId == get_pdgid_by_name("H0"), False
-        )
-
-        muons_plus = events.GenPart[
-            is_prompt_filter & is_Higgs_children & is_mu_plus_filter
-        ]
-        muons_minus = events.GenPart[
-            is_prompt_filter & is_Higgs_children & is_mu_minus_filter
-        ]
-
-        dimuons_masses = ak.flatten(safe_mass(muons_plus + muons_minus))
-        dimuons_masses_filter = dimuons_masses < 30
-        _filter = dimuons_masses_filter
+        _filter = higgs_dimuon_mass(events.GenPart) < 30
 
     # Z signal m_ll > 50 (? - Not sure if it should be done)
     # if dataset.startswith("ZToUpsilon"):
@@ -62,138 +112,138 @@ def mc_sample_filter(dataset: str, events: ak.Array) -> Union[ArrayLike, ak.Arra
     return _filter
 
 
-def save_dimuon_masses(evts: Events, list_of_dimuons_mass_filters: list[str]) -> None:
+def save_dimuon_masses(
+    evts: Events,
+    list_of_dimuons_mass_filters: list[str],
+    writer: Optional[OutputWriter] = None,
+    chunk: Optional[str] = None,
+) -> str:
+    """Save the masses of the dimuons of the events passing `list_of_dimuons_mass_filters` (in the background, if a `writer` is given). Returns the output file name.
+
+    The file is named after the `chunk` ID (see `output_writer.chunk_id`; a random token if `None`).
+    """
 
     dimuons = evts.events.dimuons[
         evts.filters.all(*list_of_dimuons_mass_filters),
     ]
     dimuons_mass = safe_mass(dimuons["0"] + dimuons["1"])
 
-    dimuons_mass_filename = f"outputs/buffer/dimuons_mass_{evts.dataset}_{evts.year}_{secrets.token_hex(nbytes=20)}.root"
-    with uproot.recreate(dimuons_mass_filename) as f:
-        f["dimuons_masses"] = {"mass": ak.flatten(dimuons_mass)}
-
+    output_format = configured_output_format()
+    dimuons_mass_filename = f"outputs/buffer/dimuons_mass_{evts.dataset}_{evts.year}_{chunk or secrets.token_hex(nbytes=20)}{output_format.extension}"
+    trees = {"dimuons_masses": {"mass": ak.flatten(dimuons_mass)}}
+    if writer:
+        return writer.write(dimuons_mass_filename, trees, output_format)
+    write_trees(dimuons_mass_filename, trees, output_format)
+    return dimuons_mass_filename
 
-def save_events(evts: Events, prefix: str, list_of_filters: list[str]) -> None:
-    """Save kinematical information of selected events."""
-    selection_filter = evts.filters.all(*list_of_filters)
-    selected_events = evts.events[selection_filter]
 
-    boson = selected_events.boson
-    upsilon = selected_events.upsilon
-    photon = selected_events.photon
-    mu_1 = selected_events.mu_1
-    mu_2 = selected_events.mu_2
-
-    output_filename = f"outputs/buffer/{prefix}_{evts.dataset}_{evts.year}_{secrets.token_hex(nbytes=20)}.root"
+def events_buffer(evts: Events, selection_filter: np.ndarray) -> dict[str, ArrayLike]:
+    """Kinematical information and weights of the events in `selection_filter` (boolean, or indices), as saved by `save_events`."""
     buffer = {
-        "boson_mass": ak.flatten(safe_mass(boson)),
-        "boson_pt": ak.flatten(boson.pt),
-        "boson_eta": ak.flatten(boson.eta),
-        "boson_phi": ak.flatten(boson.phi),
-        "upsilon_mass": ak.flatten(safe_mass(upsilon)),
-        "upsilon_pt": ak.flatten(upsilon.pt),
-        "upsilon_eta": ak.flatten(upsilon.eta),
-        "upsilon_phi": ak.flatten(upsilon.phi),
-        "photon_mass": ak.flatten(photon.mass),
-        "photon_pt": ak.flatten(photon.pt),
-        "photon_eta": ak.flatten(photon.eta),
-        "photon_phi": ak.flatten(photon.phi),
-        "mu_1_mass": ak.flatten(mu_1.mass),
-        "mu_1_pt": ak.flatten(mu_1.pt),
-        "mu_1_eta": ak.flatten(mu_1.eta),
-        "mu_1_phi": ak.flatten(mu_1.phi),
-        "mu_2_mass": ak.flatten(mu_2.mass),
-        "mu_2_pt": ak.flatten(mu_2.pt),
-        "mu_2_eta": ak.flatten(mu_2.eta),
-        "mu_2_phi": ak.flatten(mu_2.phi),
-        "delta_eta_upsilon_photon": ak.flatten(np.absolute(upsilon.eta - photon.eta)),
-        "delta_phi_upsilon_photon": ak.flatten(np.absolute(upsilon.delta_phi(photon))),
-        "delta_r_upsilon_photon": ak.flatten(upsilon.delta_r(photon)),
-        "weight": evts.weights.weight()[selection_filter],
+        f"{name}_{quantity}": ak.flatten(
+            evts.kinematics(quantity, name)[selection_filter]
+        )
+        for name in ["boson", "upsilon", "photon", "mu_1", "mu_2"]
+        for quantity in ["mass", "pt", "eta", "phi"]
     }
-    for w in evts.weights.names:
-        buffer[f"weight_{w}"] = evts.weights.individual_weight(w)[selection_filter]
-
-    with uproot.recreate(output_filename) as f:
-        f["Events"] = buffer
-
-
-def two_powers(num):
-    return [ 1 << idx for idx in range(num.bit_length()) if num & (1 << idx) ]
-
-def save_events_trigg(evts: Events, prefix: str, list_of_filters: list[str]) -> None:
-    """Save kinematical information of selected events."""
-    selection_filter = evts.filters.all(*list_of_filters)
-    selected_events = evts.events[selection_filter]
-
-    probe_photon = selected_events.probe_photon
-    probe_muon = selected_events.probe_muon
-    tag_muon = selected_events.tag_muon 
-    TrigObjs = selected_events.TrigObjs
-
-    output_filename = f"outputs_trigg/buffer/{prefix}_{evts.dataset}_{evts.year}_{secrets.token_hex(nbytes=20)}.root"
-
-    # GOOD PROBE MUON
-
-'''
-testing by hand:
-import uproot
-import awkward as ak
-import numpy as np
-f = uproot.open('step0NANOAOD_trg.root:Events')
-eta = (ak.cartesian([f['Muon_eta'].arrays()['Muon_eta'],f['TrigObj_eta'].arrays()['TrigObj_eta']], nested=True))
-delta = abs(eta["0"]-eta["1"])
-delta = ak.flatten(delta[ak.argsort(delta, ascending=True)][:,:,:1], axis=2)
-'''
-
-    deltaR_probe_muon_combinations = ak.cartesian([probe_muon,TrigObjs], nested=True)
-    deltaR_probe_muon_all = (deltaR_probe_muon_combinations["0"]).delta_r(deltaR_probe_muon_combinations["1"])
-    deltaR_probe_muon_sort = ak.flatten(deltaR_probe_muon_all[ak.argsort(deltaR_probe_muon_all, ascending=True)][:,:,:1], axis=2) #retornando so menor dr para cada muon 
-    TrigObj_probe_muon_id = ak.flatten(TrigObjs.id[[ak.argsort(deltaR_probe_muon_all, ascending=True)[:,:,:1]], axis=2) == 13
-    TrigObj_probe_muon_filterBits = two_powers(ak.flatte(TrigObjs.filterBits[ak.argsort(deltaR_probe_muon_all, ascending=True)[:,:,:1]], axis=2)))
-    TrigObj_probe_muon_filterBits_bool = [x in [32] for x in TrigObj_probe_muon_filterBits]  
-    good_probe_muon = deltaR_probe_muon_sort < 0.1 && TrigObj_probe_muon_id && TrigObj_probe_muon_filterBits_bool
-
-
-    buffer = {
-#        "probe_photon_mass": ak.flatten(probe_photon.mass),
-#        "probe_photon_pt": ak.flatten(probe_photon.pt),
-#        "probe_photon_eta": ak.flatten(probe_photon.eta),
-#        "probe_photon_phi": ak.flatten(probe_photon.phi),
-#        "tag_muon_mass": ak.flatten(tag_muon.mass),
-#        "tag_muon_pt": ak.flatten(tag_muon.pt),
-#        "tag_muon_eta": ak.flatten(tag_muon.eta),
-#        "tag_muon_phi": ak.flatten(tag_muon.phi),
-        "probe_muon_mass": ak.flatten(probe_muon.mass),
-        "probe_muon_pt": ak.flatten(probe_muon.pt),
-        "probe_muon_eta": ak.flatten(probe_muon.eta),
-        "probe_muon_phi": ak.flatten(probe_muon.phi),
-#        "weight": evts.weights.weight()[selection_filter],
-#	"triplet_weight": ?? 
-#        "good_probe": ak.flatten(good_probe_muon and good_probe_photon)
-        "good_probe_muon": ak.flatten(good_probe_muon)
-#        "good_probe_photon": ak.flatten(TrigObj_id_photon and deltaR_photon and filterBits_photon)
+    buffer.update(
+        {
+            f"{quantity}_upsilon_photon": ak.flatten(
+                evts.kinematics(quantity, "upsilon", "photon")[selection_filter]
+            )
+            for quantity in ["delta_eta", "delta_phi", "delta_r"]
+        }
+    )
+    buffer["weight"] = evts.weights.weight()[selection_filter]
+    buffer.update(
+        {
+            f"weight_{w}": weight
+            for w, weight in zip(
+                evts.weights.names,
+                evts.weights.individual_weights(selection_filter).T,
+            )
+        }
+    )
+    return buffer
+
+
+def save_events(
+    evts: Events,
+    prefix: str,
+    selection_filter: np.ndarray,
+    writer: Optional[OutputWriter] = None,
+    chunk: Optional[str] = None,
+) -> str:
+    """Save kinematical information of the events in `selection_filter` (in the background, if a `writer` is given). Returns the output file name.
+
+    `selection_filter` is either boolean or the indices of the events (e.g. `EventFilters.indices`).
+    The file is named after the `chunk` ID (see `output_writer.chunk_id`; a random token if `None`).
+    """
+    output_format = configured_output_format()
+    output_filename = f"outputs/buffer/{prefix}_{evts.dataset}_{evts.year}_{chunk or secrets.token_hex(nbytes=20)}{output_format.extension}"
+    trees = {"Events": events_buffer(evts, selection_filter)}
+    if writer:
+        return writer.write(output_filename, trees, output_format)
+    write_trees(output_filename, trees, output_format)
+    return output_filename
+
+
+def event_index(
+    evts: Events, selection_filter: np.ndarray, metadata: dict[str, Any]
+) -> dict[str, np.ndarray]:
+    """Event IDs of the events in `selection_filter`, with the UUID of their file (as two 64 bits halves) and their entry in it, sorted by event ID.
+
+    `selection_filter` is either boolean or the indices of the events.
+    `metadata` is the (coffea) metadata of the chunk, starting at its `entrystart` entry of the `fileuuid` file.
+    """
+    if selection_filter.dtype == np.bool_:
+        selection_filter = np.flatnonzero(selection_filter)
+    entries = selection_filter + metadata.get("entrystart", 0)
+    file_uuid = uuid.UUID(metadata["fileuuid"]).int if "fileuuid" in metadata else 0
+    index = {
+        "run": ak.to_numpy(evts.events.run[selection_filter]).astype(np.uint32),
+        "luminosityBlock": ak.to_numpy(
+            evts.events.luminosityBlock[selection_filter]
+        ).astype(np.uint32),
+        "event": ak.to_numpy(evts.events.event[selection_filter]).astype(np.uint64),
+        "file_uuid_high": np.full(len(entries), file_uuid >> 64, dtype=np.uint64),
+        "file_uuid_low": np.full(
+            len(entries), file_uuid & (2**64 - 1), dtype=np.uint64
+        ),
+        "entry": entries.astype(np.int64),
     }
-    for w in evts.weights.names:
-        buffer[f"weight_{w}"] = evts.weights.individual_weight(w)[selection_filter]
+    order = np.lexsort((index["event"], index["luminosityBlock"], index["run"]))
+    return {name: column[order] for name, column in index.items()}
 
-    with uproot.recreate(output_filename) as f:
-        f["Events"] = buffer
+
+def save_event_index(
+    evts: Events,
+    prefix: str,
+    selection_filter: np.ndarray,
+    metadata: dict[str, Any],
+    writer: Optional[OutputWriter] = None,
+) -> str:
+    """Save the index (see `event_index`) of the events in `selection_filter`, saved under `prefix` (in the background, if a `writer` is given). Returns the output file name.
+
+    The file is named after the ID of the chunk (see `output_writer.chunk_id`).
+    """
+    output_format = configured_output_format()
+    output_filename = f"outputs/buffer/event_index_{prefix}_{evts.dataset}_{evts.year}_{chunk_id(metadata)}{output_format.extension}"
+    trees = {"EventIndex": event_index(evts, selection_filter, metadata)}
+    if writer:
+        return writer.write(output_filename, trees, output_format)
+    write_trees(output_filename, trees, output_format)
+    return output_filename
 
 
 def fill_cutflow(
-    accumulator: Accumulatable,
+    accumulator: dict[str, Accumulatable],
     evts: Events,
     key: str,
-    variation: str,
-    list_of_weights: list[str],
-    list_of_filters: list[str],
+    weights: np.ndarray,
 ) -> None:
-    accumulator[key][
-        f"{evts.dataset}_{evts.year}"
-    ] = evts.weights.partial_weight_with_variation(
-        variation_name=variation, include=list_of_weights
-    )[
-        evts.filters.all(*list_of_filters)
-    ].sum()
+    """Fill `accumulator[variation][key]` with the sums of `weights` (selected events x `evts.weights.variation_names`, see `EventWeights.variation_weights`)."""
+    for variation, sum_of_weights in zip(
+        evts.weights.variation_names, weights.sum(axis=0)
+    ):
+        accumulator[variation][key][f"{evts.dataset}_{evts.year}"] = sum_of_weights
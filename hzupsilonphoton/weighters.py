@@ -1,9 +1,11 @@
 import json
 from typing import Union
 
+import awkward as ak
 from numpy.typing import ArrayLike
 
-from hzupsilonphoton.events import Events
+from hzupsilonphoton.events import ConstantWeight, Events
+from hzupsilonphoton.polarization import is_polarization_sample, lookup_factors
 from hzupsilonphoton.scale_factors.l1prefiring_sf import l1prefiring_weights
 from hzupsilonphoton.scale_factors.muon_sf import muon_id_weights, muon_iso_weights
 from hzupsilonphoton.scale_factors.photon_sf import (
@@ -14,7 +16,7 @@ from hzupsilonphoton.scale_factors.pu_weight import pu_weights
 from samples.lumis import lumis
 from samples.xsecs import x_section
 
-Weight = Union[tuple[ArrayLike, ArrayLike, ArrayLike], ArrayLike]
+Weight = Union[tuple[ArrayLike, ArrayLike, ArrayLike], ArrayLike, ConstantWeight]
 
 
 def pileup_weight(
@@ -22,7 +24,7 @@ def pileup_weight(
 ) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         nominal = pu_weights(evts.events.Pileup.nTrueInt, evts.year, syst_var="nominal")
         up = pu_weights(evts.events.Pileup.nTrueInt, evts.year, syst_var="plus")
@@ -33,7 +35,7 @@ def pileup_weight(
 def generator_weight(evts: Events) -> Weight:
     # if MC, get gen weights
     if evts.data_or_mc == "data":
-        return evts.ones
+        return ConstantWeight()
     else:
         # gets weights per event (from gen analysis output)
         gen_output_filename = "outputs/gen_output.json"
@@ -52,10 +54,26 @@ def generator_weight(evts: Events) -> Weight:
         )
 
 
+def polarization_weight(evts: Events) -> Weight:
+    # if signal MC, get the upsilon polarization reweighting factors (from gen analysis output)
+    if evts.data_or_mc == "data" or not is_polarization_sample(evts.dataset):
+        return ConstantWeight()
+    else:
+        factors = lookup_factors(
+            evts.dataset,
+            ak.to_numpy(evts.events.luminosityBlock),
+            ak.to_numpy(evts.events.event),
+        )
+        if factors is None:
+            # no generator level output for this dataset: unpolarized
+            return ConstantWeight()
+        return factors["nominal"], factors["up"], factors["down"]
+
+
 def l1prefr_weights(evts: Events) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         nominal = l1prefiring_weights(
             evts.events, evts.length, evts.year, syst_var="nominal"
@@ -70,7 +88,7 @@ def l1prefr_weights(evts: Events) -> Weight:
 def muon_id_weight(evts: Events) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         mu_1 = evts.events.bosons_combinations["0"]["0"]
         mu_2 = evts.events.bosons_combinations["0"]["1"]
@@ -84,7 +102,7 @@ def muon_id_weight(evts: Events) -> Weight:
 def muon_iso_weight(evts: Events) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         mu_1 = evts.events.bosons_combinations["0"]["0"]
         mu_2 = evts.events.bosons_combinations["0"]["1"]
@@ -98,7 +116,7 @@ def muon_iso_weight(evts: Events) -> Weight:
 def photon_id_weight(evts: Events) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         photon = evts.events.bosons_combinations["1"]
 
@@ -111,7 +129,7 @@ def photon_id_weight(evts: Events) -> Weight:
 def photon_electron_veto_weight(evts: Events) -> Weight:
     # if MC, get pu weights
     if evts.data_or_mc == "data":
-        return (evts.ones, evts.ones, evts.ones)
+        return ConstantWeight()
     else:
         photon = evts.events.bosons_combinations["1"]
 
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import atexit
+import concurrent.futures
+import multiprocessing
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# modules imported once by the fork server, and inherited by every worker forked from it
+PRELOADED_MODULES = [
+    "awkward",
+    "numpy",
+    "uproot",
+    "coffea.processor",
+    "coffea.nanoevents",
+    "hzupsilonphoton.analyzer",
+    "hzupsilonphoton.analyzer_scan",
+    "hzupsilonphoton.gen_analyzer",
+    "hzupsilonphoton.output_merger",
+]
+
+_shared_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+_shared_pool_workers = 0
+
+
+def setup_worker() -> None:
+    """Load, once per worker process and before its first chunk, what the analysis otherwise loads on first use.
+
+    That is the configuration, the scale factors and pileup histograms, and the sequences of the
+    analyzers (with the modules they import).
+    """
+    from hzupsilonphoton import forward_events  # noqa: F401
+    from hzupsilonphoton.config import load_config
+    from hzupsilonphoton.scale_factors import muon_sf, photon_sf, pu_weight
+
+    load_config()
+    muon_sf.evaluator()
+    photon_sf.evaluator()
+    pu_weight.pu_histograms()
+
+
+def worker_pool(workers: int) -> concurrent.futures.ProcessPoolExecutor:
+    """Warm process pool of this process (CLI invocation), shared by all its stages (gen, main, scan, merge).
+
+    It is created on first use, with `workers` processes (later calls reuse it, whatever their `workers`),
+    and shut down at exit. Workers are forked from a fork server that has imported `PRELOADED_MODULES`,
+    and run `setup_worker` when they start. It is passed as the `pool` of coffea's futures executor,
+    which then neither creates nor shuts down a pool of its own.
+    """
+    global _shared_pool, _shared_pool_workers
+    if _shared_pool is None:
+        context = None
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOADED_MODULES)
+        _shared_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=setup_worker
+        )
+        _shared_pool_workers = workers
+        atexit.register(_shared_pool.shutdown)
+    return _shared_pool
+
+
+def _run_and_wait(function: Callable[[], T], barrier: Any) -> T:
+    result = function()
+    barrier.wait()
+    return result
+
+
+def run_on_workers(function: Callable[[], T]) -> list[T]:
+    """Run `function` (picklable) once in each worker of the shared pool, and return their results (none if the pool was not created).
+
+    Every worker waits at a barrier after running it, so that none of them takes a second call while another one gets none.
+    """
+    if _shared_pool is None:
+        return []
+    with multiprocessing.Manager() as manager:
+        barrier = manager.Barrier(_shared_pool_workers)
+        return list(
+            _shared_pool.map(
+                _run_and_wait,
+                [function] * _shared_pool_workers,
+                [barrier] * _shared_pool_workers,
+            )
+        )
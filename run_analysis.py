@@ -4,18 +4,12 @@
 import json
 import os
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 import typer
-from coffea import processor
-from coffea.nanoevents import NanoAODSchema
-from tqdm import tqdm
 
-from hzupsilonphoton.analyzer import Analyzer
-from hzupsilonphoton.gen_analyzer import GenAnalyzer
-from hzupsilonphoton.output_merger import output_merger
-from hzupsilonphoton.utils import file_tester
-from samples.samples_details import mc_samples_files, samples, samples_files
+# analysis modules (coffea, uproot, scale factors, ...) are imported by the commands that need them,
+# so that the CLI starts fast (see `startup`)
 
 # create typer app
 help_str = """
@@ -42,9 +36,14 @@ app = typer.Typer(help=typer.style(help_str, fg=typer.colors.BRIGHT_BLUE, bold=T
 @app.command()
 def test_files() -> None:
     """Test uproot.open each sample file."""
+    from tqdm import tqdm
+
+    from hzupsilonphoton.utils import file_tester
+    from samples.samples_details import sample_files, samples
+
     files = []
     for s in samples:
-        for f in samples[s]["files"]:
+        for f in sample_files(s):
             files.append(f)
     for f in tqdm(files):
         file_tester(f)
@@ -59,8 +58,19 @@ def clear() -> None:
 
 
 @app.command()
-def gen() -> None:
+def gen(workers: int = 60) -> None:
     """Run gen level analysis and saves outputs."""
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+
+    from hzupsilonphoton.gen_analyzer import GenAnalyzer
+    from hzupsilonphoton.polarization import (
+        POLARIZATION_DIR,
+        save_polarization,
+        save_polarization_histograms,
+    )
+    from hzupsilonphoton.worker import worker_pool
+    from samples.samples_details import mc_samples_files
 
     os.system("rm -rf outputs/gen_output.json")
     os.system("mkdir -p outputs/")
@@ -73,7 +83,7 @@ def gen() -> None:
         processor_instance=GenAnalyzer(),
         executor=processor.futures_executor,
         # executor = processor.iterative_executor,
-        executor_args={"schema": NanoAODSchema, "workers": 60},
+        executor_args={"schema": NanoAODSchema, "pool": worker_pool(workers)},
         # executor_args = {"schema": NanoAODSchema},
         # chunksize =
         # maxchunks = 100,
@@ -81,6 +91,13 @@ def gen() -> None:
 
     # save gen level outputs
     print("\n\n\n--> Saving GEN level output...")
+    # not among the outputs cleared by `merge`, which runs after it in `all`
+    save_polarization_histograms(
+        gen_output.pop("polarization").histogram,
+        "outputs/polarization_histograms.root",
+    )
+    os.system(f"rm -rf {POLARIZATION_DIR}")
+    save_polarization(gen_output.pop("polarization_factors"))
     gen_output_filename = "outputs/gen_output.json"
     os.system(f"rm -rf {gen_output_filename}")
     # create json object from dictionary
@@ -93,19 +110,58 @@ class CoffeaExecutors(str, Enum):
     iterative = "iterative"
 
 
+class CandidateBuilders(str, Enum):
+    awkward = "awkward"
+    numba = "numba"
+
+
 @app.command()
 def main(
     maxchunks: Optional[int] = -1,  # default -1
     executor: CoffeaExecutors = CoffeaExecutors.futures,
     workers: int = 60,  # default 60
+    candidate_builder: CandidateBuilders = CandidateBuilders.awkward,
+    skim_dir: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_gb: Optional[float] = None,
+    speculation_factor: float = 3.0,
+    telemetry: Optional[str] = "outputs/telemetry.json",
+    telemetry_interval: float = 10.0,
 ) -> None:
-    """Run main analysis and saves outputs."""
-
-    executor_args = {"schema": NanoAODSchema, "workers": workers}
-    if executor.value == "interative":
-        executor_args = {"schema": NanoAODSchema}
-
-    executor = getattr(processor, f"{executor.value}_executor")
+    """Run main analysis and saves outputs.
+
+    With `--skim-dir`, preselected events are cached there, and reused by the next runs as long as the upstream code and configuration do not change.
+    With `--cache-dir`, the results of each chunk are cached there (up to `--cache-max-gb`, default: `chunk_cache.DEFAULT_MAX_GB`), and reused by the next runs for unchanged chunks.
+    With the futures executor, chunks running longer than `--speculation-factor` times the median of their dataset are re-executed on idle workers (0: disabled).
+    With the futures executor, the progress of the run (per dataset: chunks done and remaining, events/s, bytes read, CPU fraction and ETA; worker utilization and peak memory) is written to `--telemetry` every `--telemetry-interval` seconds (see `./run_analysis.py telemetry`).
+    """
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+
+    from hzupsilonphoton.analyzer import Analyzer
+    from hzupsilonphoton.chunk_cache import DEFAULT_MAX_GB, ChunkCache
+    from hzupsilonphoton.output_writer import flush_output_writers
+    from hzupsilonphoton.regions import save_region_histograms
+    from hzupsilonphoton.speculative_executor import SpeculativeFuturesExecutor
+    from hzupsilonphoton.worker import worker_pool
+    from samples.samples_details import samples_files
+
+    executor_args = {"schema": NanoAODSchema}
+    if executor.value == "futures":
+        executor_args["pool"] = worker_pool(workers)
+
+    # re-execute the straggler chunks and write the run telemetry (see `speculative_executor`)
+    with_telemetry = executor.value == "futures" and bool(telemetry)
+    if executor.value == "futures":
+        executor = SpeculativeFuturesExecutor
+        executor_args["speculation_factor"] = speculation_factor
+        if with_telemetry:
+            executor_args["telemetry"] = telemetry
+            executor_args["telemetry_interval"] = telemetry_interval
+            # bytes read per chunk
+            executor_args["savemetrics"] = True
+    else:
+        executor = getattr(processor, f"{executor.value}_executor")
 
     if maxchunks == -1:
         maxchunks = None
@@ -119,7 +175,13 @@ def main(
     output = processor.run_uproot_job(
         fileset=samples_files,
         treename="Events",
-        processor_instance=Analyzer(),
+        processor_instance=Analyzer(
+            candidate_builder=candidate_builder.value,
+            skim_dir=skim_dir,
+            cache=ChunkCache(cache_dir, cache_max_gb or DEFAULT_MAX_GB)
+            if cache_dir
+            else None,
+        ),
         # executor=processor.futures_executor,
         # executor = processor.iterative_executor,
         executor=executor,
@@ -128,27 +190,163 @@ def main(
         # chunksize =
         maxchunks=maxchunks,
     )
+    if with_telemetry:
+        output, _ = output
+
+    # wait for the output files still being written in the background (see `output_writer`)
+    write_errors = {**output.pop("write_errors", {}), **flush_output_writers()}
 
     # save outputs
     print("\n\n\n--> saving output...")
+    save_region_histograms(
+        output.pop("regions").histogram, "outputs/region_histograms.root"
+    )
     output_filename = "outputs/cutflow.json"
     os.system(f"rm -rf {output_filename}")
     # pprint(output)
     with open(output_filename, "w") as f:
         f.write(json.dumps(output))
 
+    if write_errors:
+        print("\n\n\n--> Output files write errors:")
+        for filename, error in write_errors.items():
+            print(f"    {filename}: {error}")
+        raise typer.Exit(code=1)
+
 
 @app.command()
-def merge() -> None:
+def telemetry(
+    filename: str = "outputs/telemetry.json",
+    follow: bool = False,
+    interval: float = 10.0,
+) -> None:
+    """Print the telemetry of the running (or last) main analysis: per dataset progress, events/s, bytes read, CPU fraction (low when I/O bound) and ETA. With `--follow`, print it again every `--interval` seconds."""
+    import time
+
+    from hzupsilonphoton.telemetry import format_telemetry
+
+    while True:
+        if not os.path.isfile(filename):
+            print(f"--> No telemetry file: {filename}")
+            raise typer.Exit(code=1)
+        with open(filename) as f:
+            print(format_telemetry(json.load(f)))
+        if not follow:
+            break
+        time.sleep(interval)
+        print()
+
+
+@app.command()
+def scan(
+    maxchunks: Optional[int] = -1,  # default -1
+    executor: CoffeaExecutors = CoffeaExecutors.futures,
+    workers: int = 60,  # default 60
+) -> None:
+    """Run the cut optimization scan (grid of signal selection thresholds in config) and saves the yields and significance of every grid point."""
+    from coffea import processor
+    from coffea.nanoevents import NanoAODSchema
+
+    from hzupsilonphoton.analyzer_scan import Analyzer_Scan
+    from hzupsilonphoton.config import config
+    from hzupsilonphoton.cut_optimization import best_thresholds, save_significance_maps
+    from hzupsilonphoton.worker import worker_pool
+    from samples.samples_details import samples, samples_files
+
+    executor_args = {"schema": NanoAODSchema}
+    if executor.value == "futures":
+        executor_args["pool"] = worker_pool(workers)
+
+    executor = getattr(processor, f"{executor.value}_executor")
+
+    if maxchunks == -1:
+        maxchunks = None
+
+    # only data (background) and signal samples are needed
+    fileset = {
+        sample: files
+        for sample, files in samples_files.items()
+        if samples[sample]["data_or_mc"] == "data"
+        or any(
+            sample.startswith(prefix)
+            for prefixes in config.cut_optimization.signals.values()
+            for prefix in prefixes
+        )
+    }
+
+    # run scan
+    print("\n\n\n--> Running cut optimization scan...")
+    output = processor.run_uproot_job(
+        fileset=fileset,
+        treename="Events",
+        processor_instance=Analyzer_Scan(),
+        executor=executor,
+        executor_args=executor_args,
+        maxchunks=maxchunks,
+    )
+
+    # save yields and significance maps
+    print("\n\n\n--> saving output...")
+    os.system("mkdir -p outputs/")
+    save_significance_maps(output["maps"], "outputs/cut_optimization.root")
+    for signal in config.cut_optimization.signals:
+        if f"significance_{signal}" in output["maps"]:
+            print(
+                f"--> Best thresholds ({signal}): {best_thresholds(output['maps'], signal)}"
+            )
+
+
+@app.command()
+def merge(workers: int = 60) -> None:
     """Merge the many outputs."""
-    os.system("rm -rf outputs/*.root")
+    from hzupsilonphoton.output_merger import output_merger
+    from hzupsilonphoton.worker import worker_pool
+
+    # outputs of a previous merge only: the histograms of `gen` and `main` (in outputs/ too) are kept
+    os.system(
+        "rm -rf outputs/dimuons_mass_* outputs/preselected_* outputs/selected_* outputs/event_index_*"
+    )
 
     print("\n\n\n--> Merging analysis outputs...")
-    merger_log = output_merger()
+    merger_log = output_merger(pool=worker_pool(workers))
     with open("outputs/output_merger.log", "w") as f:
         f.write(merger_log)
 
 
+@app.command()
+def pick_events(
+    ids: Optional[List[str]] = typer.Argument(None, help="run:lumi:event"),
+    ids_file: Optional[str] = None,
+    output: str = "outputs/picked_events.root",
+    region_output: str = "selected_events",
+) -> None:
+    """Extract the full NanoAOD events of a list of event IDs (`run:lumi:event`, as arguments or one per line of `--ids-file`), found in the merged event index of a region output."""
+    from hzupsilonphoton.pick_events import parse_event_id
+    from hzupsilonphoton.pick_events import pick_events as _pick_events
+
+    event_ids = list(ids or [])
+    if ids_file:
+        with open(ids_file) as f:
+            event_ids += [line for line in f if line.strip()]
+    if not event_ids:
+        raise typer.BadParameter("No event ID given.")
+
+    print(f"\n\n\n--> Picking {len(event_ids)} events...")
+    missing = _pick_events(
+        [parse_event_id(event_id) for event_id in event_ids],
+        output,
+        output=region_output,
+    )
+    if len(missing) == len(event_ids):
+        print("\n\n\n--> No event found.")
+        raise typer.Exit(code=1)
+    print(f"\n\n\n--> Saved {len(event_ids) - len(missing)} events to {output}.")
+    if len(missing):
+        print("--> Not found:")
+        for run, luminosity_block, event in missing:
+            print(f"    {run}:{luminosity_block}:{event}")
+
+
 @app.command()
 def plot() -> None:
     """Run plotter function."""
@@ -164,10 +362,151 @@ def plot() -> None:
     # os.system("root -l -b -q plotter/make_plot_2d_ver2.C")
 
 
-@app.callback(invoke_without_command=True)
-def _all(debug: bool = False) -> None:
-    """Run default workflow (CLEAR \n\n\n--> GEN \n\n\n--> MAIN \n\n\n--> MERGE)."""
+@app.command()
+def benchmark(
+    chunk_sizes: List[int] = typer.Option([1000, 10000, 100000]),
+    repeats: int = 3,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    names: Optional[List[str]] = typer.Option(None),
+    output: Optional[str] = None,
+) -> None:
+    """Run micro-benchmarks of builders, filters and weighters, over synthetic events."""
+    from hzupsilonphoton.benchmarks import format_results, run_benchmarks
+
+    print("\n\n\n--> Running micro-benchmarks...")
+    results = run_benchmarks(
+        chunk_sizes=chunk_sizes, dataset=dataset, repeats=repeats, names=names
+    )
+    print(format_results(results))
+
+    if output:
+        with open(output, "w") as f:
+            f.write(json.dumps([r._asdict() for r in results], indent=2))
+
 
+@app.command()
+def output_formats(
+    n_events: int = 100000,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    region: str = "preselected",
+    repeats: int = 3,
+    output: Optional[str] = None,
+) -> None:
+    """Compare the output formats and compression codecs (size, write and read throughput) on the saved events of a region, over synthetic events."""
+    from hzupsilonphoton.benchmarks import (
+        format_output_format_results,
+        run_output_format_benchmarks,
+    )
+
+    print("\n\n\n--> Running output formats benchmarks...")
+    results = run_output_format_benchmarks(
+        n_events=n_events, dataset=dataset, region=region, repeats=repeats
+    )
+    print(format_output_format_results(results))
+
+    if output:
+        with open(output, "w") as f:
+            f.write(json.dumps([r._asdict() for r in results], indent=2))
+
+
+@app.command()
+def throughput(
+    n_events: int = 100000,
+    chunksize: int = 25000,
+    dataset: str = "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+    files: Optional[List[str]] = typer.Option(None),
+    history: str = "benchmarks/throughput_history.json",
+    baseline: str = "benchmarks/throughput_baseline.json",
+    tolerance: float = 0.1,
+    update_baseline: bool = False,
+    candidate_builder: CandidateBuilders = CandidateBuilders.awkward,
+) -> None:
+    """Measure the end-to-end throughput of the main analysis (synthetic events or local FILES) and compare it to the baseline. Exit code is 1 in case of regressions."""
+    from hzupsilonphoton.throughput import (
+        append_to_history,
+        compare_to_baseline,
+        format_measurement,
+        measure_throughput,
+    )
+
+    print("\n\n\n--> Measuring MAIN analysis throughput...")
+    measurement = measure_throughput(
+        n_events=n_events,
+        chunksize=chunksize,
+        dataset=dataset,
+        files=files,
+        candidate_builder=candidate_builder.value,
+    )
+    print(format_measurement(measurement))
+    append_to_history(measurement, history)
+
+    if update_baseline or not os.path.isfile(baseline):
+        print(f"\n\n\n--> Saving baseline: {baseline}")
+        os.makedirs(os.path.dirname(baseline) or ".", exist_ok=True)
+        with open(baseline, "w") as f:
+            f.write(json.dumps(measurement, indent=2))
+        return
+
+    with open(baseline) as f:
+        regressions = compare_to_baseline(measurement, json.load(f), tolerance)
+    if regressions:
+        print(f"\n\n\n--> Throughput regressions (tolerance: {tolerance:.0%}):")
+        for regression in regressions:
+            print(f"    {regression}")
+        raise typer.Exit(code=1)
+    print(f"\n\n\n--> No throughput regression (tolerance: {tolerance:.0%}).")
+
+
+@app.command()
+def validate_candidate_builder(
+    n_events: int = 100000,
+    datasets: List[str] = typer.Option(
+        [
+            "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018",
+            "Run2018A_2018",
+        ]
+    ),
+    candidate_builder: CandidateBuilders = CandidateBuilders.numba,
+) -> None:
+    """Check that a candidate builder backend gives, bit-for-bit, the same candidates as the awkward one, over synthetic events. Exit code is 1 if they differ."""
+    from hzupsilonphoton.benchmarks import compare_candidate_builders
+
+    print(f"\n\n\n--> Comparing {candidate_builder.value} and awkward candidates...")
+    differences = compare_candidate_builders(
+        n_events=n_events, datasets=datasets, candidate_builder=candidate_builder.value
+    )
+    if differences:
+        for difference in differences:
+            print(f"    {difference}")
+        raise typer.Exit(code=1)
+    print("\n\n\n--> Candidates are identical.")
+
+
+@app.command()
+def startup(
+    budget: float = 0.5,
+    repeats: int = 3,
+) -> None:
+    """Measure the startup time of every command (`<command> --help`). Exit code is 1 if any of them exceeds the budget (in seconds)."""
+    from hzupsilonphoton.startup import measure_startup, over_budget
+
+    print("\n\n\n--> Measuring CLI startup time...")
+    timings = measure_startup(
+        sorted(typer.main.get_command(app).commands), repeats=repeats
+    )
+    for command, seconds in timings.items():
+        print(f"    {command:<28}{seconds * 1e3:>8.0f} ms")
+
+    regressions = over_budget(timings, budget)
+    if regressions:
+        print(f"\n\n\n--> Startup over budget ({budget:.2f} s):")
+        for regression in regressions:
+            print(f"    {regression}")
+        raise typer.Exit(code=1)
+    print(f"\n\n\n--> Startup within budget ({budget:.2f} s).")
+
+
+def run_workflow(debug: bool = False) -> None:
     clear()
     gen()
     main()
@@ -176,11 +515,20 @@ def _all(debug: bool = False) -> None:
         plot()
 
 
+@app.callback(invoke_without_command=True)
+def _all(ctx: typer.Context, debug: bool = False) -> None:
+    """Run default workflow (CLEAR \n\n\n--> GEN \n\n\n--> MAIN \n\n\n--> MERGE)."""
+
+    # the callback also runs before any subcommand
+    if ctx.invoked_subcommand is None:
+        run_workflow(debug)
+
+
 @app.command()
 def all(debug: bool = False) -> None:
     """Run default workflow (CLEAR \n\n\n--> GEN \n\n\n--> MAIN \n\n\n--> MERGE)."""
 
-    _all(debug)
+    run_workflow(debug)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 
-import json
 import os
 from enum import Enum
 from typing import Optional
@@ -12,10 +11,9 @@ from coffea.nanoevents import NanoAODSchema
 from tqdm import tqdm
 
 from hzupsilonphoton.analyzer_trigg import Analyzer_Trigg
-#from hzupsilonphoton.gen_analyzer import GenAnalyzer
-#from hzupsilonphoton.output_merger import output_merger
+from hzupsilonphoton.trigger_efficiency import save_efficiency_maps
 from hzupsilonphoton.utils import file_tester
-from samples.samples_details import mc_samples_files, samples, samples_files
+from samples.samples_details import sample_files, samples, samples_files
 
 # create typer app
 help_str = """
@@ -32,12 +30,12 @@ Usual workflow:\n
 app = typer.Typer(help=typer.style(help_str, fg=typer.colors.BRIGHT_BLUE, bold=True))
 
 
-@app.command() #mudar samples para samples_Trigg
+@app.command()  # mudar samples para samples_Trigg
 def test_files() -> None:
     """Test uproot.open each sample file."""
     files = []
     for s in samples:
-        for f in samples[s]["files"]:
+        for f in sample_files(s):
             files.append(f)
     for f in tqdm(files):
         file_tester(f)
@@ -48,7 +46,7 @@ def clear() -> None:
     """Clear outputs."""
 
     os.system("rm -rf outputs_Trigg/*")
-    os.system("mkdir -p outputs_Trigg/buffer")
+    os.system("mkdir -p outputs_Trigg")
 
 
 class CoffeaExecutors(str, Enum):
@@ -64,18 +62,16 @@ def main(
 ) -> None:
     """Run Trigg analysis and saves outputs."""
 
-    executor_args = {"schema": NanoAODSchema, "workers": workers}
-    if executor.value == "interative":
-        executor_args = {"schema": NanoAODSchema}
+    executor_args = {"schema": NanoAODSchema}
+    if executor.value == "futures":
+        executor_args["workers"] = workers
 
     executor = getattr(processor, f"{executor.value}_executor")
 
     if maxchunks == -1:
         maxchunks = None
 
-    # clear buffers
-    os.system("rm -rf outputs_Trigg/buffer")
-    os.system("mkdir -p outputs_Trigg/buffer")
+    os.system("mkdir -p outputs_Trigg")
 
     # run analysis
     print("\n\n\n--> Running Trigg level analysis...")
@@ -92,13 +88,11 @@ def main(
         maxchunks=maxchunks,
     )
 
-    # save outputs
+    # save trigger efficiency and scale factor maps
     print("\n\n\n--> saving output...")
-    output_filename = "outputs_Trigg/cutflow.json"
+    output_filename = "outputs_Trigg/trigger_efficiencies.root"
     os.system(f"rm -rf {output_filename}")
-    # pprint(output)
-    with open(output_filename, "w") as f:
-        f.write(json.dumps(output))
+    save_efficiency_maps(output["maps"], output_filename)
 
 
 if __name__ == "__main__":
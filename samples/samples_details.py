@@ -1,9 +1,13 @@
+from __future__ import annotations
+
+import functools
 from glob import glob
-from typing import TypedDict
+from typing import Any, Optional, TypedDict
 
 
 class Sample(TypedDict):
-    files: list[str]
+    # glob pattern of the files (see `sample_files`)
+    files_pattern: str
     year: str
     data_or_mc: str
 
@@ -12,104 +16,89 @@ class Sample(TypedDict):
 samples: dict[str, Sample] = {
     # Data
     "Run2018A_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/A/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/A/*.root",
         "year": "2018",
         "data_or_mc": "data",
     },
     "Run2018B_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/B/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/B/*.root",
         "year": "2018",
         "data_or_mc": "data",
     },
     "Run2018C_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/C/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/C/*.root",
         "year": "2018",
         "data_or_mc": "data",
     },
     "Run2018D_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/D/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/Data/2018/D/*.root",
         "year": "2018",
         "data_or_mc": "data",
     },
     # MC
     "ggH_HToUps1SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps1SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps1SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ggH_HToUps2SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps2SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps2SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ggH_HToUps3SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps3SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ggH_HToUps3SG_M125_NNPDF31_TuneCP5_13TeV-powheg-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "GluGluHToMuMuG_M125_MLL-0To60_Dalitz_012j_13TeV_amcatnloFXFX_pythia8_PSWeight_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/GluGluHToMuMuG_M125_MLL-0To60_Dalitz_012j_13TeV_amcatnloFXFX_pythia8_PSWeight/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/GluGluHToMuMuG_M125_MLL-0To60_Dalitz_012j_13TeV_amcatnloFXFX_pythia8_PSWeight/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ZGTo2MuG_MMuMu-2To15_TuneCP5_13TeV-madgraph-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZGTo2MuG_MMuMu-2To15_TuneCP5_13TeV-madgraph-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZGTo2MuG_MMuMu-2To15_TuneCP5_13TeV-madgraph-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon1SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ZToUpsilon2SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon2SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon2SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
     "ZToUpsilon3SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8_2018": {
-        "files": glob(
-            "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon3SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root"
-        ),
+        "files_pattern": "/eos/cms/store/user/ftorresd/HZUpsilonPhotonRun2/NanoAOD/MC/2018/ZToUpsilon3SGamma_TuneCP5_13TeV-amcatnloFXFX-pythia8/*.root",
         "year": "2018",
         "data_or_mc": "mc",
     },
 }
 
 
-# build samples files and descriptions
-samples_files = {}
-for sample in samples:
-    samples_files[sample] = samples[sample]["files"]
+@functools.lru_cache(maxsize=None)
+def sample_files(sample: str) -> list[str]:
+    """Files of `sample`, globbed on first use (EOS globs are slow: they are not done at import time)."""
+    return glob(samples[sample]["files_pattern"])
+
+
+def _samples_files(data_or_mc: Optional[str] = None) -> dict[str, list[str]]:
+    return {
+        sample: sample_files(sample)
+        for sample in samples
+        if data_or_mc in (None, samples[sample]["data_or_mc"])
+    }
 
-data_samples_files = {}
-for sample in samples:
-    if samples[sample]["data_or_mc"] == "data":
-        data_samples_files[sample] = samples[sample]["files"]
 
-mc_samples_files = {}
-for sample in samples:
-    if samples[sample]["data_or_mc"] == "mc":
-        mc_samples_files[sample] = samples[sample]["files"]
+def __getattr__(name: str) -> Any:
+    # files of all, data and MC samples (`samples_files`, `data_samples_files`, `mc_samples_files`), built on first use
+    if name == "samples_files":
+        return _samples_files()
+    if name == "data_samples_files":
+        return _samples_files("data")
+    if name == "mc_samples_files":
+        return _samples_files("mc")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")